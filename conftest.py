@@ -0,0 +1,318 @@
+"""Fakes of toggl and harvest, and the fixtures building sessions on them."""
+
+import csv
+import io
+import json
+import pathlib
+import threading
+import time
+from collections.abc import Callable
+
+import httpx
+import pytest
+import pytz
+
+import timesheetsync
+from timesheetsync import SyncSession, TogglProjectIndex, TogglSession, TokenAuth
+
+EMAIL = "ada@example.com"
+TOKEN = "0123456789abcdef0123456789abcdef"
+ME = {
+    "api_token": TOKEN,
+    "at": "2024-01-01T00:00:00+00:00",
+    "beginning_of_week": 1,
+    "created_at": "2020-01-01T00:00:00+00:00",
+    "default_workspace_id": 1,
+    "email": EMAIL,
+    "fullname": "Ada",
+    "has_password": True,
+    "id": 42,
+    "image_url": "https://example.com/ada.png",
+    "openid_enabled": False,
+    "timezone": "Europe/Amsterdam",
+    "toggl_accounts_id": "a" * 22,
+    "updated_at": "2024-01-01T00:00:00+00:00",
+    "authorization_updated_at": "2024-01-01T00:00:00+00:00",
+}
+# ada's harvest user, the one every fake session syncs to
+ADA = {"id": 7}
+SITE = {
+    "project": {"id": 100, "name": "Site"},
+    "client": {"id": 1, "name": "Acme"},
+    "task_assignments": [{"id": 5, "task": {"id": 200, "name": "Development"}}],
+}
+
+
+def as_json(entry: dict, row_number: int) -> dict:
+    return {
+        "billable": entry["billable"],
+        "billable_amount_in_cents": None,
+        "currency": "EUR",
+        "description": entry["description"],
+        "hourly_rate_in_cents": None,
+        "project_id": entry["project_id"],
+        "row_number": row_number,
+        "tag_ids": [],
+        "task_id": None,
+        "user_id": 1,
+        "username": "Ada",
+        "time_entries": [
+            {
+                "at": entry["stop"].isoformat(),
+                "at_tz": entry["stop"].isoformat(),
+                "id": entry["id"],
+                "seconds": entry["seconds"],
+                "start": entry["start"].isoformat(),
+                "stop": entry["stop"].isoformat(),
+            }
+        ],
+    }
+
+
+def as_csv(
+    entries: list[dict],
+    names: Callable[[str], tuple[str, str]],
+    running: bool = False,
+) -> bytes:
+    """The export of `entries`, naming each one's (client, project) by `names`."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(
+        ["User", "Email", "Client", "Project", "Task", "Description", "Billable"]
+        + ["Start date", "Start time", "End date", "End time", "Duration", "Tags"]
+    )
+    for entry in entries:
+        client, project = names(str(entry["project_id"]))
+        seconds = entry["seconds"]
+        writer.writerow(
+            ["Ada", EMAIL, client, project, "", entry["description"]]
+            + ["Yes" if entry["billable"] else "No"]
+            + entry["start"].strftime("%Y-%m-%d %H:%M:%S").split()
+            + entry["stop"].strftime("%Y-%m-%d %H:%M:%S").split()
+            + [
+                "{:02}:{:02}:{:02}".format(
+                    seconds // 3600, seconds // 60 % 60, seconds % 60
+                ),
+                "",
+            ]
+        )
+    if running:
+        # the timer still going when the report was exported
+        writer.writerow(
+            ["Ada", EMAIL, "", "", "", "ongoing", "No"]
+            + ["2024-01-01", "09:00:00", "", "", "", ""]
+        )
+    return out.getvalue().encode()
+
+
+class Chunked(httpx.SyncByteStream):
+    def __init__(self, body: bytes, size: int):
+        self.body = body
+        self.size = size
+
+    def __iter__(self):
+        for i in range(0, len(self.body), self.size):
+            yield self.body[i : i + self.size]
+
+
+class FakeTogglApi:
+    """The toggl api endpoints a session uses, counting requests.
+
+    Projects and clients are listed by workspace id, and the detailed report
+    has `entries`, exported as a csv (by default in tiny chunks, splitting rows
+    and characters) or searched a page at a time.
+    """
+
+    def __init__(
+        self,
+        entries=(),
+        projects=None,
+        clients=None,
+        latency=0.0,
+        csv_status=200,
+        chunk_size=7,
+        running=False,
+    ):
+        self.entries = list(entries)
+        self.projects: dict[int, list[dict]] = projects or {}
+        self.clients: dict[int, list[dict]] = clients or {}
+        self.latency = latency
+        self.csv_status = csv_status
+        self.chunk_size = chunk_size
+        self.running = running
+        self.requests: list[str] = []
+        self.in_flight = self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self.lock:
+            self.requests.append(request.url.path)
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return self.respond(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def names(self, project_id: str) -> tuple[str, str]:
+        for wid, projects in self.projects.items():
+            for project in projects:
+                if str(project["id"]) == project_id:
+                    clients = {c["id"]: c["name"] for c in self.clients.get(wid) or []}
+                    return clients.get(project["client_id"], ""), project["name"]
+        return "", ""
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith("/me"):
+            return httpx.Response(200, json=ME)
+        if path.endswith("/projects"):
+            projects = self.projects.get(int(path.split("/")[-2]), [])
+            page = int(request.url.params["page"])
+            per_page = int(request.url.params["per_page"])
+            return httpx.Response(
+                200, json=projects[(page - 1) * per_page : page * per_page]
+            )
+        if path.endswith("/clients"):
+            # workspaces without clients list as null
+            clients = self.clients.get(int(path.split("/")[-2]))
+            return httpx.Response(200, content=json.dumps(clients))
+        if "/search/time_entries" not in path:
+            return httpx.Response(404, json={})
+
+        payload = json.loads(request.content)
+        entries = [
+            e
+            for e in self.entries
+            if payload["start_date"]
+            <= e["start"].date().isoformat()
+            <= payload["end_date"]
+        ]
+        if path.endswith(".csv"):
+            if self.csv_status != 200:
+                return httpx.Response(self.csv_status, text="Not on your plan")
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/csv"},
+                stream=Chunked(
+                    as_csv(entries, self.names, self.running), self.chunk_size
+                ),
+            )
+
+        first = payload.get("first_row_number", 1) - 1
+        page = entries[first : first + payload.get("page_size", 50)]
+        return httpx.Response(
+            200, json=[as_json(e, first + i + 1) for i, e in enumerate(page)]
+        )
+
+
+class FakeToggl:
+    """Toggl as a sync session sees it, once its entries are patched in."""
+
+    cache_key = "toggl"
+
+    def __init__(self, tz=pytz.utc):
+        self.tz = tz
+
+    def timezone(self):
+        return self.tz
+
+    def project_index(self):
+        return TogglProjectIndex()
+
+
+class FakeHarvest:
+    """Harvest as a sync session sees it, with ada as its only user.
+
+    `time_entries` answers each listing's params. The account's projects and
+    task assignments are the active ones of ada's `project_assignments`.
+    """
+
+    account_id = "42"
+    cache_key = "42:ada"
+
+    def __init__(
+        self,
+        time_entries: Callable[[dict], list[dict]] = lambda _params: [],
+        project_assignments: list[dict] | None = None,
+    ):
+        self.time_entries = time_entries
+        self.project_assignments = project_assignments or [SITE]
+        self.posted = []
+        self.listed = []
+        self.lock = threading.Lock()
+
+    def get_users(self):
+        return [{"id": ADA["id"], "email": EMAIL}]
+
+    def get_time_entries(self, params=None):
+        return self.time_entries(params or {})
+
+    def get_user_project_assignments(self, user_id):
+        self.listed.append(user_id)
+        return self.project_assignments
+
+    def get_projects(self):
+        self.listed.append("projects")
+        return [
+            {"id": p["project"]["id"], "client": p["client"]}
+            for p in self.project_assignments
+        ]
+
+    def get_task_assignments(self):
+        self.listed.append("task_assignments")
+        return [
+            {"id": a["id"], "project": p["project"], "task": a["task"]}
+            for p in self.project_assignments
+            if p.get("is_active", True)
+            for a in p["task_assignments"]
+            if a.get("is_active", True)
+        ]
+
+    def post_all(self, url, data):
+        with self.lock:
+            self.posted.append(data)
+        return {"id": len(self.posted), **data}
+
+
+def fake_session(tmp_path: pathlib.Path, toggl=None, harvest=None) -> SyncSession:
+    """A sync session on the fakes, keeping its files under `tmp_path`."""
+    return SyncSession(
+        toggl or FakeToggl(),  # pyright: ignore[reportArgumentType]
+        harvest or FakeHarvest(),  # pyright: ignore[reportArgumentType]
+        fingerprint_file=tmp_path / "fingerprints",
+        stats_file=tmp_path / "stats",
+    )
+
+
+@pytest.fixture
+def session_for(monkeypatch, tmp_path):
+    """Builds sync sessions whose toggl entries come from `fetch_toggl_entries`."""
+
+    def make(fetch_toggl_entries: Callable, toggl=None, harvest=None) -> SyncSession:
+        monkeypatch.setattr(timesheetsync, "fetch_toggl_entries", fetch_toggl_entries)
+        return fake_session(tmp_path, toggl, harvest)
+
+    return make
+
+
+@pytest.fixture
+def toggl_for(monkeypatch, tmp_path):
+    """Builds toggl sessions whose requests `fake` answers, with `lookups` patched."""
+    sessions = []
+
+    def make(fake: FakeTogglApi, **lookups) -> TogglSession:
+        monkeypatch.setattr(
+            httpx, "HTTPTransport", lambda **_: httpx.MockTransport(fake)
+        )
+        toggl = TogglSession(TokenAuth(TOKEN), cache_file=tmp_path / "cache")
+        for name, lookup in lookups.items():
+            monkeypatch.setattr(toggl, name, lookup)
+        sessions.append(toggl)
+        return toggl
+
+    yield make
+    for toggl in sessions:
+        toggl.close()
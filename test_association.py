@@ -0,0 +1,221 @@
+import random
+import string
+import time
+
+import pytest
+
+from timesheetsync import (
+    AssociationFormulaError,
+    AssociationSuggester,
+    NgramIndex,
+    parse_task_association,
+    suggest_task_association,
+    suggested_association_formula,
+)
+
+
+@pytest.mark.parametrize(
+    ("formula", "expected"),
+    [
+        ("1:3,5,7>2,3|4,6>1", [([1, 2, 3, 5, 7], [2, 3]), ([4, 6], [1])]),
+        ("1-3,5,7>2", [([1, 2, 3, 5, 7], [2])]),
+        (" 0 > 0 | ", [([0], [0])]),
+        ("2,1:3,>0,", [([2, 1, 3], [0])]),
+        ("", []),
+    ],
+)
+def test_parse_task_association(formula, expected):
+    assert parse_task_association(formula, 10, 10) == expected
+
+
+@pytest.mark.parametrize(
+    ("formula", "position", "message"),
+    [
+        ("1,2", 3, "Expected '>', found end of input"),
+        ("1>2>3", 3, "Expected '|' or the end of the formula"),
+        ("1>x", 2, "Unexpected character 'x'"),
+        ("3:1>0", 0, "Range 3:1 is reversed"),
+        ("1>10", 2, "There is no harvest task #10"),
+        ("0:12>1", 2, "There is no toggl task #12"),
+        (">1", 0, "Expected a toggl task #"),
+    ],
+)
+def test_parse_task_association_errors(formula, position, message):
+    with pytest.raises(AssociationFormulaError, match=message) as exc_info:
+        parse_task_association(formula, 10, 10)
+
+    assert exc_info.value.position == position
+
+
+def test_parse_task_association_fuzz():
+    rng = random.Random(1234)
+    alphabet = "0123456789:-,>| x"
+    for _ in range(5000):
+        formula = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        try:
+            groups = parse_task_association(formula, 50, 50)
+        except AssociationFormulaError as e:
+            assert 0 <= e.position <= len(formula)
+        else:
+            for toggl_ids, harvest_ids in groups:
+                assert toggl_ids and harvest_ids
+                assert len(set(toggl_ids)) == len(toggl_ids)
+                assert all(0 <= i < 50 for i in toggl_ids + harvest_ids)
+
+
+def test_parse_task_association_scales_linearly():
+    count = 20_000
+    ids = ",".join(str(i) for i in range(count))
+    formula = "|".join([f"{ids}>0:{count - 1}"] * 5)
+    # would backtrack catastrophically with a nested-repetition regex
+    malformed = "1," * 50_000 + "x"
+
+    started = time.perf_counter()
+    groups = parse_task_association(formula, count, count)
+    with pytest.raises(AssociationFormulaError):
+        parse_task_association(malformed, count, count)
+    elapsed = time.perf_counter() - started
+
+    assert len(groups) == 5
+    assert groups[0] == (list(range(count)), list(range(count)))
+    assert elapsed < 2
+
+
+def harvest_task(client, project, task):
+    return {
+        "client": {"name": client},
+        "project": {"id": hash(project) % 1000, "name": project},
+        "task": {"id": hash(task) % 1000, "name": task},
+    }
+
+
+def toggl_task(i, client, project, description):
+    return {
+        "id": i,
+        "pid": str(i),
+        "client": client,
+        "project": project,
+        "description": description,
+    }
+
+
+HARVEST_TASKS = [
+    harvest_task(client, project, task)
+    for client, project in [
+        ("Acme", "Website Redesign"),
+        ("Acme", "Mobile App"),
+        ("Globex", "Data Warehouse"),
+        (None, "Internal"),
+    ]
+    for task in ["Development", "Design", "Meetings", "Code Review"]
+]
+
+
+def test_suggestions_match_names():
+    suggester = AssociationSuggester(HARVEST_TASKS)
+
+    def best(client, project, description):
+        (i, _score), *_ = suggester.suggest(toggl_task(0, client, project, description))
+        h = HARVEST_TASKS[i]
+        return h["project"]["name"], h["task"]["name"]
+
+    assert best("Acme", "Website redesign", "develop") == (
+        "Website Redesign",
+        "Development",
+    )
+    # typos and abbreviations still share trigrams
+    assert best("ACME", "mobile-app", "code reveiw") == ("Mobile App", "Code Review")
+    assert best("Globex", "warehouse", "standup meeting") == (
+        "Data Warehouse",
+        "Meetings",
+    )
+    assert best(None, None, "internal meetings") == ("Internal", "Meetings")
+
+
+def test_one_suggestion_is_the_best_of_several():
+    harvest_tasks = [
+        harvest_task("Acme", "Apollo", "Design"),
+        harvest_task("Acme", "Apollo Site", "Development"),
+    ]
+    suggester = AssociationSuggester(harvest_tasks)
+    task = toggl_task(0, "Acme", "Apollo", "development")
+
+    # the best task can be in a project that isn't the likeliest
+    assert [i for i, _ in suggester.suggest(task)] == [1, 0]
+    assert suggester.suggest(task, 1) == suggester.suggest(task)[:1]
+    association = suggest_task_association([task], harvest_tasks)
+    assert association["0"]["development"]["harvest_task_id"] == [
+        harvest_tasks[1]["task"]["id"]
+    ]
+
+
+def test_suggested_formula_leaves_out_poor_matches():
+    toggl_tasks = [
+        toggl_task(0, "Acme", "Website Redesign", "development"),
+        toggl_task(1, "Acme", "Website Redesign", "dev"),
+        toggl_task(2, None, None, "xyzzy"),
+        toggl_task(3, "Globex", "Data Warehouse", "design"),
+    ]
+    suggester = AssociationSuggester(HARVEST_TASKS)
+    suggestions = [suggester.suggest(task) for task in toggl_tasks]
+
+    assert suggestions[2] == []
+    assert suggested_association_formula(toggl_tasks, suggestions) == "0,1>0|3>9"
+
+    association = suggest_task_association(toggl_tasks, HARVEST_TASKS)
+    assert association["0"]["development"]["harvest_task_id"] == [
+        HARVEST_TASKS[0]["task"]["id"]
+    ]
+    assert association["2"]["xyzzy"]["harvest_task_id"] == []
+
+
+def test_suggestions_scale(monkeypatch):
+    rng = random.Random(1234)
+    words = [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+        for _ in range(3000)
+    ]
+    tasks = ["Development", "Design", "Meetings", "Code Review", "Support", "QA"]
+    projects = [
+        (
+            "{} {}".format(*rng.sample(words, 2)),
+            "{} {} {}".format(i, *rng.sample(words, 2)),
+        )
+        for i in range(5000)
+    ]
+    harvest_tasks = [
+        harvest_task(client, project, task)
+        for client, project in projects
+        for task in rng.sample(tasks, 4)
+    ]
+    toggl_tasks = [
+        toggl_task(
+            i,
+            h["client"]["name"],
+            h["project"]["name"].title(),
+            h["task"]["name"].lower(),
+        )
+        for i, h in enumerate(rng.sample(harvest_tasks, 1000))
+    ]
+
+    suggester = AssociationSuggester(harvest_tasks)
+    # how many project names each query scores
+    scored = []
+    query = NgramIndex.query
+
+    def counted_query(index, text):
+        scores = query(index, text)
+        if index is suggester.projects:
+            scored.append(len(scores))
+        return scores
+
+    monkeypatch.setattr(NgramIndex, "query", counted_query)
+    suggestions = [suggester.suggest(task) for task in toggl_tasks]
+
+    for task, ((i, _), *_) in zip(toggl_tasks, suggestions):
+        h = harvest_tasks[i]
+        assert h["project"]["name"].title() == task["project"]
+        assert h["task"]["name"].lower() == task["description"]
+    # only projects sharing a word with the query are looked at, not all of them
+    assert len(scored) == len(toggl_tasks)
+    assert max(scored) < len(projects) / 20
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+import timesheetsync
+from conftest import EMAIL, SITE, FakeHarvest
+from timesheetsync import (
+    Harvest,
+    TogglProjectIndex,
+    TogglSession,
+    TogglTimeEntry,
+    TokenAuth,
+)
+
+TZ = pytz.timezone("America/New_York")
+# across the spring dst change
+START, END = datetime(2024, 3, 1), datetime(2024, 3, 21)
+
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="the fakes only reach worker processes that are forked",
+)
+
+
+def toggl_entries(start: datetime, end: datetime) -> list[TogglTimeEntry]:
+    """Entries right at, just after and just before each local midnight."""
+    entries = []
+    day = start
+    while day <= end:
+        for offset, description in [
+            (timedelta(0), "midnight"),
+            (timedelta(minutes=30), "early"),
+            (timedelta(hours=23, minutes=30), "late"),
+        ]:
+            begins = TZ.localize(day + offset)
+            entries.append(
+                TogglTimeEntry.model_construct(
+                    project_id="11",
+                    description=description,
+                    billable=False,
+                    username="ada",
+                    seconds=1800,
+                    start=begins,
+                    stop=begins + timedelta(minutes=30),
+                )
+            )
+        day += timedelta(days=1)
+    return list(reversed(entries))
+
+
+@pytest.fixture
+def session(session_for, monkeypatch, tmp_path):
+    pids = tmp_path / "pids"
+
+    def fetch_toggl_entries(_toggl, start, end, _tz):
+        with open(pids, "a") as f:
+            f.write("{}\n".format(os.getpid()))
+        time.sleep(session.latency)
+        return toggl_entries(start, end)
+
+    monkeypatch.setattr(TogglSession, "timezone", lambda _: TZ)
+    monkeypatch.setattr(TogglSession, "project_index", lambda _: TogglProjectIndex())
+    monkeypatch.setattr(Harvest, "get_time_entries", lambda _, params=None: [])
+    monkeypatch.setattr(Harvest, "get_users", FakeHarvest.get_users)
+    monkeypatch.setattr(
+        Harvest, "get_user_project_assignments", lambda _, _user_id: [SITE]
+    )
+
+    session = session_for(
+        fetch_toggl_entries,
+        TogglSession(TokenAuth("key"), cache_file=tmp_path / "cache"),
+        Harvest("42", "key"),
+    )
+    session.pids = pids
+    session.latency = 0
+    yield session
+    session.toggl.close()
+
+
+def day_tasks(plan):
+    return {
+        day.date().isoformat(): entry["toggl"]["tasks"]
+        for day, entry in plan.combined_entries.items()
+    }
+
+
+@pytest.mark.parametrize(
+    ("processes", "shards"),
+    [
+        (1, 1),
+        (3, 3),
+        # 21 days in 3 day shards
+        (8, 7),
+    ],
+)
+def test_sharded_plan_matches_single_process(session, processes, shards):
+    single = session.plan(START, END, "0-2>0", EMAIL)
+    session.pids.unlink()
+    sharded = session.plan(START, END, "0-2>0", EMAIL, processes=processes)
+
+    assert sharded.entries == single.entries
+    assert day_tasks(sharded) == day_tasks(single)
+    # every day is whole: the midnight entry counts towards the day before
+    assert day_tasks(sharded)["2024-03-05"] == {
+        "11": {"early": 0.5, "late": 0.5, "midnight": 0.5}
+    }
+    assert [t["description"] for t in sharded.toggl_tasks] == [
+        t["description"] for t in single.toggl_tasks
+    ]
+
+    worker_pids = session.pids.read_text().split()
+    assert len(worker_pids) == shards
+    assert str(os.getpid()) not in worker_pids
+
+
+def test_failed_plan_drops_queued_shards(session, monkeypatch):
+    monkeypatch.setattr(timesheetsync, "SHARD_DAYS", 1)
+    session.latency = 0.2
+
+    with pytest.raises(LookupError):
+        session.plan(START, END, "0-2>0", "nobody@example.com", processes=2)
+
+    # only the shards already running when the plan failed were fetched
+    assert len(session.pids.read_text().split()) < 21
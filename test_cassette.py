@@ -0,0 +1,81 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import httpx
+import pytest
+
+import timesheetsync
+from timesheetsync import Cassette, CassetteTransport, Harvest
+
+
+class FakeHarvest(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        FakeHarvest.requests += 1
+        page = int(self.path.split("page=")[1].split("&")[0])
+        body = json.dumps(
+            {
+                "users": [{"id": page, "email": "user{}@example.com".format(page)}],
+                "next_page": page + 1 if page < 3 else None,
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def harvest_url():
+    server = HTTPServer(("127.0.0.1", 0), FakeHarvest)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}/v2/users".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def toggl_handler(request: httpx.Request):
+    return httpx.Response(200, json={"description": "secret", "seen": request.url.path})
+
+
+@pytest.mark.parametrize("anonymize", [False, True])
+def test_record_then_replay(tmp_path, monkeypatch, harvest_url, anonymize):
+    path = tmp_path / "sync.cassette.gz"
+
+    cassette = Cassette(path, "record", anonymize=anonymize)
+    monkeypatch.setattr(timesheetsync.state, "cassette", cassette)
+    recorded_users = Harvest("1", "key").get_all(harvest_url, "users")
+    client = httpx.Client(
+        transport=CassetteTransport(cassette, httpx.MockTransport(toggl_handler))
+    )
+    recorded_toggl = client.post("https://toggl.test/me", json={"a": 1}).json()
+    cassette.save()
+
+    requests_made = FakeHarvest.requests
+    cassette = Cassette(path, "replay", latency_scale=0)
+    monkeypatch.setattr(timesheetsync.state, "cassette", cassette)
+    replayed_users = Harvest("1", "key").get_all(harvest_url, "users")
+    client = httpx.Client(
+        transport=CassetteTransport(cassette, httpx.MockTransport(None))
+    )
+    replayed_toggl = client.post("https://toggl.test/me", json={"a": 1}).json()
+
+    assert FakeHarvest.requests == requests_made
+    assert [u["id"] for u in replayed_users] == [1, 2, 3]
+    assert replayed_toggl["seen"] == "/me"
+    if anonymize:
+        assert all(u["email"].startswith("anon-") for u in replayed_users)
+        assert len({u["email"] for u in replayed_users}) == 3
+        assert replayed_toggl["description"].startswith("anon-")
+    else:
+        assert replayed_users == recorded_users
+        assert replayed_toggl == recorded_toggl
+
+    with pytest.raises(LookupError):
+        client.post("https://toggl.test/me", json={"a": 2})
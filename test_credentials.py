@@ -0,0 +1,43 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from timesheetsync import CredentialStore, Credentials
+
+
+def test_legacy_cache_file_is_the_default_profile(tmp_path):
+    cache_file = tmp_path / ".creds"
+    cache_file.write_text(
+        json.dumps({"toggl_key": "t", "harvest_account_id": "a", "harvest_key": "k"})
+    )
+
+    store = CredentialStore(cache_file)
+    assert store.get() == Credentials("t", "a", "k")
+    assert store.get("other") == Credentials()
+
+    store.save("other", Credentials("t2", "a2", None))
+    assert json.loads(cache_file.read_text()) == {
+        "default": {"toggl_key": "t", "harvest_account_id": "a", "harvest_key": "k"},
+        "other": {"toggl_key": "t2", "harvest_account_id": "a2"},
+    }
+
+
+def test_unchanged_credentials_are_not_rewritten(tmp_path):
+    cache_file = tmp_path / ".creds"
+    CredentialStore(cache_file).save("default", Credentials("t", "a", "k"))
+    mtime = cache_file.stat().st_mtime_ns
+
+    CredentialStore(cache_file).save("default", Credentials("t", "a", "k"))
+    assert cache_file.stat().st_mtime_ns == mtime
+
+
+def _save_profile(args):
+    cache_file, i = args
+    CredentialStore(cache_file).save(f"p{i}", Credentials(str(i), "a", "k"))
+
+
+def test_concurrent_saves_keep_every_profile(tmp_path):
+    cache_file = tmp_path / ".creds"
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(_save_profile, [(cache_file, i) for i in range(20)]))
+
+    assert set(CredentialStore(cache_file).profiles) == {f"p{i}" for i in range(20)}
@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import httpx
+import pytest
+
+import timesheetsync
+from timesheetsync import (
+    Deadline,
+    DeadlineExceeded,
+    Harvest,
+    LatencyTracker,
+    SyncPlan,
+    SyncSession,
+    TogglSession,
+    TokenAuth,
+    deadline_scope,
+)
+
+
+class SlowHarvest(BaseHTTPRequestHandler):
+    """Answers after `server.delays` seconds, popped per request, or right away.
+
+    Statuses are popped from `server.statuses` the same way, 200 when there are
+    none left.
+    """
+
+    def answer(self, body: dict):
+        server: Any = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path))
+            delay = server.delays.pop(0) if server.delays else 0
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(delay)
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            pass  # the client gave up waiting
+
+    def do_GET(self):
+        self.answer({"users": [{"id": 7}], "total_entries": 1, "next_page": None})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.answer({"id": 1})
+
+    def log_message(self, *_args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHarvest)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.delays = []
+    server.statuses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = "http://127.0.0.1:{}".format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_latencies(monkeypatch):
+    monkeypatch.setattr(timesheetsync, "request_latencies", LatencyTracker())
+
+
+def test_deadline_cuts_a_hanging_request_short(server):
+    server.delays = [5]
+    harvest = Harvest("1", "key")
+
+    started = time.monotonic()
+    with deadline_scope(Deadline(0.3)), pytest.raises(DeadlineExceeded):
+        harvest.get_all(server.url + "/users", "users")
+
+    assert time.monotonic() - started < 1
+    # and once it's over, nothing more is sent
+    with deadline_scope(Deadline(0)), pytest.raises(DeadlineExceeded):
+        harvest.count(server.url + "/users")
+    assert len(server.requests) == 1
+
+
+def test_deadlines_cross_processes_as_wall_clock_times():
+    deadline = Deadline(10)
+    time.sleep(0.2)
+    # a worker started late only gets what's left of the run's budget
+    shared = Deadline.until(deadline.wall_time())
+    assert 9 < shared.remaining() <= deadline.remaining() + 0.01 < 10
+    assert Deadline.until(time.time() - 1).expired
+    assert Deadline.until(Deadline().wall_time()).remaining() is None
+
+
+def test_slow_gets_are_hedged(server, monkeypatch):
+    monkeypatch.setattr(timesheetsync, "HEDGE_MIN_SECONDS", 0.05)
+    harvest = Harvest("1", "key")
+    for _ in range(timesheetsync.HEDGE_MIN_SAMPLES):
+        harvest.count(server.url + "/users")
+    sent = len(server.requests)
+
+    # the first copy stalls, the hedge sent after it answers straight away
+    server.delays = [3]
+    started = time.monotonic()
+    assert harvest.count(server.url + "/users") == 1
+
+    assert time.monotonic() - started < 1
+    assert len(server.requests) == sent + 2
+
+
+def test_posts_are_never_hedged(server, monkeypatch):
+    monkeypatch.setattr(timesheetsync, "HEDGE_MIN_SECONDS", 0.05)
+    harvest = Harvest("1", "key")
+    for _ in range(timesheetsync.HEDGE_MIN_SAMPLES):
+        harvest.count(server.url + "/users")
+    sent = len(server.requests)
+
+    server.delays = [0.3]
+    harvest.post_all(server.url + "/time_entries", {"hours": 1})
+
+    assert len(server.requests) == sent + 1
+
+
+def test_toggl_timeouts_are_retried(monkeypatch, tmp_path):
+    attempts = []
+
+    def flaky(request: httpx.Request) -> httpx.Response:
+        attempts.append(request.extensions["timeout"])
+        if len(attempts) < 3:
+            raise httpx.ReadTimeout("slow", request=request)
+        return httpx.Response(200, json=[])
+
+    monkeypatch.setattr(httpx, "HTTPTransport", lambda **_: httpx.MockTransport(flaky))
+    toggl = TogglSession(TokenAuth("key"), cache_file=tmp_path / "cache")
+
+    with deadline_scope(Deadline(30)):
+        assert toggl.reports.search(1, datetime(2024, 1, 1), datetime(2024, 1, 2)) == []
+
+    assert len(attempts) == 3
+    # every timeout fits in what's left of the deadline
+    assert all(0 < t["read"] <= 30 for t in attempts)
+
+
+def five_day_plan() -> SyncPlan:
+    return SyncPlan(
+        start_date=datetime(2024, 1, 1),
+        end_date=datetime(2024, 1, 5),
+        harvest_user_id=7,
+        toggl_tasks=[],
+        harvest_tasks=[],
+        task_association={},
+        combined_entries={},
+        entries=[{"spent_date": f"2024-01-0{d}", "hours": 1} for d in range(1, 6)],
+    )
+
+
+def test_apply_keeps_partial_progress(server, monkeypatch):
+    plan = five_day_plan()
+    server.delays = [0, 0, 5]
+    session = SyncSession(
+        None,  # pyright: ignore[reportArgumentType]
+        Harvest("1", "key"),
+    )
+    monkeypatch.setattr(
+        timesheetsync, "HARVEST_TIME_ENTRIES_URL", server.url + "/time_entries"
+    )
+
+    with deadline_scope(Deadline(0.5)):
+        result = session.apply(plan, confirm=True)
+
+    assert len(result.posted) == 2
+    assert result.pending == plan.entries[2:]
+    assert "deadline" in (result.error or "")
+    assert "post" in plan.timings
+
+
+def test_refused_posts_stop_apply(server, monkeypatch, tmp_path):
+    plan = five_day_plan()
+    server.statuses = [200, 422]
+    session = SyncSession(
+        None,  # pyright: ignore[reportArgumentType]
+        Harvest("1", "key"),
+        fingerprint_file=tmp_path / "fingerprints",
+    )
+    monkeypatch.setattr(
+        timesheetsync, "HARVEST_TIME_ENTRIES_URL", server.url + "/time_entries"
+    )
+
+    result = session.apply(plan, confirm=True)
+
+    assert len(result.posted) == 1
+    assert result.pending == plan.entries[1:]
+    assert "422" in (result.error or "")
+    # the days stay for `reconcile` to find
+    assert not (tmp_path / "fingerprints").exists()
@@ -0,0 +1,92 @@
+import pytest
+
+import timesheetsync
+from timesheetsync import (
+    SyncProbe,
+    estimate_sync_cost,
+    plan_sync_strategies,
+    sync_flags,
+)
+
+
+def make_probe(**overrides) -> SyncProbe:
+    values = dict(
+        days=365,
+        workspaces=1,
+        toggl_rows_per_day=10.0,
+        harvest_counts={
+            "time_entries": 1000,
+            "users": 5,
+            "projects": 40,
+            "task_assignments": 250,
+        },
+        toggl_latency=0.2,
+        harvest_latency=0.1,
+        fingerprints_fresh=False,
+        requests=5,
+    )
+    values.update(overrides)
+    return SyncProbe(**values)
+
+
+def test_request_counts():
+    estimate = estimate_sync_cost(
+        make_probe(), window_days=365, concurrency=1, export=False
+    )
+    stages = {stage.stage: stage for stage in estimate.stages}
+
+    # 3650 rows in one window: 73 full pages and the empty one after them
+    assert stages["toggl reports"].requests == 74
+    assert stages["harvest listings"].requests == 10 + 1 + 1 + 3
+    assert stages["post"].requests == 3650 - 1000
+
+
+def test_export_is_one_request_per_window():
+    probe = make_probe(workspaces=2)
+    export = estimate_sync_cost(probe, window_days=90, concurrency=1)
+    paged = estimate_sync_cost(probe, window_days=90, concurrency=1, export=False)
+
+    assert export.stages[0].requests == 5 * 2
+    assert export.stages[0].requests < paged.stages[0].requests
+    assert plan_sync_strategies(probe)[0].strategy == "export"
+
+
+def test_aggregate_is_one_request_per_window():
+    probe = make_probe(days=30, workspaces=2)
+    aggregate = estimate_sync_cost(probe, 10, concurrency=1, aggregate=True)
+    paged = estimate_sync_cost(probe, 30, concurrency=1, export=False)
+
+    assert aggregate.strategy == "aggregate"
+    assert aggregate.stages[0].requests == 3 * 2
+    assert aggregate.bytes < paged.bytes
+
+
+def test_rate_limit_bounds_concurrency():
+    probe = make_probe()
+    serial = estimate_sync_cost(probe, window_days=30, concurrency=1, export=False)
+    parallel = estimate_sync_cost(probe, window_days=30, concurrency=4, export=False)
+
+    serial_toggl, parallel_toggl = serial.stages[0], parallel.stages[0]
+    assert serial_toggl.requests == parallel_toggl.requests
+    # toggl allows about one request a second, however many run at once
+    assert parallel_toggl.seconds == pytest.approx(parallel_toggl.requests)
+    assert serial_toggl.seconds == pytest.approx(parallel_toggl.seconds)
+
+
+def test_strategies_are_what_sync_can_run():
+    # a diff isn't a sync, however fresh the fingerprints
+    for fresh in (True, False):
+        estimates = plan_sync_strategies(make_probe(fingerprints_fresh=fresh))
+        assert {e.strategy for e in estimates} == {"export", "aggregate"}
+        assert {e.concurrency for e in estimates} == set(timesheetsync.SYNC_PROCESSES)
+        assert max(e.window_days for e in estimates) == timesheetsync.SHARD_DAYS
+        assert estimates == sorted(estimates, key=lambda e: e.seconds)
+
+
+def test_sync_flags():
+    probe = make_probe()
+    assert sync_flags(estimate_sync_cost(probe, 180, concurrency=1)) == ""
+    assert (
+        sync_flags(estimate_sync_cost(probe, 92, concurrency=4, aggregate=True))
+        == "--aggregate --processes 4"
+    )
@@ -0,0 +1,93 @@
+import datetime
+from types import SimpleNamespace
+
+import pytz
+
+from timesheetsync import (
+    FingerprintIndex,
+    day_ranges,
+    diff_fingerprints,
+    fingerprints_fresh,
+    task_fingerprint,
+    update_fingerprints,
+)
+
+
+def test_task_fingerprint_ignores_sub_posting_precision():
+    assert task_fingerprint({"1": {"a": 1.0001}}) == task_fingerprint({"1": {"a": 1.0}})
+    assert task_fingerprint({"1": {"a": 1.0}}) != task_fingerprint({"1": {"a": 1.5}})
+
+
+def test_diff_fingerprints_finds_changed_days():
+    old = {
+        "2023-12-31": "a",
+        "2024-01-01": "b",
+        "2024-01-02": "c",
+        "2024-03-05": "d",
+    }
+    new = dict(old)
+    new["2024-01-02"] = "changed"
+    del new["2024-03-05"]
+    new["2024-06-01"] = "e"
+
+    assert diff_fingerprints(old, old) == []
+    assert sorted(diff_fingerprints(old, new)) == [
+        "2024-01-02",
+        "2024-03-05",
+        "2024-06-01",
+    ]
+
+
+def test_day_ranges_coalesces_consecutive_days():
+    assert day_ranges(["2024-01-03", "2024-01-01", "2024-01-02", "2024-01-05"]) == [
+        (datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 3)),
+        (datetime.datetime(2024, 1, 5), datetime.datetime(2024, 1, 5)),
+    ]
+
+
+def test_checks_are_kept_per_day():
+    index = FingerprintIndex()
+    jan, feb = datetime.datetime(2024, 1, 1), datetime.datetime(2024, 2, 1)
+    index.record({}, jan, jan + datetime.timedelta(days=6), "2024-01-08T00:00:00")
+    index.record({}, feb, feb + datetime.timedelta(days=6), "2024-02-08T00:00:00")
+
+    # syncing february doesn't make january look freshly checked
+    assert index.checked_since(jan, jan + datetime.timedelta(days=6)) == (
+        "2024-01-08T00:00:00"
+    )
+    assert index.checked_since(jan, feb) is None
+    assert index.checked_since(jan, jan + datetime.timedelta(days=40)) is None
+
+    index.mark_checked(jan + datetime.timedelta(days=7), feb, "2024-02-09T00:00:00")
+    assert index.checked_since(jan, feb) == "2024-01-08T00:00:00"
+
+
+def test_indexes_with_a_single_check_are_unchecked():
+    index = FingerprintIndex.from_cache(
+        {"toggl": {"2024-01-01": "a"}, "harvest": {}, "checked_at": "2024-01-08"}
+    )
+    assert index.toggl == {"2024-01-01": "a"}
+    day = datetime.datetime(2024, 1, 1)
+    assert index.checked_since(day, day) is None
+
+
+def test_fresh_fingerprints_are_the_users_own(tmp_path):
+    harvest = SimpleNamespace(account_id="42")
+    path = tmp_path / "fingerprints"
+    now = datetime.datetime.now(pytz.utc)
+    first = datetime.datetime(now.year, now.month, now.day) - datetime.timedelta(days=7)
+    last = first + datetime.timedelta(days=6)
+    with update_fingerprints(path) as fingerprints:
+        fingerprints["42:7"] = FingerprintIndex()
+        fingerprints["42:7"].mark_checked(first, last)
+        fingerprints["42:8"] = FingerprintIndex()
+        fingerprints["42:8"].mark_checked(first, last, "2000-01-01T00:00:00+00:00")
+
+    assert fingerprints_fresh(path, harvest, 7, first, last)
+    # someone else's sync of the window, or one of only part of it, says nothing
+    assert not fingerprints_fresh(path, harvest, 9, first, last)
+    assert not fingerprints_fresh(
+        path, harvest, 7, first - datetime.timedelta(days=1), last
+    )
+    # toggl has forgotten what changed that long ago
+    assert not fingerprints_fresh(path, harvest, 8, first, last)
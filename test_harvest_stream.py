@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from timesheetsync import compile_projection, iter_json_list
+
+PAGE = {
+    "time_entries": [
+        {
+            "id": i,
+            "spent_date": "2024-01-0{}".format(i % 9 + 1),
+            "hours": 1.25 * i,
+            "notes": 'note "{}" – ünïcode'.format(i),
+            "project": {"id": 10 + i, "name": "p", "code": "x", "extra": [1, 2]},
+            "external_reference": None,
+        }
+        for i in range(25)
+    ],
+    "per_page": 100,
+    "total_pages": 12,
+    "next_page": None,
+    "links": {"first": "https://example.com?page=1"},
+}
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1 << 20])
+def test_iter_json_list_matches_full_decode(chunk_size):
+    data = json.dumps(PAGE, indent=1).encode()
+    meta = {}
+    records = list(
+        iter_json_list(chunked(data, chunk_size), "time_entries", None, meta)
+    )
+
+    assert records == PAGE["time_entries"]
+    assert meta == {k: v for k, v in PAGE.items() if k != "time_entries"}
+
+
+def test_iter_json_list_projects_fields():
+    data = json.dumps(PAGE).encode()
+    projection = compile_projection(("id", "hours", "project.id", "missing.id"))
+    records = list(iter_json_list(chunked(data, 5), "time_entries", projection))
+
+    assert records == [
+        {"id": e["id"], "hours": e["hours"], "project": {"id": e["project"]["id"]}}
+        for e in PAGE["time_entries"]
+    ]
+
+
+def test_iter_json_list_projects_fields_of_each_list_item():
+    page = {
+        "project_assignments": [
+            {
+                "id": 1,
+                "project": {"id": 10, "name": "Site", "code": "S"},
+                "task_assignments": [
+                    {"id": 5, "billable": True, "task": {"id": 200, "name": "Dev"}},
+                    {"id": 6, "billable": False, "task": {"id": 201, "name": "QA"}},
+                ],
+            }
+        ]
+    }
+    projection = compile_projection(
+        ("project.id", "task_assignments.id", "task_assignments.task.name")
+    )
+    records = list(
+        iter_json_list([json.dumps(page).encode()], "project_assignments", projection)
+    )
+
+    assert records == [
+        {
+            "project": {"id": 10},
+            "task_assignments": [
+                {"id": 5, "task": {"name": "Dev"}},
+                {"id": 6, "task": {"name": "QA"}},
+            ],
+        }
+    ]
+
+
+def test_iter_json_list_rejects_truncated_pages():
+    data = json.dumps(PAGE).encode()
+    with pytest.raises(ValueError):
+        list(iter_json_list(chunked(data[:-40], 16), "time_entries"))
@@ -0,0 +1,222 @@
+import json
+import pathlib
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+import timesheetsync
+from conftest import ADA, EMAIL, FakeHarvest, fake_session
+from timesheetsync import MemoryReport, SyncSession, TogglTimeEntry
+
+TZ = pytz.timezone("UTC")
+START, END = datetime(2024, 1, 1), datetime(2024, 2, 25)
+ENTRIES_PER_DAY = 24
+TASKS = 8
+FORMULA = "0-{}>0".format(TASKS - 1)
+MiB = 2**20
+BUDGET = 2 * MiB
+# what's kept between slices, and the helper objects around them, come on top
+LIMIT = 3 * MiB
+
+
+def synthetic_entries(start: datetime, end: datetime) -> list[TogglTimeEntry]:
+    """Every day's toggl entries from `start` up to `end`, each a few KiB."""
+    entries = []
+    for day in range((end - start).days + 1):
+        date = start + timedelta(days=day)
+        for i in range(ENTRIES_PER_DAY):
+            begins = TZ.localize(date + timedelta(hours=6, minutes=i * 10))
+            entries.append(
+                TogglTimeEntry.model_construct(
+                    project_id="11",
+                    description="task {}".format(i % TASKS),
+                    billable=False,
+                    # standing in for everything else a real entry carries,
+                    # built one string per entry like decoding would
+                    username="ada " * 2000 + str(i),
+                    seconds=600,
+                    start=begins,
+                    stop=begins + timedelta(minutes=10),
+                )
+            )
+    return entries
+
+
+def sunday_entries(params):
+    # sundays already have time in harvest
+    first = datetime.fromisoformat(params["from"])
+    days = (datetime.fromisoformat(params["to"]) - first).days + 1
+    return [
+        {
+            "spent_date": day.date().isoformat(),
+            "hours": 8.0,
+            "notes": "x" * 2000,
+            "user": ADA,
+        }
+        for day in (first + timedelta(days=i) for i in range(days))
+        if day.weekday() == 6
+    ]
+
+
+def synthetic_session(tmp_path: pathlib.Path, setattr=setattr) -> SyncSession:
+    setattr(
+        timesheetsync,
+        "fetch_toggl_entries",
+        lambda _toggl, start, end, _tz: synthetic_entries(start, end),
+    )
+    return fake_session(tmp_path, harvest=FakeHarvest(sunday_entries))
+
+
+def traced_peak(run):
+    tracemalloc.start()
+    try:
+        result = run()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def planned(plan):
+    return sorted((e["spent_date"], e["notes"], e["hours"]) for e in plan.entries)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    return synthetic_session(tmp_path, monkeypatch.setattr)
+
+
+def test_memory_budget_bounds_peak(session):
+    full_peak, full = traced_peak(lambda: session.plan(START, END, FORMULA, EMAIL))
+    sliced_peak, sliced = traced_peak(
+        lambda: session.plan(START, END, FORMULA, EMAIL, max_memory=BUDGET)
+    )
+
+    assert planned(sliced) == planned(full)
+    # every day but the sundays
+    assert len(full.entries) == 48 * TASKS
+    assert sliced_peak < LIMIT < full_peak
+
+
+def test_sliced_plans_number_and_count_like_plan(session, monkeypatch, tmp_path):
+    def fetch_toggl_entries(_toggl, start, end, _tz):
+        entries = synthetic_entries(start, end)
+        if start <= START <= end:
+            # only worked on in the first slice, and before any other task
+            begins = TZ.localize(START + timedelta(hours=1))
+            entries.append(
+                TogglTimeEntry.model_construct(
+                    project_id="11",
+                    description="kickoff",
+                    billable=False,
+                    username="ada",
+                    seconds=600,
+                    start=begins,
+                    stop=begins + timedelta(minutes=10),
+                )
+            )
+        return entries
+
+    monkeypatch.setattr(timesheetsync, "fetch_toggl_entries", fetch_toggl_entries)
+    stats = timesheetsync.DiskCache(tmp_path / "stats", timedelta(days=1))
+
+    full = session.plan(START, END, FORMULA, EMAIL)
+    full_stats = stats.get("toggl:42")
+    sliced = session.plan(START, END, FORMULA, EMAIL, max_memory=BUDGET)
+
+    assert [t["description"] for t in full.toggl_tasks][:2] == ["kickoff", "task 0"]
+    assert sliced.toggl_tasks == full.toggl_tasks
+    # the day toggl is asked for past each slice isn't counted twice
+    assert stats.get("toggl:42") == full_stats
+    assert full_stats["toggl_rows_per_day"] * 55 == 56 * ENTRIES_PER_DAY + 1
+
+
+def test_memory_report_names_each_stage(session):
+    report = MemoryReport()
+    try:
+        session.plan(START, END, FORMULA, EMAIL, memory_report=report)
+    finally:
+        report.close()
+
+    stages = {stage.name: stage for stage in report.stages}
+    assert list(stages) == [
+        "toggl entries",
+        "harvest entries",
+        "task tables",
+        "combined entries",
+        "harvest entries to add",
+    ]
+    # the toggl download is what holds the memory
+    assert stages["toggl entries"].held > 4 * LIMIT
+    assert any("test_memory.py" in line for line, _ in stages["toggl entries"].top)
+    assert not tracemalloc.is_tracing()
+
+
+def test_sliced_plans_size_slices_to_the_budget(session):
+    report = MemoryReport()
+    try:
+        session.plan(
+            START, END, FORMULA, EMAIL, max_memory=BUDGET, memory_report=report
+        )
+    finally:
+        report.close()
+
+    slices = [s for s in report.stages if s.name[0].isdigit()]
+    assert slices[0].name == "2024-02-19 to 2024-02-25"
+    assert slices[-1].name.startswith("2024-01-01 to")
+    assert all(s.peak < LIMIT for s in slices)
+
+
+PEAK_RSS_SCRIPT = """
+import json, pathlib, sys
+import test_memory
+
+
+def status(field):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+
+
+session = test_memory.synthetic_session(pathlib.Path(sys.argv[1]))
+# start the high water mark over from here, leaving out the imports
+with open("/proc/self/clear_refs", "w") as clear_refs:
+    clear_refs.write("5")
+before = status("VmRSS")
+session.plan(
+    test_memory.START,
+    test_memory.END,
+    test_memory.FORMULA,
+    test_memory.EMAIL,
+    max_memory=json.loads(sys.argv[2]),
+)
+print(json.dumps(status("VmHWM") - before))
+"""
+
+
+@pytest.mark.skipif(
+    not pathlib.Path("/proc/self/clear_refs").exists(),
+    reason="needs linux to reset the peak RSS",
+)
+def test_peak_rss_stays_under_limit(tmp_path):
+    def rss_growth(max_memory):
+        out = subprocess.run(
+            [sys.executable, "-c", PEAK_RSS_SCRIPT, str(tmp_path)]
+            + [json.dumps(max_memory)],
+            cwd=pathlib.Path(__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        return json.loads(out)
+
+    sliced, full = rss_growth(BUDGET), rss_growth(None)
+
+    # on top of the python allocations, tracemalloc's own bookkeeping and the
+    # allocator's slack
+    assert sliced < LIMIT * 2 < full
+    assert sliced * 3 < full
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import timesheetsync
+from timesheetsync import Coalescer, SyncJob, SyncService, SyncServiceHandler
+
+
+def test_coalescer_shares_concurrent_calls():
+    coalescer = Coalescer()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(coalescer.run("k", fetch)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(r is results[0] for r in results)
+
+    # once finished, the next call fetches again
+    coalescer.run("k", fetch)
+    assert len(calls) == 2
+
+
+class StubService(SyncService):
+    def execute(self, job: SyncJob):
+        if job.harvest_email == "broken@example.com":
+            raise RuntimeError("boom")
+        return {"entries": [], "window": job.summary()["start_date"]}
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize(
+    ("body", "field"),
+    [
+        ({"days": "3"}, "days"),
+        ({"days": [3]}, "days"),
+        ({"days": True}, "days"),
+        ({"daterange": "2024-01-01"}, "daterange"),
+        ({"daterange": [2024, 1]}, "daterange"),
+        ({"deadline": "soon"}, "deadline"),
+        ({"harvest_email": ["a@b.c"]}, "harvest_email"),
+        ({"mode": 1}, "mode"),
+    ],
+)
+def test_jobs_with_mistyped_fields_are_refused(body, field):
+    with pytest.raises(ValueError, match=field):
+        SyncJob.from_request({"harvest_email": "a@b.c", **body})
+
+
+def test_finished_jobs_expire(tmp_path, monkeypatch):
+    service = StubService(tmp_path / ".creds", workers=1)
+    first = service.submit(SyncJob.from_request({"days": 3, "harvest_email": "a@b.c"}))
+    service.pool.shutdown(wait=True)
+    assert first.status == "done"
+
+    service.pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(timesheetsync, "SYNC_JOB_TTL", timedelta(0))
+    second = service.submit(SyncJob.from_request({"days": 3, "harvest_email": "a@b.c"}))
+    assert first.id not in service.jobs and second.id in service.jobs
+    service.close()
+
+
+def test_service_queues_and_reports_jobs(tmp_path):
+    service = StubService(tmp_path / ".creds", workers=2)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyncServiceHandler)
+    server.service = service
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+
+    try:
+        status, body = request(url + "/jobs", {"days": 3})
+        assert status == 400 and "harvest_email" in body["error"]
+        for bad in ({"days": "3", "harvest_email": "a@b.c"}, ["not", "a", "job"]):
+            status, body = request(url + "/jobs", bad)
+            assert status == 400 and body["error"]
+
+        status, ok = request(
+            url + "/jobs",
+            {"daterange": ["2024-01-01", "2024-01-05"], "harvest_email": "a@b.c"},
+        )
+        assert status == 202 and ok["status"] in ("queued", "running", "done")
+        _, failing = request(
+            url + "/jobs", {"days": 3, "harvest_email": "broken@example.com"}
+        )
+
+        service.pool.shutdown(wait=True)
+        _, ok = request(url + "/jobs/" + ok["id"])
+        _, failing = request(url + "/jobs/" + failing["id"])
+        _, jobs = request(url + "/jobs")
+
+        assert ok["status"] == "done"
+        assert ok["result"] == {"entries": [], "window": "2024-01-01"}
+        assert failing["status"] == "failed" and "boom" in failing["error"]
+        assert len(jobs) == 2
+        assert request(url + "/jobs/nope")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,392 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pytest
+import pytz
+import requests
+
+import timesheetsync
+from conftest import ADA, FakeHarvest
+from timesheetsync import (
+    Coalescer,
+    LockedPeriods,
+    SyncPrefetch,
+    TogglTimeEntry,
+    build_task_association,
+)
+
+TZ = pytz.timezone("UTC")
+START, END = datetime(2024, 1, 1), datetime(2024, 1, 4)
+
+
+def toggl_entry(day: int, description: str, hours: float) -> TogglTimeEntry:
+    start = TZ.localize(datetime(2024, 1, day, 9))
+    return TogglTimeEntry.model_construct(
+        project_id="11",
+        description=description,
+        billable=False,
+        username="ada",
+        seconds=int(hours * 3600),
+        start=start,
+        stop=start + timedelta(hours=hours),
+    )
+
+
+GRACE = {"id": 8}
+ASSIGNMENTS = [
+    {
+        "project": {"id": 100, "name": "Site"},
+        "client": {"id": 1, "name": "Acme"},
+        "task_assignments": [
+            {"id": 5, "task": {"id": 200, "name": "Development"}},
+            {"id": 6, "task": {"id": 201, "name": "Meetings"}},
+            {"id": 7, "task": {"id": 202, "name": "Old"}, "is_active": False},
+        ],
+    },
+    {
+        "is_active": False,
+        "project": {"id": 101, "name": "Archived"},
+        "client": {"id": 1, "name": "Acme"},
+        "task_assignments": [{"id": 8, "task": {"id": 200, "name": "Build"}}],
+    },
+]
+
+
+def time_entries(_params):
+    # the 2nd already has time in harvest, and the listing is everyone's
+    return [
+        {"spent_date": "2024-01-02", "hours": 1.0, "notes": "review", "user": ADA},
+        {"spent_date": "2024-01-03", "hours": 8.0, "notes": "x", "user": GRACE},
+    ]
+
+
+@pytest.fixture
+def session(session_for):
+    toggl_fetches = []
+
+    def fetch_toggl_entries(*_args):
+        toggl_fetches.append(1)
+        time.sleep(0.1)
+        return [
+            toggl_entry(1, "build", 2),
+            toggl_entry(1, "review", 0.5),
+            toggl_entry(2, "build", 3),
+            toggl_entry(3, "build", 1.25),
+        ]
+
+    session = session_for(
+        fetch_toggl_entries, harvest=FakeHarvest(time_entries, ASSIGNMENTS)
+    )
+    session.toggl_fetches = toggl_fetches
+    return session
+
+
+def test_plan_without_confirmation_posts_nothing(session):
+    # toggl tasks sort as "build", "review"; harvest tasks as task 200, 201
+    plan = session.plan(START, END, "0>0|1>0,1", "ada@example.com")
+
+    assert [(e["spent_date"], e["task_id"], e["hours"]) for e in plan.entries] == [
+        ("2024-01-01", 200, 2.0),
+        ("2024-01-01", 200, 0.5),
+        ("2024-01-01", 201, 0.5),
+        ("2024-01-03", 200, 1.25),
+    ]
+    assert {e["user_id"] for e in plan.entries} == {7}
+    assert [t["#"] for t in plan.tables()["toggl_tasks"]] == [0, 1]
+
+    result = session.apply(plan)
+    assert not result.confirmed and result.posted == []
+    assert session.harvest.posted == []
+    # an aborted sync leaves nothing for `reconcile` to take as synced
+    with timesheetsync.update_fingerprints(session.fingerprint_file) as fingerprints:
+        assert fingerprints == {}
+
+
+def test_confirmed_sync_fingerprints_the_posted_days(session):
+    session.sync(START, END, "0>0|1>0,1", "ada@example.com", confirm=True)
+
+    with timesheetsync.update_fingerprints(session.fingerprint_file) as fingerprints:
+        (index,) = fingerprints.values()
+    assert sorted(index.checked) == [
+        "2024-01-01",
+        "2024-01-02",
+        "2024-01-03",
+        "2024-01-04",
+    ]
+    assert sorted(index.harvest) == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    # the same as `reconcile` fetches: only ada's time, not grace's
+    assert index.harvest["2024-01-03"] == timesheetsync.task_fingerprint(
+        {"build": 1.25}
+    )
+
+
+def harvest_entry(day: str, project_id: int, user_id: int = 7, **flags) -> dict:
+    entry = {"spent_date": day, "hours": 1.0, "notes": "x", "user": {"id": user_id}}
+    return entry | {"project": {"id": project_id}} | flags
+
+
+def test_locked_periods():
+    periods = LockedPeriods.from_entries(
+        [
+            harvest_entry("2024-01-02", 100, is_billed=True),
+            harvest_entry("2024-01-04", 100),
+            harvest_entry("2024-01-05", 100, is_locked=True, locked_reason="Invoiced"),
+            # a wednesday, closing the week from monday the 8th
+            harvest_entry("2024-01-10", 101, is_locked=True, is_closed=True),
+        ]
+    )
+    # the first slice of a window ends where the next begins
+    periods.merge(
+        LockedPeriods.from_entries(
+            [
+                harvest_entry("2024-01-06", 100, is_locked=True),
+                harvest_entry("2024-01-06", 100),
+                harvest_entry("2024-01-09", 100, is_locked=True),
+            ]
+        )
+    )
+
+    assert periods.ranges()[100] == [
+        (date(2024, 1, 2), date(2024, 1, 2), "billed"),
+        (date(2024, 1, 5), date(2024, 1, 5), "Invoiced"),
+        (date(2024, 1, 9), date(2024, 1, 9), "locked"),
+    ]
+    entries = [
+        {"spent_date": day, "project_id": project_id}
+        for day, project_id in [
+            ("2024-01-02", 100),
+            ("2024-01-02", 101),
+            ("2024-01-03", 100),
+            ("2024-01-08", 102),
+            ("2024-01-14", 101),
+            ("2024-01-15", 100),
+        ]
+    ]
+    kept, pruned = periods.prune(entries)
+
+    assert kept == [entries[1], entries[2], entries[5]]
+    assert [e["reason"] for e in pruned] == [
+        "billed from 2024-01-02 to 2024-01-02",
+        "timesheet for the week of 2024-01-08 approved",
+        "timesheet for the week of 2024-01-08 approved",
+    ]
+
+
+def test_entries_on_locked_days_are_pruned(session, monkeypatch):
+    monkeypatch.setattr(
+        session.harvest,
+        "get_time_entries",
+        lambda params=None: [
+            harvest_entry("2024-01-02", 100, is_billed=True),
+            harvest_entry("2024-01-04", 100, is_locked=True, locked_reason="Invoiced"),
+        ],
+    )
+    plan = session.plan(START, END, "0>0|1>1", "ada@example.com")
+
+    assert [(e["spent_date"], e["task_id"]) for e in plan.entries] == [
+        ("2024-01-01", 200),
+        ("2024-01-01", 201),
+    ]
+    assert [(e["spent_date"], e["reason"]) for e in plan.pruned] == [
+        ("2024-01-03", "billed from 2024-01-02 to 2024-01-04")
+    ]
+    assert plan.tables()["pruned"] == plan.pruned
+
+    result = session.apply(plan, confirm=True)
+    assert session.harvest.posted == plan.entries
+    assert len(result.posted) == 2
+
+
+def test_other_users_locks_prune_nothing(session, monkeypatch):
+    # a colleague's, around the window: their approved week and invoiced days
+    # on the same project are theirs alone
+    monkeypatch.setattr(
+        session.harvest,
+        "get_time_entries",
+        lambda params=None: [
+            harvest_entry("2023-12-31", 100, user_id=8, is_billed=True),
+            harvest_entry("2024-01-05", 100, user_id=8, is_locked=True, is_closed=True),
+        ],
+    )
+    plan = session.plan(START, END, "0>0|1>1", "ada@example.com")
+
+    assert plan.pruned == []
+    assert [e["spent_date"] for e in plan.entries] == [
+        "2024-01-01",
+        "2024-01-01",
+        "2024-01-02",
+        "2024-01-03",
+    ]
+
+
+def test_only_the_users_assignments_are_listed(session):
+    plan = session.plan(START, END, "0>0|1>1", "ada@example.com")
+
+    assert session.harvest.listed == [7]
+    # inactive projects and task assignments can't take time
+    assert [h["task"]["name"] for h in plan.harvest_tasks] == [
+        "Development",
+        "Meetings",
+    ]
+    assert plan.harvest_tasks[0]["client"] == {"id": 1, "name": "Acme"}
+
+
+def test_account_wide_assignments_when_the_users_are_forbidden(session, monkeypatch):
+    def forbidden(user_id):
+        response = requests.Response()
+        response.status_code = 403
+        raise requests.HTTPError(response=response)
+
+    monkeypatch.setattr(session.harvest, "get_user_project_assignments", forbidden)
+    plan = session.plan(START, END, "0>0|1>1", "ada@example.com")
+
+    assert sorted(session.harvest.listed) == ["projects", "task_assignments"]
+    assert [h["id"] for h in plan.harvest_tasks] == [5, 6]
+
+
+def test_association_and_confirmation_callables(session):
+    seen = []
+
+    def associate(toggl_tasks, harvest_tasks):
+        seen.append((len(toggl_tasks), len(harvest_tasks)))
+        return build_task_association(toggl_tasks, harvest_tasks, [([0], [1])])
+
+    result = session.sync(
+        START,
+        END,
+        associate,
+        "ada@example.com",
+        confirm=lambda plan: len(plan.entries) == 2,
+    )
+
+    assert seen == [(2, 2)]
+    assert result.confirmed
+    assert [p["task_id"] for p in result.posted] == [201, 201]
+    assert "post" in result.plan.timings
+
+
+def test_bad_formula_raises_instead_of_prompting(session):
+    with pytest.raises(timesheetsync.AssociationFormulaError):
+        session.plan(START, END, "0>9", "ada@example.com")
+
+
+def test_unknown_emails_raise_instead_of_prompting(session, monkeypatch):
+    def prompt(*_args, **_kwargs):
+        raise AssertionError("prompted")
+
+    monkeypatch.setattr(timesheetsync.typer, "prompt", prompt)
+    with pytest.raises(LookupError, match="nobody@example.com"):
+        session.plan(START, END, "0>0", "nobody@example.com")
+
+    # whoever wants to ask passes a function picking from the users
+    plan = session.plan(START, END, "0>0", lambda users: users[0]["email"])
+    assert plan.harvest_user_id == 7
+
+
+def test_sessions_keep_to_their_own_files(session, tmp_path):
+    other = timesheetsync.SyncSession(
+        session.toggl,
+        session.harvest,
+        fingerprint_file=tmp_path / "other" / "fingerprints",
+        stats_file=tmp_path / "other" / "stats",
+    )
+    (tmp_path / "other").mkdir()
+
+    session.sync(START, END, "0>0", "ada@example.com", confirm=True)
+    assert not (tmp_path / "other" / "stats").exists()
+    other.sync(START, END, "0>0", "ada@example.com", confirm=True)
+
+    for name in ("fingerprints", "stats"):
+        assert (tmp_path / name).exists()
+        assert (tmp_path / "other" / name).exists()
+
+
+def test_concurrent_syncs_share_a_warm_session(session):
+    session.coalescer = Coalescer()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(
+            pool.map(
+                lambda _: session.sync(
+                    START, END, "0,1>0", "ada@example.com", confirm=True
+                ),
+                range(8),
+            )
+        )
+
+    assert all(len(r.posted) == 3 for r in results)
+    assert len(session.harvest.posted) == 8 * 3
+    # overlapping syncs of the same window shared downloads
+    assert 1 <= len(session.toggl_fetches) < 8
+
+
+def test_keys_on_one_account_fetch_their_own_listings(session):
+    coalescer = Coalescer()
+    harvests = [FakeHarvest(time_entries), FakeHarvest(time_entries)]
+    harvests[1].cache_key = "42:grace"
+    listed = []
+
+    def slow_users(harvest):
+        listed.append(harvest)
+        time.sleep(0.1)
+        return FakeHarvest.get_users(harvest)
+
+    prefetches = []
+    for harvest in harvests:
+        harvest.get_users = lambda harvest=harvest: slow_users(harvest)
+        prefetches.append(
+            SyncPrefetch(
+                session.toggl, harvest, START, END, coalescer=coalescer, entries=False
+            )
+        )
+    for prefetch in prefetches:
+        with prefetch:
+            prefetch.harvest_users.result()
+
+    # a key may not see what another one on the same account can
+    assert sorted(map(id, listed)) == sorted(map(id, harvests))
+
+
+def test_org_plan_partitions_one_fetch_by_user(session, monkeypatch):
+    def entry(day, user_id, email=None):
+        return toggl_entry(day, "build", 1).model_copy(
+            update={"user_id": user_id, "email": email, "username": f"user {user_id}"}
+        )
+
+    toggl_entries = [
+        entry(1, 1),
+        entry(2, None, "ADA@example.com"),  # as a csv export names users
+        entry(1, 2),
+        entry(2, 2),
+        entry(1, 3),
+    ]
+    monkeypatch.setattr(timesheetsync, "fetch_toggl_entries", lambda *_: toggl_entries)
+    session.toggl.workspace_users = lambda: [
+        {"id": 1, "email": "ada@example.com"},
+        {"id": 2, "email": "bob@toggl.example"},
+        {"id": 3, "email": "eve@example.com"},
+    ]
+    session.harvest.get_users = lambda: [
+        {"id": 7, "email": "ada@example.com"},
+        {"id": 8, "email": "bob@example.com"},
+    ]
+    session.harvest.get_time_entries = lambda params=None: [
+        {"spent_date": "2024-01-02", "hours": 1.0, "notes": "x", "user": {"id": 8}}
+    ]
+
+    org_plan = session.plan_org(
+        START, END, "0>0", user_map={"bob@toggl.example": "bob@example.com"}
+    )
+
+    assert org_plan.unmapped == ["user 3"]
+    assert {
+        email: [(e["user_id"], e["spent_date"]) for e in plan.entries]
+        for email, plan in org_plan.plans.items()
+    } == {
+        "ada@example.com": [(7, "2024-01-01"), (7, "2024-01-02")],
+        # bob already has time in harvest on the 2nd
+        "bob@example.com": [(8, "2024-01-01")],
+    }
+    # everyone shares one task table, so it's the account's
+    assert sorted(session.harvest.listed) == ["projects", "task_assignments"]
@@ -0,0 +1,249 @@
+import base64
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import pytz
+
+import timesheetsync
+from conftest import FakeTogglApi, as_csv
+from timesheetsync import (
+    Cassette,
+    TogglExportError,
+    TogglProjectIndex,
+    TogglSession,
+    TogglTimeEntry,
+    TokenAuth,
+    anonymize_value,
+    combine_entries_by_day,
+    fetch_toggl_day_totals,
+    fetch_toggl_entries,
+    hourly_localizer,
+    iter_csv_lines,
+)
+
+TZ = pytz.timezone("Europe/Amsterdam")
+INDEX = TogglProjectIndex(
+    projects={
+        "11": {"name": "Website", "client_id": 5, "workspace_id": 1},
+        "12": {"name": "Internal", "client_id": None, "workspace_id": 1},
+    },
+    clients={"5": "Acme"},
+)
+LISTED = {
+    "projects": {
+        1: [
+            {"id": int(pid), "name": p["name"], "client_id": p["client_id"]}
+            for pid, p in INDEX.projects.items()
+        ]
+    },
+    "clients": {
+        1: [{"id": int(cid), "name": name} for cid, name in INDEX.clients.items()]
+    },
+}
+
+
+def make_entries(count: int) -> list[dict]:
+    entries = []
+    for i in range(count):
+        start = TZ.localize(datetime(2024, 1, 1) + timedelta(hours=i))
+        entries.append(
+            {
+                "id": 1000 + i,
+                "project_id": [11, 12, None][i % 3],
+                "description": (
+                    'fix "login", again\nand again' if i == 7 else f"task {i % 5}"
+                ),
+                "billable": i % 2 == 0,
+                "seconds": 1800 + i,
+                "start": start,
+                "stop": start + timedelta(seconds=1800 + i),
+            }
+        )
+    return entries
+
+
+def fake_api(entries, **options) -> FakeTogglApi:
+    """The api with `entries`, listing INDEX's projects and clients to name them."""
+    return FakeTogglApi(entries, **(LISTED | options))
+
+
+@pytest.fixture
+def toggl_for(toggl_for):
+    """Sessions on a single workspace, indexed as INDEX without listing it."""
+
+    def make(fake: FakeTogglApi) -> TogglSession:
+        return toggl_for(
+            fake,
+            workspaces=lambda: [SimpleNamespace(id=1)],
+            project_index=lambda refresh=False: INDEX,
+        )
+
+    return make
+
+
+def summarize(entries):
+    return [
+        (e.project_id, e.description, e.billable, e.seconds, e.start) for e in entries
+    ]
+
+
+def fetch(toggl, export=True):
+    return fetch_toggl_entries(
+        toggl, datetime(2024, 1, 1), datetime(2024, 3, 1), TZ, export=export
+    )
+
+
+def test_csv_lines_keep_quoted_newlines():
+    body = 'a,b\r\n1,"two\nlines"\r\nß,4'.encode()
+    chunks = [body[i : i + 3] for i in range(0, len(body), 3)]
+
+    rows = list(csv.reader(iter_csv_lines(chunks)))
+
+    assert rows == [["a", "b"], ["1", "two\nlines"], ["ß", "4"]]
+
+
+def test_hourly_localizer_across_dst():
+    localize = hourly_localizer(TZ)
+    for minutes in range(0, 6 * 60, 7):
+        naive = datetime(2024, 3, 31) + timedelta(minutes=minutes)
+        assert localize(naive) == TZ.localize(naive)
+        assert localize(naive).utcoffset() == TZ.localize(naive).utcoffset()
+
+
+@pytest.mark.parametrize(
+    "update",
+    [{"End date": "", "End time": ""}, {"Duration": "1 day"}, {"Duration": "-"}],
+)
+def test_unreadable_export_rows(update):
+    body = as_csv(make_entries(1), fake_api([]).names)
+    row = next(csv.DictReader(io.StringIO(body.decode())))
+    TogglTimeEntry.from_export_row(row, "11", TZ.localize)
+
+    with pytest.raises(TogglExportError):
+        TogglTimeEntry.from_export_row({**row, **update}, "11", TZ.localize)
+
+
+def test_export_matches_paged_search(toggl_for):
+    fake = fake_api(make_entries(120))
+
+    exported = fetch(toggl_for(fake))
+    assert len(fake.requests) == 1
+    paged = fetch(toggl_for(fake), export=False)
+
+    assert summarize(exported) == summarize(paged)
+    assert exported[0].project_id in ("11", "12", "-1")
+
+
+@pytest.mark.parametrize(
+    ("fake", "expected_requests"),
+    [
+        (fake_api(make_entries(60), csv_status=402), 1 + 3),
+        # a project the index doesn't know about can't be mapped back to an id
+        (
+            fake_api(
+                make_entries(60) + [dict(make_entries(1)[0], project_id=99)],
+                projects={
+                    1: LISTED["projects"][1]
+                    + [{"id": 99, "name": "Brand new", "client_id": 5}]
+                },
+            ),
+            1 + 3,
+        ),
+        # rows that can't be parsed, like a timer that hasn't stopped yet
+        (fake_api(make_entries(60), running=True), 1 + 3),
+    ],
+)
+def test_export_falls_back_to_paged_search(toggl_for, fake, expected_requests):
+    entries = fetch(toggl_for(fake))
+
+    assert len(fake.requests) == expected_requests
+    assert len(entries) == len(fake.entries)
+
+
+def test_export_takes_one_request_per_window(toggl_for):
+    fake = fake_api(make_entries(1500), chunk_size=16384)
+
+    exported = fetch(toggl_for(fake))
+    export_requests = len(fake.requests)
+    fake.requests.clear()
+    paged = fetch(toggl_for(fake), export=False)
+
+    assert summarize(exported) == summarize(paged)
+    # every round trip counts against toggl's rate limit
+    assert export_requests == 1
+    assert len(fake.requests) == 1500 // timesheetsync.TOGGL_REPORT_PAGE_SIZE + 1
+
+
+def daily_tasks(entries, start, end):
+    combined = combine_entries_by_day(entries, [], start, end, TZ)
+    return {
+        day: {
+            pid: {task: round(hours, 6) for task, hours in tasks.items()}
+            for pid, tasks in entry["toggl"]["tasks"].items()
+        }
+        for day, entry in combined.items()
+    }
+
+
+@pytest.mark.parametrize(
+    ("csv_status", "expected_requests"),
+    [
+        (200, 2),
+        # both exports are refused, and 144 + 56 entries are paged through instead
+        (402, 2 + (3 + 1) + (2 + 1)),
+    ],
+)
+def test_day_totals_match_detailed_entries(toggl_for, csv_status, expected_requests):
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 11)
+    fake = fake_api(make_entries(200), csv_status=csv_status)
+
+    totals = fetch_toggl_day_totals(toggl_for(fake), start, end, TZ, window_days=6)
+    assert len(fake.requests) == expected_requests
+    detailed = fetch_toggl_entries(toggl_for(fake), start, end, TZ)
+
+    assert len(totals) < len(detailed)
+    assert daily_tasks(totals, start, end) == daily_tasks(detailed, start, end)
+
+
+def test_anonymized_cassettes_replay_the_export(monkeypatch, tmp_path):
+    fake = fake_api(make_entries(120))
+    monkeypatch.setattr(httpx, "HTTPTransport", lambda **_: httpx.MockTransport(fake))
+    path = tmp_path / "sync.cassette.gz"
+
+    def fetch_through(cassette):
+        toggl = TogglSession(
+            TokenAuth("key"), cache_file=tmp_path / "cache", cassette=cassette
+        )
+        monkeypatch.setattr(toggl, "workspaces", lambda: [SimpleNamespace(id=1)])
+        try:
+            return fetch(toggl)
+        finally:
+            toggl.close()
+
+    cassette = Cassette(path, "record", anonymize=True)
+    recorded = fetch_through(cassette)
+    cassette.save()
+    # the project listing, the client listing and the export
+    assert len(fake.requests) == 3
+
+    with gzip.open(path, "rt") as f:
+        bodies = b"".join(
+            base64.b64decode(json.loads(line)["body"]) for line in list(f)[1:]
+        )
+    for secret in (b"ada@example.com", b"Ada", b"Acme", b"Website", b"task 1"):
+        assert secret not in bodies
+
+    replayed = fetch_through(Cassette(path, "replay", latency_scale=0))
+    assert len(fake.requests) == 3
+    assert [(e.project_id, e.seconds, e.start) for e in replayed] == [
+        (e.project_id, e.seconds, e.start) for e in recorded
+    ]
+    assert [e.description for e in replayed] == [
+        anonymize_value(e.description) for e in recorded
+    ]
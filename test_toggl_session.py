@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+
+import timesheetsync
+from conftest import ME, TOKEN, FakeTogglApi
+from timesheetsync import (
+    TogglProjectIndex,
+    presentation_table,
+    toggl_task_table,
+)
+
+
+def test_me_is_cached_without_the_api_token(toggl_for, tmp_path):
+    fake = FakeTogglApi()
+    toggl = toggl_for(fake)
+    assert toggl.me().api_token == TOKEN
+    toggl.close()
+
+    assert TOKEN not in (tmp_path / "cache").read_text()
+
+    toggl = toggl_for(fake)
+    assert toggl.timezone().zone == "Europe/Amsterdam"
+    assert toggl.me().api_token is None
+    assert len(fake.requests) == 1
+    toggl.close()
+
+
+def test_caches_holding_the_api_token_are_written_over(toggl_for, tmp_path):
+    fake = FakeTogglApi()
+    toggl = toggl_for(fake)
+    toggl.cache.set("{}:me".format(toggl.cache_key), ME)
+
+    toggl.me()
+    toggl.close()
+
+    assert TOKEN not in (tmp_path / "cache").read_text()
+    assert len(fake.requests) == 1
+
+
+def project(pid: int, name: str, client_id: int | None = None) -> dict:
+    return {"id": pid, "name": name, "client_id": client_id}
+
+
+def test_project_index_pages_through_every_workspace(toggl_for, monkeypatch):
+    monkeypatch.setattr(timesheetsync, "TOGGL_PROJECTS_PER_PAGE", 2)
+    fake = FakeTogglApi(
+        projects={
+            1: [
+                project(11, "Website", 5),
+                project(12, "Internal"),
+                project(13, "Ads", 6),
+            ],
+            2: [project(21, "Website", 7), project(22, "Brand", 7)],
+        },
+        clients={1: [{"id": 5, "name": "Acme"}, {"id": 6, "name": "Globex"}]},
+    )
+    toggl = toggl_for(fake)
+    monkeypatch.setattr(
+        toggl, "workspaces", lambda: [SimpleNamespace(id=1), SimpleNamespace(id=2)]
+    )
+
+    index = toggl.project_index()
+
+    assert sorted(index.projects) == ["11", "12", "13", "21", "22"]
+    assert index.clients == {"5": "Acme", "6": "Globex"}
+    # 2 + 2 pages of projects, the last one short or empty, and one client listing each
+    assert sorted(fake.requests) == sorted(
+        ["/api/v9/workspaces/1/projects"] * 2
+        + ["/api/v9/workspaces/2/projects"] * 2
+        + ["/api/v9/workspaces/1/clients", "/api/v9/workspaces/2/clients"]
+    )
+    assert index.project_ids(1) == {
+        ("Acme", "Website"): "11",
+        ("", "Internal"): "12",
+        ("Globex", "Ads"): "13",
+    }
+
+    # and it's remembered
+    assert toggl.project_index() == index
+    assert len(fake.requests) == 6
+    toggl.close()
+
+
+def test_project_index_names_unknown_projects_and_clients():
+    index = TogglProjectIndex(
+        projects={
+            "11": {"name": "Website", "client_id": 5},
+            "12": {"name": "Internal", "client_id": None},
+            # its client since deleted, or in a workspace that wasn't listed
+            "13": {"name": "Ads", "client_id": 6},
+        },
+        clients={"5": "Acme"},
+    )
+
+    assert (index.project_name("11"), index.client_name("11")) == ("Website", "Acme")
+    assert (index.project_name("12"), index.client_name("12")) == ("Internal", "")
+    assert (index.project_name("13"), index.client_name("13")) == ("Ads", "")
+    # a project not in the index shows its id, no project at all shows nothing
+    assert (index.project_name("99"), index.client_name("99")) == ("99", "")
+    assert (index.project_name("-1"), index.client_name("-1")) == ("", "")
+
+
+def test_task_tables_show_the_toggl_client():
+    index = TogglProjectIndex(
+        projects={
+            "11": {"name": "Website", "client_id": 5},
+            "12": {"name": "Internal", "client_id": None},
+        },
+        clients={"5": "Acme"},
+    )
+    entries = [
+        SimpleNamespace(project_id=pid, description=description, start=hour)
+        for hour, (pid, description) in enumerate(
+            [("11", "build"), ("12", "meeting"), ("99", "gone"), ("11", "build")]
+        )
+    ]
+
+    toggl_tasks = toggl_task_table(entries, index)
+    assert [(t["client"], t["project"], t["description"]) for t in toggl_tasks] == [
+        ("Acme", "Website", "build"),
+        ("", "Internal", "meeting"),
+        ("", "99", "gone"),
+    ]
+
+    harvest_tasks = [
+        {
+            "client": {"name": "Acme"},
+            "project": {"name": "Site"},
+            "task": {"name": "Development"},
+        }
+    ]
+    table, header = presentation_table(toggl_tasks, harvest_tasks)
+    assert header[:4] == [
+        "Toggl #",
+        "Toggl Client",
+        "Toggl Project",
+        "Toggl Task Desc.",
+    ]
+    assert [row[:4] for row in table] == [
+        [0, "Acme", "Website", "build"],
+        [1, "", "Internal", "meeting"],
+        [2, "", "99", "gone"],
+    ]
+    assert table[0][5:] == ["Acme", "Site", "Development"]
+    assert table[1][4:] == [None] * 4
@@ -0,0 +1,356 @@
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import pytz
+
+import timesheetsync
+from timesheetsync import (
+    Debouncer,
+    TogglTimeEntry,
+    TogglWebhookHandler,
+    WebhookSync,
+    harvest_day_delta,
+    verify_toggl_signature,
+)
+
+SECRET = "s3cret"
+UTC = pytz.utc
+ASSOCIATION = {
+    "11": {
+        "build": {"harvest_project_id": [100], "harvest_task_id": [200]},
+        "review": {"harvest_project_id": [100], "harvest_task_id": [201]},
+    }
+}
+
+
+def sign(body: bytes, secret: str = SECRET) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_signatures():
+    body = b'{"a": 1}'
+    assert verify_toggl_signature(SECRET, body, sign(body))
+    assert not verify_toggl_signature(SECRET, body, sign(body, "other"))
+    assert not verify_toggl_signature(SECRET, body + b" ", sign(body))
+    assert not verify_toggl_signature(SECRET, body, None)
+
+
+def test_debouncer_collapses_bursts():
+    calls = []
+    debouncer = Debouncer(0.05, calls.append)
+    for _ in range(10):
+        debouncer.touch("a")
+        time.sleep(0.005)
+    debouncer.touch("b")
+
+    wait_until(lambda: len(calls) == 2)
+    time.sleep(0.1)
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_day_delta_leaves_unmanaged_entries_alone():
+    managed = {(100, 200, "build"), (100, 201, "review")}
+    existing = [
+        {"id": i, "project": {"id": 100}, "task": {"id": task}, "notes": notes}
+        | {"hours": 1.0}
+        for i, task, notes in [
+            (1, 200, "build"),
+            (2, 200, "build"),
+            (3, 201, "review"),
+            (4, 200, "lunch"),
+        ]
+    ]
+    desired = [
+        {"project_id": 100, "task_id": 200, "notes": "build", "hours": 2.5},
+        {"project_id": 100, "task_id": 201, "notes": "docs", "hours": 0.5},
+    ]
+
+    delta = harvest_day_delta(desired, existing, managed)
+
+    assert delta.create == [desired[1]]
+    assert delta.update == [(1, {"hours": 2.5})]
+    # the duplicate and the review no toggl task has any more; never "lunch"
+    assert sorted(delta.delete) == [2, 3]
+
+
+class FakeAccounts:
+    """Toggl and harvest, as far as the receiver can see them."""
+
+    def __init__(self):
+        self.toggl_entries: dict[int, dict] = {}
+        self.harvest_entries: dict[int, dict] = {
+            # typed straight into harvest, nothing a sync would create
+            1: {
+                "id": 1,
+                "user": {"id": 7},
+                "spent_date": "2024-01-01",
+                "project": {"id": 100},
+                "task": {"id": 200},
+                "notes": "lunch",
+                "hours": 1.0,
+            }
+        }
+        self.ids = itertools.count(10)
+        self.toggl_calls = 0
+        self.toggl_failures = 0
+        self.harvest_calls = 0
+        self.lock = threading.Lock()
+
+    # toggl
+    def timezone(self):
+        return UTC
+
+    def workspaces(self):
+        return [SimpleNamespace(id=1)]
+
+    def fetch_window_pages(self, _toggl, _wid, window, _tz, export=True, user_ids=None):
+        assert export is False and user_ids is not None
+        with self.lock:
+            self.toggl_calls += 1
+            if self.toggl_failures:
+                self.toggl_failures -= 1
+                raise httpx.ConnectError("toggl is down")
+            return [
+                [
+                    TogglTimeEntry.model_construct(
+                        project_id=str(e["project_id"]),
+                        description=e["description"],
+                        billable=False,
+                        username="",
+                        user_id=e["user_id"],
+                        seconds=e["duration"],
+                        start=datetime.fromisoformat(e["start"]),
+                    )
+                    for e in self.toggl_entries.values()
+                    if window[0] <= datetime.fromisoformat(e["start"]) <= window[1]
+                    and e["user_id"] in user_ids
+                ]
+            ]
+
+    # harvest
+    def get_time_entries(self, params):
+        with self.lock:
+            self.harvest_calls += 1
+            return [
+                dict(e)
+                for e in self.harvest_entries.values()
+                if e["spent_date"] == params["from"]
+                and e["user"]["id"] == params["user_id"]
+            ]
+
+    def post_all(self, url, data):
+        with self.lock:
+            self.harvest_calls += 1
+            entry_id = next(self.ids)
+            self.harvest_entries[entry_id] = {
+                "id": entry_id,
+                "user": {"id": data["user_id"]},
+                "spent_date": data["spent_date"],
+                "project": {"id": data["project_id"]},
+                "task": {"id": data["task_id"]},
+                "notes": data["notes"],
+                "hours": data["hours"],
+            }
+
+    def patch(self, url, data):
+        with self.lock:
+            self.harvest_calls += 1
+            self.harvest_entries[int(url.rsplit("/", 1)[1])].update(data)
+
+    def delete(self, url):
+        with self.lock:
+            self.harvest_calls += 1
+            del self.harvest_entries[int(url.rsplit("/", 1)[1])]
+
+    def harvest_day(self, day):
+        return sorted(
+            (e["notes"], e["hours"])
+            for e in self.harvest_entries.values()
+            if e["spent_date"] == day
+        )
+
+
+class EventGenerator:
+    """Changes toggl entries and sends the signed events toggl would send."""
+
+    def __init__(self, url: str, accounts: FakeAccounts):
+        self.url = url
+        self.accounts = accounts
+        self.ids = itertools.count(1000)
+
+    def send(self, event: dict, secret: str = SECRET):
+        body = json.dumps(event).encode()
+        request = urllib.request.Request(
+            self.url, data=body, headers={"X-Webhook-Signature-256": sign(body, secret)}
+        )
+        try:
+            with urllib.request.urlopen(request) as r:
+                return r.status, json.loads(r.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def event(self, action: str, entry: dict):
+        return self.send(
+            {
+                "event_id": next(self.ids),
+                "created_at": datetime.now(UTC).isoformat(),
+                "metadata": {
+                    "action": action,
+                    "model": "time_entry",
+                    "event_user_id": str(entry["user_id"]),
+                    "workspace_id": "1",
+                },
+                "payload": entry,
+            }
+        )
+
+    def create(self, user_id, start, hours, description, project_id=11):
+        entry = {
+            "id": next(self.ids),
+            "user_id": user_id,
+            "project_id": project_id,
+            "description": description,
+            "start": start.isoformat(),
+            "duration": int(hours * 3600),
+        }
+        self.accounts.toggl_entries[entry["id"]] = entry
+        self.event("created", entry)
+        return entry["id"]
+
+    def update(self, entry_id, **changes):
+        if "start" in changes:
+            changes["start"] = changes["start"].isoformat()
+        entry = self.accounts.toggl_entries[entry_id]
+        entry.update(changes)
+        self.event("updated", dict(entry))
+
+    def delete(self, entry_id):
+        self.event("deleted", self.accounts.toggl_entries.pop(entry_id))
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    accounts = FakeAccounts()
+    monkeypatch.setattr(
+        timesheetsync, "fetch_toggl_window_pages", accounts.fetch_window_pages
+    )
+    webhook = WebhookSync(
+        accounts,  # pyright: ignore[reportArgumentType]
+        accounts,  # pyright: ignore[reportArgumentType]
+        ASSOCIATION,
+        harvest_users={1: 7},
+        debounce=0.1,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TogglWebhookHandler)
+    server.webhook = webhook
+    server.secret = SECRET
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = "http://127.0.0.1:{}/toggl".format(server.server_port)
+    yield webhook, accounts, EventGenerator(url, accounts)
+
+    server.shutdown()
+    server.server_close()
+    webhook.close()
+
+
+def test_ping_and_bad_signatures(receiver):
+    webhook, accounts, events = receiver
+
+    status, body = events.send({"payload": "ping", "validation_code": "abc"})
+    assert (status, body) == (200, {"validation_code": "abc"})
+
+    status, _ = events.send({"payload": "ping"}, secret="wrong")
+    assert status == 401
+
+
+def test_events_push_day_deltas(receiver):
+    webhook, accounts, events = receiver
+    day1 = datetime(2024, 1, 1, 9, tzinfo=UTC)
+    day2 = day1 + timedelta(days=1)
+
+    # nothing happens, and nothing is asked of either api
+    time.sleep(0.3)
+    assert accounts.toggl_calls == accounts.harvest_calls == 0
+
+    # a burst on one day is pushed once
+    build = events.create(1, day1, 1, "build")
+    events.update(build, duration=2 * 3600)
+    review = events.create(1, day1 + timedelta(hours=3), 0.5, "review")
+    events.create(2, day1, 4, "build")  # nobody in harvest
+    events.create(1, day1, 1, "not associated")
+    wait_until(lambda: len(webhook.pushed) == 1)
+
+    assert accounts.toggl_calls == 1
+    assert accounts.harvest_day("2024-01-01") == [
+        ("build", 2.0),
+        ("lunch", 1.0),
+        ("review", 0.5),
+    ]
+
+    # moving an entry to another day updates both
+    events.update(build, start=day2)
+    wait_until(lambda: len(webhook.pushed) == 3)
+    assert accounts.harvest_day("2024-01-01") == [("lunch", 1.0), ("review", 0.5)]
+    assert accounts.harvest_day("2024-01-02") == [("build", 2.0)]
+
+    events.delete(review)
+    wait_until(lambda: len(webhook.pushed) == 4)
+    assert accounts.harvest_day("2024-01-01") == [("lunch", 1.0)]
+
+    # and it's quiet again
+    calls = (accounts.toggl_calls, accounts.harvest_calls)
+    time.sleep(0.3)
+    assert (accounts.toggl_calls, accounts.harvest_calls) == calls
+
+
+def test_failed_pushes_are_retried(receiver, monkeypatch):
+    webhook, accounts, events = receiver
+    day = datetime(2024, 1, 1, 9, tzinfo=UTC)
+
+    accounts.toggl_failures = 2
+    events.create(1, day, 1, "build")
+    wait_until(lambda: len(webhook.pushed) == 1)
+    assert accounts.toggl_calls == 3
+    assert accounts.harvest_day("2024-01-01") == [("build", 1.0), ("lunch", 1.0)]
+    assert webhook.failures == {}
+
+    # past the retries, the day waits for its next event
+    accounts.toggl_failures = timesheetsync.WEBHOOK_RETRIES + 1
+    events.create(1, day + timedelta(days=1), 1, "build")
+    wait_until(lambda: accounts.toggl_calls == 3 + timesheetsync.WEBHOOK_RETRIES + 1)
+    time.sleep(0.3)
+    assert accounts.toggl_calls == 3 + timesheetsync.WEBHOOK_RETRIES + 1
+    assert len(webhook.pushed) == 1 and webhook.failures == {}
+
+
+def test_remembered_entries_and_deltas_are_bounded(receiver, monkeypatch):
+    webhook, accounts, events = receiver
+    monkeypatch.setattr(timesheetsync, "WEBHOOK_ENTRIES", 2)
+    day = datetime(2024, 1, 1, 9, tzinfo=UTC)
+
+    ids = [events.create(1, day + timedelta(days=i), 1, "build") for i in range(3)]
+    assert list(webhook.entry_days) == ids[1:]
+    # seeing an entry again makes it the most recent
+    events.update(ids[1], duration=2 * 3600)
+    events.create(1, day, 1, "review")
+    assert list(webhook.entry_days)[0] == ids[1]
+    assert webhook.pushed.maxlen == timesheetsync.WEBHOOK_HISTORY
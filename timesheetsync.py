@@ -1,9 +1,43 @@
-from contextlib import contextmanager
-from dataclasses import asdict, dataclass
+import base64
+import bisect
+import codecs
+from collections import deque
+import contextvars
+import math
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+import copy
+import csv
+from dataclasses import asdict, dataclass, field
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
+import os
 import pathlib
-from typing import Annotated, Any, Literal, TypedDict, override
-from datetime import datetime, timedelta
+import queue
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    TypedDict,
+    override,
+)
+from datetime import date, datetime, timedelta
 import click
 from click.core import ParameterSource
 from pydantic import AwareDatetime, BaseModel, BeforeValidator
@@ -12,14 +46,32 @@ import dateutil.parser
 import pprint
 from tabulate import tabulate
 import dateparser
-import re
+import httpx
 import requests
+import requests.adapters
+import requests.structures
 import textwrap
+import urllib.parse
 from toggl_python import ReportTimeEntry, SearchReportTimeEntriesResponse, Workspace
+from toggl_python import SearchReportTimeEntriesRequest
 from toggl_python import BasicAuth, TokenAuth, auth as toggl_auth_
+from toggl_python import MeResponse, WorkspaceResponse
+from toggl_python.api import COMMON_HEADERS as TOGGL_HEADERS, ROOT_URL as TOGGL_API_URL
 from toggl_python.entities import user as toggl_user
+from toggl_python.entities.report_time_entry import REPORT_ROOT_URL as TOGGL_REPORTS_URL
+from toggl_python.exceptions import BadRequest
 import typer
 
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
 HARVEST_API_BASE_URL = "https://api.harvestapp.com/v2"
 HARVEST_TIME_ENTRIES_URL = HARVEST_API_BASE_URL + "/time_entries"
 HARVEST_USERS_URL = HARVEST_API_BASE_URL + "/users"
@@ -27,6 +79,112 @@ HARVEST_CLIENTS_URL = HARVEST_API_BASE_URL + "/clients"
 HARVEST_TASKS_URL = HARVEST_API_BASE_URL + "/tasks"
 HARVEST_TASK_ASSIGNMENTS_URL = HARVEST_API_BASE_URL + "/task_assignments"
 HARVEST_PROJECTS_URL = HARVEST_API_BASE_URL + "/projects"
+HARVEST_USER_PROJECT_ASSIGNMENTS_URL = (
+    HARVEST_API_BASE_URL + "/users/{}/project_assignments"
+)
+
+# the fields of each harvest listing the sync actually uses, everything else is
+# dropped as the page is decoded
+HARVEST_FIELDS: dict[str, tuple[str, ...]] = {
+    "users": ("id", "email", "first_name", "last_name"),
+    "time_entries": (
+        "id",
+        "spent_date",
+        "hours",
+        "hours_without_timer",
+        "rounded_hours",
+        "notes",
+        "is_locked",
+        "locked_reason",
+        "is_closed",
+        "is_billed",
+        "user.id",
+        "client.id",
+        "client.name",
+        "project.id",
+        "project.name",
+        "task.id",
+        "task.name",
+    ),
+    "clients": ("id", "name"),
+    "tasks": ("id", "name"),
+    "task_assignments": ("id", "project.id", "project.name", "task.id", "task.name"),
+    # all an aggregate sync needs: which days have time, the notes' totals, and
+    # which days are locked
+    "time_entry_totals": (
+        "spent_date",
+        "hours",
+        "notes",
+        "is_locked",
+        "is_closed",
+        "is_billed",
+        "project.id",
+        "user.id",
+    ),
+    "projects": ("id", "name", "client.id", "client.name"),
+    "project_assignments": (
+        "is_active",
+        "project.id",
+        "project.name",
+        "client.id",
+        "client.name",
+        "task_assignments.id",
+        "task_assignments.is_active",
+        "task_assignments.task.id",
+        "task_assignments.task.name",
+    ),
+}
+
+TOGGL_CACHE_TTL = timedelta(hours=12)
+TOGGL_PROJECTS_PER_PAGE = 200
+TOGGL_REPORT_PAGE_SIZE = 50
+HARVEST_PER_PAGE = 100
+# the columns of toggl's detailed report csv export the sync reads
+TOGGL_EXPORT_COLUMNS = (
+    "User",
+    "Client",
+    "Project",
+    "Description",
+    "Billable",
+    "Start date",
+    "Start time",
+    "End date",
+    "End time",
+    "Duration",
+)
+
+# published rate limits, used to estimate how long a sync will take
+TOGGL_REQUESTS_PER_SECOND = 1.0
+HARVEST_REQUESTS_PER_SECOND = 100 / 15
+# rough size of a single record in each api response, for estimating bytes
+RECORD_BYTES = {
+    "toggl_reports": 450,
+    "toggl_export": 150,
+    "time_entries": 1400,
+    "users": 900,
+    "projects": 1100,
+    "task_assignments": 700,
+    "posts": 1400,
+}
+SYNC_STATS_TTL = timedelta(days=30)
+# the days in the first slice of a sync planned under --max-memory, before the
+# memory it takes is known
+MEMORY_SLICE_DAYS = 7
+# the most days in one shard of a backfill, a single toggl report window
+SHARD_DAYS = 180
+# the --processes `plan` estimates a sync with
+SYNC_PROCESSES = (1, 2, 4)
+
+# every request gets these timeouts, cut short to what's left of a --deadline
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_READ_TIMEOUT = 60.0
+# idempotent requests slower than this share of recent ones (and than
+# HEDGE_MIN_SECONDS) get a second copy sent alongside, and are retried this
+# many times after timeouts and connection errors
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_SECONDS = 1.0
+HTTP_RETRIES = 2
 
 
 class MutuallyExclusiveOption(click.ParamType):
@@ -97,59 +255,513 @@ class MutuallyExclusiveOption(click.ParamType):
         return super(MutuallyExclusiveOption, self).convert(value, param, ctx)
 
 
+def compile_projection(fields: Iterable[str]) -> dict[str, Any]:
+    """Turn dotted field paths into a nested dict, with None marking kept leaves."""
+    projection: dict[str, Any] = {}
+    for path in fields:
+        node = projection
+        *parents, leaf = path.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = None
+
+    return projection
+
+
+def project_fields(value: Any, projection: dict[str, Any] | None) -> Any:
+    if isinstance(value, list):
+        return [project_fields(item, projection) for item in value]
+    if projection is None or not isinstance(value, dict):
+        return value
+
+    return {
+        key: project_fields(value[key], sub_projection)
+        for key, sub_projection in projection.items()
+        if key in value
+    }
+
+
+def iter_json_list(
+    chunks: Iterable[bytes],
+    list_key: str,
+    projection: dict[str, Any] | None = None,
+    meta: dict[str, Any] | None = None,
+) -> Iterator[Any]:
+    """Incrementally decode `{..., list_key: [...], ...}`, yielding each list item.
+
+    Only the item currently being decoded and the unread part of the current chunk
+    are held in memory. Other top level values are stored in `meta`.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    exhausted = False
+    meta = {} if meta is None else meta
+
+    def fill() -> bool:
+        nonlocal buffer, position, exhausted
+        if exhausted:
+            return False
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            exhausted = True
+            chunk = b""
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=exhausted)
+        position = 0
+        return True
+
+    def peek() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                raise ValueError("Unexpected end of json document")
+
+    def expect(char: str):
+        nonlocal position
+        if peek() != char:
+            raise ValueError(
+                "Expected {!r} but found {!r} in json document".format(char, peek())
+            )
+        position += 1
+
+    def value() -> Any:
+        nonlocal position
+        peek()
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(buffer) and not exhausted:
+                fill()
+                continue
+            position = end
+            return decoded
+
+    expect("{")
+    while peek() != "}":
+        key = value()
+        expect(":")
+        if key == list_key and peek() == "[":
+            expect("[")
+            while peek() != "]":
+                yield project_fields(value(), projection)
+                if peek() == ",":
+                    expect(",")
+            expect("]")
+        else:
+            meta[key] = value()
+        if peek() == ",":
+            expect(",")
+
+
+def iter_csv_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Incrementally decode utf-8 chunks into lines, keeping their line endings.
+
+    Line endings are kept so `csv.reader` can tell a quoted newline from the end
+    of a row.
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    partial = ""
+    for chunk in chunks:
+        lines = (partial + text_decoder.decode(chunk)).splitlines(keepends=True)
+        # the last line may continue in the next chunk
+        partial = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+
+    rest = partial + text_decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+
+class DeadlineExceeded(TimeoutError):
+    """The run's time budget ran out before its work did."""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """A time budget shared by every request made on behalf of one run.
+
+    Without `seconds` there's no budget, and requests only get the default
+    connect and read timeouts.
+    """
+
+    seconds: float | None = None
+    expires_at: float | None = field(default=None, init=False)
+
+    def __post_init__(self):
+        if self.seconds is not None:
+            object.__setattr__(self, "expires_at", time.monotonic() + self.seconds)
+
+    @classmethod
+    def until(cls, wall_time: float | None) -> "Deadline":
+        """The budget left until a `time.time()`, to hand a deadline to a process."""
+        return cls(None if wall_time is None else wall_time - time.time())
+
+    def remaining(self) -> float | None:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def wall_time(self) -> float | None:
+        """When the budget runs out, as a `time.time()` other processes can share."""
+        remaining = self.remaining()
+        return None if remaining is None else time.time() + remaining
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded("Ran out of the {}s deadline".format(self.seconds))
+
+    def timeout(self, limit: float) -> float:
+        """`limit`, cut short to what's left of the budget."""
+        self.check()
+        remaining = self.remaining()
+        return limit if remaining is None else min(limit, remaining)
+
+
+NO_DEADLINE = Deadline()
+current_deadline: contextvars.ContextVar[Deadline] = contextvars.ContextVar(
+    "current_deadline", default=NO_DEADLINE
+)
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline):
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def with_deadline[**P, T](fn: Callable[P, T]) -> Callable[P, T]:
+    """Bind `fn` to the caller's deadline, to run it on another thread."""
+    deadline = current_deadline.get()
+
+    def run(*args: P.args, **kwargs: P.kwargs) -> T:
+        with deadline_scope(deadline):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+class LatencyTracker:
+    """Recent request latencies per host, to tell a slow request from a normal one."""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def hedge_after(self, key: str) -> float | None:
+        """The HEDGE_PERCENTILE latency, once there are enough samples to trust."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        percentile = samples[
+            min(int(len(samples) * HEDGE_PERCENTILE), len(samples) - 1)
+        ]
+        return max(percentile, HEDGE_MIN_SECONDS)
+
+
+request_latencies = LatencyTracker()
+
+
+def hedged[T](
+    attempt: Callable[[], T], hedge_after: float, discard: Callable[[T], None]
+) -> T:
+    """Run `attempt`, starting a second one if the first takes over `hedge_after`.
+
+    Whichever succeeds first wins, and the other's result is handed to
+    `discard` whenever it comes in.
+    """
+    outcomes: queue.SimpleQueue[tuple[bool, Any]] = queue.SimpleQueue()
+    attempt = with_deadline(attempt)
+
+    def run():
+        try:
+            outcomes.put((True, attempt()))
+        except Exception as e:
+            outcomes.put((False, e))
+
+    def drain(pending: int):
+        for _ in range(pending):
+            ok, value = outcomes.get()
+            if ok:
+                discard(value)
+
+    threading.Thread(target=run, daemon=True).start()
+    started = 1
+    try:
+        ok, value = outcomes.get(timeout=hedge_after)
+    except queue.Empty:
+        threading.Thread(target=run, daemon=True).start()
+        started = 2
+        ok, value = outcomes.get()
+        if not ok:
+            # the other attempt may still come through
+            ok, value = outcomes.get()
+            started = 1
+
+    if started > 1:
+        threading.Thread(target=drain, args=(started - 1,), daemon=True).start()
+    if not ok:
+        raise value
+    return value
+
+
+def deadline_request[T](
+    send: Callable[[], T],
+    host: str,
+    idempotent: bool,
+    errors: tuple[type[Exception], ...],
+    discard: Callable[[T], None],
+    hedge: bool = True,
+) -> T:
+    """Send a request within the current deadline.
+
+    `send` has to read the timeouts it uses from the deadline itself. Idempotent
+    requests are hedged once they're slower than usual for `host`, and retried
+    up to HTTP_RETRIES times after `errors`. A timeout caused by the deadline
+    running out is raised as DeadlineExceeded.
+    """
+    deadline = current_deadline.get()
+    attempts = HTTP_RETRIES + 1 if idempotent else 1
+    for attempt in range(attempts):
+        deadline.check()
+        hedge_after = request_latencies.hedge_after(host) if hedge else None
+        started = time.monotonic()
+        try:
+            if idempotent and hedge_after is not None:
+                response = hedged(send, hedge_after, discard)
+            else:
+                response = send()
+        except errors as e:
+            if deadline.expired:
+                raise DeadlineExceeded(
+                    "Ran out of the {}s deadline".format(deadline.seconds)
+                ) from e
+            if attempt == attempts - 1:
+                raise
+            continue
+        request_latencies.record(host, time.monotonic() - started)
+        return response
+
+    raise AssertionError("unreachable")
+
+
+class DeadlineSession(requests.Session):
+    """A requests session whose requests all run within the current deadline."""
+
+    def __init__(self, hedge: bool = True):
+        super().__init__()
+        self.hedge = hedge
+
+    @override
+    def request(self, method, url, *args, **kwargs):
+        def send():
+            deadline = current_deadline.get()
+            timeout = (
+                deadline.timeout(HTTP_CONNECT_TIMEOUT),
+                deadline.timeout(HTTP_READ_TIMEOUT),
+            )
+            return super(DeadlineSession, self).request(
+                method, url, *args, **{**kwargs, "timeout": timeout}
+            )
+
+        return deadline_request(
+            send,
+            urllib.parse.urlsplit(url).netloc,
+            method.upper() == "GET",
+            (requests.Timeout, requests.ConnectionError),
+            lambda response: response.close(),
+            self.hedge,
+        )
+
+
+class DeadlineTransport(httpx.BaseTransport):
+    """Sends toggl requests within the current deadline.
+
+    Report searches are POSTs, but read-only ones, so they're hedged and
+    retried like GETs.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, hedge: bool = True):
+        self.transport = transport
+        self.hedge = hedge
+
+    @staticmethod
+    def idempotent(request: httpx.Request) -> bool:
+        return request.method == "GET" or (
+            request.method == "POST" and str(request.url).startswith(TOGGL_REPORTS_URL)
+        )
+
+    @override
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        limits = request.extensions.get("timeout") or {}
+
+        def send() -> httpx.Response:
+            deadline = current_deadline.get()
+            request.extensions["timeout"] = {
+                name: deadline.timeout(limits.get(name) or default)
+                for name, default in [
+                    ("connect", HTTP_CONNECT_TIMEOUT),
+                    ("read", HTTP_READ_TIMEOUT),
+                    ("write", HTTP_READ_TIMEOUT),
+                    ("pool", HTTP_CONNECT_TIMEOUT),
+                ]
+            }
+            return self.transport.handle_request(request)
+
+        return deadline_request(
+            send,
+            request.url.host,
+            self.idempotent(request),
+            (httpx.TimeoutException, httpx.NetworkError),
+            lambda response: response.close(),
+            self.hedge,
+        )
+
+    @override
+    def close(self):
+        self.transport.close()
+
+
 class Harvest:
-    def __init__(self, hai: str, hk: str):
+    def __init__(self, hai: str, hk: str, cassette: "Cassette | None" = None):
+        """Requests go through `cassette`, by default the one the cli opened."""
         self.account_id = hai
         self.auth_key = hk
+        # tells keys apart without keeping the secret itself around
+        self.cache_key = hashlib.sha256(f"{hai}:{hk}".encode()).hexdigest()[:16]
+        cassette = cassette or state.cassette
+        # a cassette records every request sent, hedges included
+        self.session = DeadlineSession(hedge=cassette is None)
+        if cassette is not None:
+            adapter = CassetteAdapter(cassette)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
+                "Authorization": "Bearer " + self.auth_key,
+                "Harvest-Account-ID": self.account_id,
+            }
+        )
 
     def post_all(self, url: str, data: dict[str, Any]):
-        url_address = url
-        headers = {
-            "Authorization": "Bearer " + self.auth_key,
-            "Harvest-Account-ID": self.account_id,
-        }
-
-        # find out total number of pages
-        r = requests.post(url=url_address, headers=headers, data=data).json()
+        r = self.session.post(url=url, data=data)
+        r.raise_for_status()
+
+        return r.json()
+
+    def patch(self, url: str, data: dict[str, Any]):
+        r = self.session.patch(url=url, data=data)
+        r.raise_for_status()
+
+        return r.json()
+
+    def delete(self, url: str):
+        self.session.delete(url=url).raise_for_status()
+
+    def count(self, url: str, params: dict[str, Any] | None = None) -> int:
+        """Total number of records in a listing, from a single one-record page."""
+        r = self.session.get(url=url, params={**(params or {}), "per_page": 1}).json()
+        return int(r["total_entries"])
+
+    def iter_all(
+        self,
+        url: str,
+        list_key: str,
+        params: dict[str, Any] | None = None,
+        fields: Iterable[str] | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """Yield every record of a paginated listing as its page is streamed in.
+
+        Records are trimmed to `fields` (dotted paths), defaulting to the ones
+        listed for `list_key` in HARVEST_FIELDS.
+        """
+        fields = HARVEST_FIELDS.get(list_key) if fields is None else fields
+        projection = compile_projection(fields) if fields is not None else None
+        params = params or {}
+
+        page = 1
+        while page is not None:
+            meta: dict[str, Any] = {}
+            with self.session.get(
+                url=url, params={**params, "page": page}, stream=True
+            ) as response:
+                response.raise_for_status()
+                yield from iter_json_list(
+                    response.iter_content(chunk_size=64 * 1024),
+                    list_key,
+                    projection,
+                    meta,
+                )
+            page = meta.get("next_page")
 
-        return r
+    def get_all(
+        self,
+        url: str,
+        list_key: str | None = None,
+        params: dict[str, Any] | None = None,
+    ):
+        if list_key is not None:
+            return list(self.iter_all(url, list_key, params))
 
-    def get_all(self, url: str, list_key: str | None = None):
-        url_address = url
-        headers = {
-            "Authorization": "Bearer " + self.auth_key,
-            "Harvest-Account-ID": self.account_id,
-        }
+        params = params or {}
 
         # find out total number of pages
-        r_get = requests.get(url=url_address, headers=headers)
-        r = r_get.json()
+        r = self.session.get(url=url, params=params).json()
         total_pages = int(r["total_pages"])
 
         # results will be appended to this list
-        all_results = []
+        all_results = [r]
 
-        # loop through all pages and return JSON object
-        for page in range(1, total_pages + 1):
-            url = url_address + "?page=" + str(page)
-            response = requests.get(url=url, headers=headers).json()
+        # loop through the remaining pages and return JSON object
+        for page in range(2, total_pages + 1):
+            response = self.session.get(url=url, params={**params, "page": page}).json()
             all_results.append(response)
 
-        if list_key is not None:
-            data = []
-            for page in all_results:
-                data += page.get(list_key, [])
-
-            return data
-        else:
-            return all_results
+        return all_results
 
     def get_users(self):
         data = self.get_all(HARVEST_USERS_URL, "users")
         return data
 
-    def get_time_entries(self):
-        data = self.get_all(HARVEST_TIME_ENTRIES_URL, "time_entries")
+    def get_time_entries(self, params: dict[str, Any] | None = None):
+        data = self.get_all(HARVEST_TIME_ENTRIES_URL, "time_entries", params)
+        return data
+
+    def get_time_entry_totals(self, params: dict[str, Any] | None = None):
+        """Time entries trimmed to their day, hours and notes."""
+        data = list(
+            self.iter_all(
+                HARVEST_TIME_ENTRIES_URL,
+                "time_entries",
+                params,
+                fields=HARVEST_FIELDS["time_entry_totals"],
+            )
+        )
         return data
 
     def get_clients(self):
@@ -168,6 +780,13 @@ class Harvest:
         data = self.get_all(HARVEST_PROJECTS_URL, "projects")
         return data
 
+    def get_user_project_assignments(self, user_id: int | str = "me"):
+        """The projects a user can log time to, with their clients and tasks."""
+        data = self.get_all(
+            HARVEST_USER_PROJECT_ASSIGNMENTS_URL.format(user_id), "project_assignments"
+        )
+        return data
+
 
 @dataclass
 class Credentials:
@@ -203,6 +822,11 @@ class State:
     cache_file: pathlib.Path = pathlib.Path(".creds")
     cache: bool = True
     store: bool = True
+    profile: str = "default"
+    fingerprint_file: pathlib.Path = pathlib.Path(".fingerprints")
+    toggl_cache_file: pathlib.Path = pathlib.Path(".toggl-cache")
+    stats_file: pathlib.Path = pathlib.Path(".sync-stats")
+    cassette: "Cassette | None" = None
     toggl_auth: (
         toggl_auth_.BasicAuth | toggl_auth_.TokenAuth | Literal["test"] | None
     ) = None
@@ -213,24 +837,631 @@ credentials = Credentials()
 state = State()
 
 
+def read_cache(cache_file: pathlib.Path) -> dict[str, Any]:
+    try:
+        with open(cache_file, "r") as json_cache:
+            contents = json_cache.read()
+    except FileNotFoundError:
+        return {}
+
+    return (contents.strip() and json.loads(contents)) or {}
+
+
+@contextmanager
+def lock_cache(cache_file: pathlib.Path):
+    """Hold an exclusive lock on a sidecar file while the cache file is rewritten.
+
+    The cache file itself is replaced on every write, so it can't carry the lock.
+    """
+    lock_file = cache_file.with_name(cache_file.name + ".lock")
+    with open(lock_file, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_cache_changes(
+    cache_file: pathlib.Path, before: dict[str, Any], after: dict[str, Any]
+):
+    """Apply the top level keys changed between `before` and `after` to the cache file.
+
+    The file is re-read under the lock so changes made by other processes to other
+    keys in the meantime are kept, and it's replaced atomically so readers never
+    see a partially written file.
+    """
+    with lock_cache(cache_file):
+        current = read_cache(cache_file)
+        merged = dict(current)
+        for key in before.keys() - after.keys():
+            merged.pop(key, None)
+        for key, value in after.items():
+            if key not in before or before[key] != value:
+                merged[key] = value
+
+        if merged == current:
+            return
+
+        fd, tmp_name = tempfile.mkstemp(
+            dir=cache_file.parent, prefix=cache_file.name, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as json_cache:
+                json.dump(merged, json_cache)
+                json_cache.flush()
+                os.fsync(json_cache.fileno())
+            os.replace(tmp_name, cache_file)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+
 @contextmanager
 def update_cache(read: bool, store: bool, cache_file: pathlib.Path):
-    if read:
-        cache_file.touch(exist_ok=True)
-        with open(cache_file, "r") as json_cache:
-            cache_data: dict[str, Any] = (
-                (cache_file.stat(follow_symlinks=True).st_size != 0)
-                and json.load(json_cache)
-            ) or {}
-    else:
-        cache_data = {}
+    cache_data = read_cache(cache_file) if read else {}
+    before = copy.deepcopy(cache_data)
 
     try:
         yield cache_data
     finally:
-        if store:
-            with open(cache_file, "w+") as json_cache:
-                json.dump(cache_data, json_cache)
+        if store and cache_data != before:
+            write_cache_changes(cache_file, before, cache_data)
+
+
+CREDENTIAL_FIELDS = ("toggl_key", "harvest_account_id", "harvest_key")
+DEFAULT_PROFILE = "default"
+
+
+class CredentialStore:
+    """Named sets of credentials, kept together in one cache file."""
+
+    def __init__(self, cache_file: pathlib.Path):
+        self.cache_file = cache_file
+        self._profiles: dict[str, Credentials] | None = None
+
+    @staticmethod
+    def _profiles_from(cache_data: dict[str, Any]) -> dict[str, Any]:
+        # cache files written before profiles existed hold a single set of credentials
+        legacy = {k: cache_data.pop(k) for k in CREDENTIAL_FIELDS if k in cache_data}
+        if legacy:
+            cache_data[DEFAULT_PROFILE] = {
+                **legacy,
+                **cache_data.get(DEFAULT_PROFILE, {}),
+            }
+
+        return cache_data
+
+    @property
+    def profiles(self) -> dict[str, Credentials]:
+        if self._profiles is None:
+            cache_data = self._profiles_from(read_cache(self.cache_file))
+            self._profiles = {
+                name: Credentials(**{k: values.get(k) for k in CREDENTIAL_FIELDS})
+                for name, values in cache_data.items()
+            }
+
+        return self._profiles
+
+    def get(self, profile: str = DEFAULT_PROFILE) -> Credentials:
+        return self.profiles.get(profile, Credentials())
+
+    def save(self, profile: str, creds: Credentials | ConfirmedCredentials):
+        """Store the given (non-empty) credentials, writing only if they changed."""
+        updated = {k: v for k, v in asdict(creds).items() if v is not None}
+        with update_cache(True, True, self.cache_file) as cache_data:
+            profiles = self._profiles_from(cache_data)
+            profiles[profile] = {**profiles.get(profile, {}), **updated}
+
+        self._profiles = None
+
+
+# values of these keys are replaced when recording an anonymized cassette
+ANONYMIZED_KEYS = frozenset(
+    {
+        "api_token",
+        "description",
+        "email",
+        "first_name",
+        "fullname",
+        "image_url",
+        "last_name",
+        "name",
+        "notes",
+        "openid_email",
+        # summary report groups' names: descriptions, when grouped by them
+        "title",
+        "user_name",
+        "username",
+        "avatar_url",
+        "avatar_url_large",
+    }
+)
+
+
+# columns of csv report exports replaced the same way; project and client names
+# are replaced wherever they're listed, so exports still map back to their ids
+ANONYMIZED_CSV_COLUMNS = frozenset(
+    {"User", "Email", "Client", "Project", "Task", "Description", "Tags"}
+)
+
+
+def anonymize_value(value: Any) -> Any:
+    """Replace identifying strings with stable pseudonyms, keeping their cardinality."""
+    if isinstance(value, str) and value and not value.startswith("anon-"):
+        return "anon-" + hashlib.sha256(value.encode()).hexdigest()[:12]
+    return value
+
+
+def anonymize_json(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            k: anonymize_value(v) if k in ANONYMIZED_KEYS else anonymize_json(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [anonymize_json(v) for v in value]
+    return value
+
+
+def anonymize_body(body: bytes, content_type: str | None) -> bytes:
+    if not body:
+        return body
+    if content_type and "application/x-www-form-urlencoded" in content_type:
+        fields = urllib.parse.parse_qsl(body.decode(), keep_blank_values=True)
+        return urllib.parse.urlencode(
+            [(k, anonymize_value(v) if k in ANONYMIZED_KEYS else v) for k, v in fields]
+        ).encode()
+    if content_type and "text/csv" in content_type:
+        return anonymize_csv(body)
+    try:
+        return json.dumps(anonymize_json(json.loads(body))).encode()
+    except ValueError:
+        return body
+
+
+def anonymize_csv(body: bytes) -> bytes:
+    rows = csv.reader(iter_csv_lines([body]))
+    header = next(rows, None)
+    if header is None:
+        return body
+    anonymized = [i for i, name in enumerate(header) if name in ANONYMIZED_CSV_COLUMNS]
+
+    out = io.StringIO(newline="")
+    writer = csv.writer(out)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(
+            [anonymize_value(v) if i in anonymized else v for i, v in enumerate(row)]
+        )
+    return out.getvalue().encode()
+
+
+class Cassette:
+    """Http exchanges recorded from real syncs, stored as gzipped json lines.
+
+    Replayed exchanges are matched on method, url and request body, in the order
+    they were recorded, and served after their recorded latency times
+    `latency_scale`.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        mode: Literal["record", "replay"],
+        anonymize: bool = False,
+        latency_scale: float = 1.0,
+    ):
+        self.path = path
+        self.mode = mode
+        self.anonymize = anonymize
+        self.latency_scale = latency_scale
+        self.interactions: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._queues: dict[str, list[dict[str, Any]]] = {}
+
+        if mode == "replay":
+            with gzip.open(path, "rt") as cassette:
+                header = json.loads(next(cassette))
+                self.anonymize = header.get("anonymized", False)
+                for line in cassette:
+                    interaction = json.loads(line)
+                    self._queues.setdefault(interaction["key"], []).append(interaction)
+
+    def key(self, method: str, url: str, body: bytes, content_type: str | None) -> str:
+        if self.anonymize:
+            body = anonymize_body(body, content_type)
+        parts = urllib.parse.urlsplit(url)
+        query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query)))
+        return "{} {}://{}{}?{} {}".format(
+            method.upper(),
+            parts.scheme,
+            parts.netloc,
+            parts.path,
+            query,
+            hashlib.sha256(body).hexdigest()[:16],
+        )
+
+    def record(
+        self,
+        key: str,
+        status: int,
+        content_type: str | None,
+        content: bytes,
+        latency: float,
+    ):
+        if self.anonymize:
+            content = anonymize_body(content, content_type)
+        with self._lock:
+            self.interactions.append(
+                {
+                    "key": key,
+                    "status": status,
+                    "content_type": content_type,
+                    "body": base64.b64encode(content).decode(),
+                    "latency": round(latency, 4),
+                }
+            )
+
+    def play(self, key: str) -> tuple[int, str | None, bytes]:
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise LookupError("No recorded response left for {}".format(key))
+            # the last response for a key keeps answering repeated requests
+            interaction = queue.pop(0) if len(queue) > 1 else queue[0]
+
+        time.sleep(interaction["latency"] * self.latency_scale)
+        return (
+            interaction["status"],
+            interaction["content_type"],
+            base64.b64decode(interaction["body"]),
+        )
+
+    def save(self):
+        if self.mode != "record":
+            return
+        with gzip.open(self.path, "wt") as cassette:
+            cassette.write(json.dumps({"version": 1, "anonymized": self.anonymize}))
+            cassette.write("\n")
+            for interaction in self.interactions:
+                cassette.write(json.dumps(interaction))
+                cassette.write("\n")
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """Records toggl exchanges into, or replays them from, a cassette."""
+
+    def __init__(self, cassette: Cassette, transport: httpx.BaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    @override
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        content_type = request.headers.get("content-type")
+        key = self.cassette.key(
+            request.method, str(request.url), request.read(), content_type
+        )
+        if self.cassette.mode == "replay":
+            status, response_type, content = self.cassette.play(key)
+        else:
+            started = time.perf_counter()
+            response = self.transport.handle_request(request)
+            content = response.read()
+            response.close()
+            status = response.status_code
+            response_type = response.headers.get("content-type")
+            self.cassette.record(
+                key, status, response_type, content, time.perf_counter() - started
+            )
+
+        # the content is already decoded, so don't pass on any content-encoding
+        headers = {"content-type": response_type} if response_type else {}
+        return httpx.Response(status, headers=headers, content=content)
+
+    @override
+    def close(self):
+        self.transport.close()
+
+
+class CassetteAdapter(requests.adapters.HTTPAdapter):
+    """Records harvest exchanges into, or replays them from, a cassette."""
+
+    def __init__(self, cassette: Cassette, *args, **kwargs):
+        self.cassette = cassette
+        super().__init__(*args, **kwargs)
+
+    @override
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ):
+        body = request.body or b""
+        body = body.encode() if isinstance(body, str) else body
+        content_type = request.headers.get("Content-Type")
+        key = self.cassette.key(request.method, request.url, body, content_type)
+
+        if self.cassette.mode == "record":
+            started = time.perf_counter()
+            response = super().send(request, False, timeout, verify, cert, proxies)
+            self.cassette.record(
+                key,
+                response.status_code,
+                response.headers.get("Content-Type"),
+                response.content,
+                time.perf_counter() - started,
+            )
+            return response
+
+        status, response_type, content = self.cassette.play(key)
+        response = requests.Response()
+        response.status_code = status
+        response.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Type": response_type} if response_type else {}
+        )
+        response._content = content
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+
+class DiskCache:
+    """Json-serializable values kept in a cache file, each expiring after `ttl`."""
+
+    def __init__(self, cache_file: pathlib.Path, ttl: timedelta):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._data: dict[str, Any] | None = None
+
+    def get(self, key: str) -> Any | None:
+        if self._data is None:
+            self._data = read_cache(self.cache_file)
+
+        cached = self._data.get(key)
+        if cached is None or cached["expires"] < datetime.now(pytz.utc).timestamp():
+            return None
+
+        return cached["value"]
+
+    def set(self, key: str, value: Any):
+        cached = {
+            "expires": (datetime.now(pytz.utc) + self.ttl).timestamp(),
+            "value": value,
+        }
+        with update_cache(False, True, self.cache_file) as cache_data:
+            cache_data[key] = cached
+
+        if self._data is not None:
+            self._data[key] = cached
+
+    def memoize[T](
+        self,
+        key: str,
+        fetch: Callable[[], T],
+        dump: Callable[[T], Any] = lambda v: v,
+        load: Callable[[Any], T] = lambda v: v,
+        refresh: bool = False,
+    ) -> T:
+        cached = None if refresh else self.get(key)
+        if cached is not None:
+            return load(cached)
+
+        value = fetch()
+        self.set(key, dump(value))
+        return value
+
+
+class TogglExportError(ValueError):
+    """A csv report export that can't be read back into time entries."""
+
+
+@dataclass
+class TogglProjectIndex:
+    """Toggl project and client names, looked up by the ids time entries carry."""
+
+    projects: dict[str, dict[str, Any]] = field(default_factory=dict)
+    clients: dict[str, str] = field(default_factory=dict)
+
+    def project_name(self, project_id: str) -> str:
+        project = self.projects.get(str(project_id))
+        if project is None:
+            # entries without a project carry -1
+            return "" if str(project_id) == "-1" else str(project_id)
+        return project["name"]
+
+    def client_name(self, project_id: str) -> str:
+        project = self.projects.get(str(project_id))
+        if project is None or project["client_id"] is None:
+            return ""
+        return self.clients.get(str(project["client_id"]), "")
+
+    def project_ids(self, workspace_id: int) -> dict[tuple[str, str], str | None]:
+        """Project ids by (client name, project name), as csv exports name them.
+
+        Names shared by more than one project map to None.
+        """
+        ids: dict[tuple[str, str], str | None] = {}
+        for project_id, project in self.projects.items():
+            if project.get("workspace_id", workspace_id) != workspace_id:
+                continue
+            client = self.clients.get(str(project["client_id"]), "")
+            key = (client, project["name"])
+            ids[key] = None if key in ids else project_id
+
+        return ids
+
+
+class TogglSession:
+    """Toggl api wrappers that share one connection pool, with memoized lookups.
+
+    The current user and workspace list are remembered on disk for `ttl`, so
+    back to back runs don't pay for those round trips every time.
+    """
+
+    def __init__(
+        self,
+        auth: BasicAuth | TokenAuth,
+        cache_file: pathlib.Path | None = None,
+        ttl: timedelta = TOGGL_CACHE_TTL,
+        cassette: "Cassette | None" = None,
+    ):
+        self.auth = auth
+        cassette = cassette or state.cassette
+        self.transport: httpx.BaseTransport = httpx.HTTPTransport(http2=True)
+        if cassette is not None:
+            self.transport = CassetteTransport(cassette, self.transport)
+            # everything has to go over the wire to end up in (or come from) the
+            # cassette, so don't answer anything from the disk cache
+            ttl = timedelta(0)
+        self.transport = DeadlineTransport(self.transport, hedge=cassette is None)
+        self.cache = DiskCache(cache_file or state.toggl_cache_file, ttl)
+        # separate entries per account, without writing the secret itself to disk
+        self.cache_key = hashlib.sha256(auth._auth_header.encode()).hexdigest()[:16]
+
+        self.user = self._wrap(toggl_user.CurrentUser, TOGGL_API_URL)
+        self.workspace = self._wrap(Workspace, TOGGL_API_URL)
+        self.reports = self._wrap(ReportTimeEntry, TOGGL_REPORTS_URL)
+
+    def _wrap[T](self, wrapper_cls: type[T], base_url: str) -> T:
+        wrapper = wrapper_cls.__new__(wrapper_cls)
+        wrapper.client = httpx.Client(  # pyright: ignore[reportAttributeAccessIssue]
+            base_url=base_url,
+            auth=self.auth,
+            headers=TOGGL_HEADERS,
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            transport=self.transport,
+        )
+        return wrapper
+
+    def me(self, refresh: bool = False) -> MeResponse:
+        key = f"{self.cache_key}:me"
+        # caches from before the token was left out are written over
+        cached = self.cache.get(key)
+        if cached is not None and cached.get("api_token") is not None:
+            refresh = True
+        return self.cache.memoize(
+            key,
+            self.user.me,
+            # never the api token, the cache file isn't a secret
+            dump=lambda me: me.model_dump(mode="json", exclude={"api_token"}),
+            load=MeResponse.model_validate,
+            refresh=refresh,
+        )
+
+    def timezone(self) -> Any:
+        return pytz.timezone(self.me().timezone)
+
+    def workspaces(self, refresh: bool = False) -> list[WorkspaceResponse]:
+        return self.cache.memoize(
+            f"{self.cache_key}:workspaces",
+            self.workspace.list,
+            dump=lambda workspaces: [w.model_dump(mode="json") for w in workspaces],
+            load=lambda workspaces: [
+                WorkspaceResponse.model_validate(w) for w in workspaces
+            ],
+            refresh=refresh,
+        )
+
+    def workspace_users(self, refresh: bool = False) -> list[dict[str, Any]]:
+        """Everyone in the user's workspaces; listing them needs an admin's key."""
+        return self.cache.memoize(
+            f"{self.cache_key}:workspace_users",
+            self._fetch_workspace_users,
+            refresh=refresh,
+        )
+
+    def _fetch_workspace_users(self) -> list[dict[str, Any]]:
+        users: dict[int, dict[str, Any]] = {}
+        for wid in [w.id for w in self.workspaces()]:
+            response = self.workspace.client.get(f"/workspaces/{wid}/users")
+            self.workspace.raise_for_status(response)
+            for user in response.json() or []:
+                users[user["id"]] = {
+                    "id": user["id"],
+                    "email": user.get("email") or "",
+                    "fullname": user.get("fullname") or "",
+                }
+
+        return list(users.values())
+
+    def project_index(self, refresh: bool = False) -> TogglProjectIndex:
+        """Every project and client across the user's workspaces, one listing each."""
+        return self.cache.memoize(
+            f"{self.cache_key}:projects",
+            self._fetch_project_index,
+            dump=asdict,
+            load=lambda index: TogglProjectIndex(**index),
+            refresh=refresh,
+        )
+
+    def _fetch_project_index(self) -> TogglProjectIndex:
+        index = TogglProjectIndex()
+        client = self.workspace.client
+        for wid in [w.id for w in self.workspaces()]:
+            page = 1
+            while True:
+                response = client.get(
+                    f"/workspaces/{wid}/projects",
+                    params={
+                        "active": "both",
+                        "page": page,
+                        "per_page": TOGGL_PROJECTS_PER_PAGE,
+                    },
+                )
+                self.workspace.raise_for_status(response)
+                projects = response.json() or []
+                for project in projects:
+                    index.projects[str(project["id"])] = {
+                        "name": project["name"],
+                        "client_id": project.get("client_id"),
+                        "workspace_id": wid,
+                    }
+                if len(projects) < TOGGL_PROJECTS_PER_PAGE:
+                    break
+                page += 1
+
+            response = client.get(f"/workspaces/{wid}/clients")
+            self.workspace.raise_for_status(response)
+            for toggl_client in response.json() or []:
+                index.clients[str(toggl_client["id"])] = toggl_client["name"]
+
+        return index
+
+    def export_report(
+        self, wid: int, window: list[datetime]
+    ) -> Iterator[dict[str, str]]:
+        """Stream the detailed report of a workspace as csv rows, in one request."""
+        payload = SearchReportTimeEntriesRequest(
+            start_date=window[0], end_date=window[1]
+        ).model_dump(mode="json", exclude_none=True, exclude_unset=True)
+        with self.reports.client.stream(
+            "POST", f"/{wid}/search/time_entries.csv", json=payload
+        ) as response:
+            if response.is_error:
+                response.read()
+                self.reports.raise_for_status(response)
+
+            rows = csv.DictReader(iter_csv_lines(response.iter_bytes()))
+            missing = set(TOGGL_EXPORT_COLUMNS) - set(rows.fieldnames or ())
+            if missing:
+                raise TogglExportError(
+                    "Report export is missing columns: {}".format(sorted(missing))
+                )
+            yield from rows
+
+    def close(self):
+        for wrapper in (self.user, self.workspace, self.reports):
+            wrapper.client.close()
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
 
 
 app = typer.Typer()
@@ -326,15 +1557,99 @@ def main(
         bool,
         typer.Option(" /--no-store", " /-s", help="Store credentials in file"),
     ] = True,
+    profile: Annotated[
+        str,
+        typer.Option("--profile", "-p", help="Name of the stored credentials to use"),
+    ] = DEFAULT_PROFILE,
+    record: Annotated[
+        pathlib.Path | None,
+        typer.Option(
+            help="Record every toggl and harvest request and response to this file",
+        ),
+    ] = None,
+    replay: Annotated[
+        pathlib.Path | None,
+        typer.Option(
+            help="""Serve toggl and harvest responses from a recorded file instead of the network.
+            Use an explicit --daterange so the requests match the recorded ones.
+            """,
+        ),
+    ] = None,
+    anonymize: Annotated[
+        bool,
+        typer.Option(help="Replace names, emails and notes when recording"),
+    ] = False,
+    latency_scale: Annotated[
+        float,
+        typer.Option(help="Multiplier applied to recorded latencies on replay"),
+    ] = 1.0,
+    estimate: Annotated[
+        bool,
+        typer.Option(
+            help="Only estimate the requests and time the sync would take, see `plan`"
+        ),
+    ] = False,
+    aggregate: Annotated[
+        bool,
+        typer.Option(help="Download daily totals instead of every time entry"),
+    ] = False,
+    max_memory: Annotated[
+        int | None,
+        typer.Option(
+            help="""MiB of python allocations the sync may hold. The window is then
+            downloaded and combined a few days at a time, keeping only daily totals.
+            """,
+        ),
+    ] = None,
+    memory_report: Annotated[
+        bool,
+        typer.Option(help="Print the memory each stage of the sync took, and peak RSS"),
+    ] = False,
+    processes: Annotated[
+        int | None,
+        typer.Option(
+            help="""Backfill with this many worker processes, each downloading and
+            totalling its own shard of the days. Can't be combined with --max-memory.
+            """,
+        ),
+    ] = None,
+    deadline: Annotated[
+        float | None,
+        typer.Option(
+            help="""Seconds the whole run may take. Requests time out when it runs out,
+            and a sync stops posting, listing the entries it didn't get to.
+            """,
+        ),
+    ] = None,
     test: Annotated[
         bool,
         typer.Option("--test/ ", "-t/ ", help="Test mode"),
     ] = False,
 ):
+    if record is not None and replay is not None:
+        raise click.UsageError("Only one of `record` and `replay` can be given.")
+    if max_memory is not None and processes is not None:
+        raise click.UsageError("Only one of `max-memory` and `processes` can be given.")
+    if processes is not None and (record is not None or replay is not None):
+        # worker processes can't write to, or read from, the parent's cassette
+        raise click.UsageError("`processes` can't be used with `record` or `replay`.")
+    if record is not None or replay is not None:
+        state.cassette = Cassette(
+            record or replay,  # pyright: ignore[reportArgumentType]
+            "record" if record is not None else "replay",
+            anonymize,
+            latency_scale,
+        )
+        ctx.call_on_close(state.cassette.save)
+    if deadline is not None:
+        # subcommands run on this thread too, and so within the deadline
+        current_deadline.set(Deadline(deadline))
+
     if not ctx.invoked_subcommand:
         state.cache = cache
         state.cache_file = cache_file
         state.store = store
+        state.profile = profile
 
         toggl_auth = None
         harvest_auth = None
@@ -343,80 +1658,88 @@ def main(
             days, (daterange and list(daterange)) or (datebound and [datebound]) or None
         )
 
-        with update_cache(cache, store, cache_file) as cache_data:
-            credentials.toggl_key = cache_data.get("toggl_key", None)
+        credential_store = CredentialStore(cache_file)
+        stored = credential_store.get(profile) if cache else Credentials()
 
-            attempt = 0
-            while toggl_auth is None:
-                if attempt > 3:
-                    raise typer.Exit(1)
+        credentials.toggl_key = stored.toggl_key
 
-                if credentials.toggl_key is None:
-                    print("Please enter toggl login credentials...")
-                    email = typer.prompt("Toggl email")
-                    pw = typer.prompt("Toggl password", hide_input=True)
-                    toggl_auth = (
-                        toggl_login_test(email, pw) if test else toggl_login(email, pw)
-                    )
-                else:
-                    toggl_auth = (
-                        "test" if test else toggl_auth_.TokenAuth(credentials.toggl_key)
-                    )
+        attempt = 0
+        while toggl_auth is None:
+            if attempt > 3:
+                raise typer.Exit(1)
 
-                attempt += 1
-
-            print("toggl login complete")
-
-            credentials.harvest_account_id = cache_data.get("harvest_account_id", None)
-            credentials.harvest_key = cache_data.get("harvest_key", None)
-
-            attempt = 0
-            while harvest_auth is None:
-                if (credentials.harvest_account_id is None) or (
-                    credentials.harvest_key is None
-                ):
-                    if attempt > 3:
-                        raise typer.Exit(1)
-                    print("Please enter harvest login credentials...")
-                    account_id = typer.prompt("Harvest account id")
-                    key = typer.prompt("Harvest key")
-                    harvest_auth = (
-                        harvest_login_test(account_id, key)
-                        if test
-                        else harvest_login(account_id, key)
-                    )
-                else:
-                    harvest_auth = (
-                        "test"
-                        if test
-                        else Harvest(
-                            credentials.harvest_account_id, credentials.harvest_key
-                        )
+            if credentials.toggl_key is None:
+                print("Please enter toggl login credentials...")
+                email = typer.prompt("Toggl email")
+                pw = typer.prompt("Toggl password", hide_input=True)
+                toggl_auth = (
+                    toggl_login_test(email, pw) if test else toggl_login(email, pw)
+                )
+            else:
+                toggl_auth = (
+                    "test" if test else toggl_auth_.TokenAuth(credentials.toggl_key)
+                )
+
+            attempt += 1
+
+        print("toggl login complete")
+
+        credentials.harvest_account_id = stored.harvest_account_id
+        credentials.harvest_key = stored.harvest_key
+
+        attempt = 0
+        while harvest_auth is None:
+            if (credentials.harvest_account_id is None) or (
+                credentials.harvest_key is None
+            ):
+                if attempt > 3:
+                    raise typer.Exit(1)
+                print("Please enter harvest login credentials...")
+                account_id = typer.prompt("Harvest account id")
+                key = typer.prompt("Harvest key")
+                harvest_auth = (
+                    harvest_login_test(account_id, key)
+                    if test
+                    else harvest_login(account_id, key)
+                )
+            else:
+                harvest_auth = (
+                    "test"
+                    if test
+                    else Harvest(
+                        credentials.harvest_account_id, credentials.harvest_key
                     )
+                )
 
-                attempt += 1
+            attempt += 1
 
-            print("harvest login complete")
+        print("harvest login complete")
 
-            creds = ConfirmedCredentials.from_creds(credentials)
-            cache_data.update(asdict(creds))
+        creds = ConfirmedCredentials.from_creds(credentials)
+        if store:
+            credential_store.save(profile, creds)
 
         if toggl_auth != "test" and harvest_auth != "test":
-            do_sync(
-                toggl_auth,
-                harvest_auth,
-                start_date,
-                end_date,
-                "",
-            )
+            with TogglSession(toggl_auth) as toggl:
+                if estimate:
+                    print_sync_plan(toggl, harvest_auth, start_date, end_date)
+                    return
+                do_sync(
+                    toggl,
+                    harvest_auth,
+                    start_date,
+                    end_date,
+                    "",
+                    aggregate,
+                    max_memory and max_memory * 2**20,
+                    memory_report,
+                    processes,
+                )
 
 
 def login_result_callback(*_args, **_kwargs):
-    with update_cache(state.cache, state.store, state.cache_file) as cache_data:
-        updated_credentials = {
-            k: v for k, v in asdict(credentials).items() if v is not None
-        }
-        cache_data.update(updated_credentials)
+    if state.store:
+        CredentialStore(state.cache_file).save(state.profile, credentials)
 
 
 @login_app.callback(result_callback=login_result_callback)
@@ -431,10 +1754,15 @@ def login_callback(
         bool,
         typer.Option(" /--no-store", " /-s", help="Store credentials in file"),
     ] = True,
+    profile: Annotated[
+        str,
+        typer.Option("--profile", "-p", help="Name to store the credentials under"),
+    ] = DEFAULT_PROFILE,
 ):
     state.cache = True
     state.cache_file = cache_file
     state.store = store
+    state.profile = profile
 
 
 @login_app.command("harvest")
@@ -472,7 +1800,9 @@ def toggl_login(
     ],
 ):
     auth = toggl_auth_.BasicAuth(username=email, password=password)
-    user = toggl_user.CurrentUser(auth=auth).me()
+    with TogglSession(auth) as toggl:
+        # refreshing also primes the cached identity for the sync that follows
+        user = toggl.me(refresh=True)
     print("toggl auth success")
     credentials.toggl_key = user.api_token
     state.toggl_auth = auth
@@ -485,7 +1815,9 @@ def toggl_login_key(
     key: Annotated[str, typer.Option(prompt=True, help="toggl access key")],
 ):
     auth = toggl_auth_.TokenAuth(key)
-    user = toggl_user.CurrentUser(auth=auth).me()
+    with TogglSession(auth) as toggl:
+        # refreshing also primes the cached identity for the sync that follows
+        user = toggl.me(refresh=True)
     print("toggl auth success")
     credentials.toggl_key = user.api_token
     state.toggl_auth = auth
@@ -506,6 +1838,20 @@ def toggl_login_test(
     return "test"
 
 
+@app.command()
+def profiles(
+    cache_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location to look for toggl and harvest credentials",
+        ),
+    ] = pathlib.Path(".creds"),
+):
+    """List the names of the stored credential profiles."""
+    for name in sorted(CredentialStore(cache_file).profiles):
+        print(name)
+
+
 @app.command()
 def sync(
     toggl_key: Annotated[str, typer.Option("--toggl-key", "-tk", help="toggl api key")],
@@ -557,41 +1903,74 @@ def sync(
             """,
         ),
     ] = None,
+    aggregate: Annotated[
+        bool,
+        typer.Option(help="Download daily totals instead of every time entry"),
+    ] = False,
+    max_memory: Annotated[
+        int | None,
+        typer.Option(
+            help="""MiB of python allocations the sync may hold. The window is then
+            downloaded and combined a few days at a time, keeping only daily totals.
+            """,
+        ),
+    ] = None,
+    memory_report: Annotated[
+        bool,
+        typer.Option(help="Print the memory each stage of the sync took, and peak RSS"),
+    ] = False,
+    processes: Annotated[
+        int | None,
+        typer.Option(
+            help="""Backfill with this many worker processes, each downloading and
+            totalling its own shard of the days. Can't be combined with --max-memory.
+            """,
+        ),
+    ] = None,
 ):
+    if max_memory is not None and processes is not None:
+        raise click.UsageError("Only one of `max-memory` and `processes` can be given.")
     start_date, end_date = parse_date_range(
         days, (daterange and list(daterange)) or (datebound and [datebound]) or None
     )
 
-    toggl = toggl_auth_.TokenAuth(toggl_key)
     harvest = harvest_login(harvest_account_id, harvest_key)
 
-    do_sync(
-        toggl,
-        harvest,
-        start_date,
-        end_date,
-        harvest_email,
-    )
+    with TogglSession(toggl_auth_.TokenAuth(toggl_key)) as toggl:
+        do_sync(
+            toggl,
+            harvest,
+            start_date,
+            end_date,
+            harvest_email,
+            aggregate,
+            max_memory and max_memory * 2**20,
+            memory_report,
+            processes,
+        )
 
 
 class TogglTimeEntry(BaseModel):
     project_id: Annotated[str, BeforeValidator(lambda v: str(v or -1))]
     description: Annotated[str, BeforeValidator(lambda v: v or "")]
     billable: bool
-    billable_amount_in_cents: int | None
-    currency: str
-    hourly_rate_in_cents: int | None
-    row_number: int
-    tag_ids: list[int]
-    task_id: int | None
-    user_id: int
     username: str
-    at: AwareDatetime
-    at_tz: AwareDatetime
-    id: int
     seconds: int
     start: AwareDatetime
     stop: AwareDatetime
+    # only the json search has these, csv exports leave them out
+    billable_amount_in_cents: int | None = None
+    currency: str | None = None
+    hourly_rate_in_cents: int | None = None
+    row_number: int | None = None
+    tag_ids: list[int] = []
+    task_id: int | None = None
+    user_id: int | None = None
+    at: AwareDatetime | None = None
+    at_tz: AwareDatetime | None = None
+    id: int | None = None
+    # only csv exports have this, it stands in for user_id there
+    email: str | None = None
 
     @classmethod
     def from_resp(cls, resp: SearchReportTimeEntriesResponse):
@@ -602,6 +1981,33 @@ class TogglTimeEntry(BaseModel):
         new_model = cls.model_validate(combined)
         return new_model
 
+    @classmethod
+    def from_export_row(
+        cls,
+        row: dict[str, str],
+        project_id: str,
+        localize: Callable[[datetime], datetime],
+    ):
+        # running timers export without an end, and columns can be renamed
+        try:
+            hours, minutes, seconds = (int(part) for part in row["Duration"].split(":"))
+            return cls.model_construct(
+                project_id=project_id,
+                description=row["Description"],
+                billable=row["Billable"] == "Yes",
+                username=row["User"],
+                email=row.get("Email") or None,
+                seconds=hours * 3600 + minutes * 60 + seconds,
+                start=localize(
+                    datetime.fromisoformat(f"{row['Start date']}T{row['Start time']}")
+                ),
+                stop=localize(
+                    datetime.fromisoformat(f"{row['End date']}T{row['End time']}")
+                ),
+            )
+        except (KeyError, ValueError) as e:
+            raise TogglExportError("Can't read export row {}".format(row)) from e
+
 
 class HarvestTimeEntry(TypedDict):
     id: int
@@ -626,146 +2032,259 @@ class CombinedEntries(TypedDict):
     harvest: RawTaskContext[list[HarvestTimeEntry], float]
 
 
-def do_sync(
-    toggl: BasicAuth | TokenAuth,
-    harvest: Harvest,
-    start_date: datetime,
-    end_date: datetime,
-    harvest_email: str | None = None,
-):
-    """Convert Toggl time entries into Harvest timesheet entries."""
-    pp = pprint.PrettyPrinter(indent=4)
-
-    toggl_me = toggl_user.CurrentUser(toggl).me()
-    toggl_tz_str = toggl_me.timezone
-    toggl_tz = pytz.timezone(toggl_tz_str)
-
+def toggl_date_windows(
+    start_date: datetime, end_date: datetime, toggl_tz: Any, window_days: int = 180
+) -> list[list[datetime]]:
+    """Split a date range into windows small enough for the toggl reports api."""
     # do some fancy date windowing required for retrieving tasks from toggl
     toggl_dateranges = []
-    chunks = (end_date - start_date).days // 180
-    partials = (end_date - start_date).days % 180
+    chunks = (end_date - start_date).days // window_days
+    partials = (end_date - start_date).days % window_days
 
-    for i in range((end_date - start_date).days // 180):
+    for i in range(chunks):
         toggl_dateranges.append(
             [
-                start_date + timedelta(days=i * 180),
-                start_date + timedelta(days=(i + 1) * 180 - 1),
+                start_date + timedelta(days=i * window_days),
+                start_date + timedelta(days=(i + 1) * window_days - 1),
             ]
         )
 
     if partials:
         toggl_dateranges.append(
             [
-                start_date + timedelta(days=chunks * 180),
-                start_date + timedelta(days=chunks * 180 + partials),
+                start_date + timedelta(days=chunks * window_days),
+                start_date + timedelta(days=chunks * window_days + partials),
             ]
         )
 
-    toggl_dateranges = [
+    return [
         [toggl_tz.localize(dr[0]), toggl_tz.localize(dr[1])] for dr in toggl_dateranges
     ]
 
-    # collect toggl entries
-    toggl_entries = []
-    time_reports = []
 
-    toggl_workspaces = Workspace(toggl).list()
+def fetch_toggl_report_pages(
+    toggl: TogglSession,
+    wid: int,
+    window: list[datetime],
+    user_ids: list[int] | None = None,
+) -> list[list[SearchReportTimeEntriesResponse]]:
+    pages = []
+    more_reports = True
+    page = 0
+    while more_reports:
+        reports = toggl.reports.search(
+            wid, window[0], window[1], user_ids=user_ids, page_number=page
+        )
+        pages.append(reports)
+        more_reports = len(reports) > 0
+        page += 1
+
+    return pages
+
+
+def hourly_localizer(tz: Any) -> Callable[[datetime], datetime]:
+    """`tz.localize`, but looking the utc offset up once per hour of local time."""
+    offsets = {}
+
+    def localize(naive: datetime) -> datetime:
+        hour = naive.replace(minute=0, second=0, microsecond=0)
+        if hour not in offsets:
+            offsets[hour] = tz.localize(hour).tzinfo
+        return naive.replace(tzinfo=offsets[hour])
+
+    return localize
+
+
+def fetch_toggl_export_pages(
+    toggl: TogglSession, wid: int, window: list[datetime], toggl_tz: Any
+) -> list[list[TogglTimeEntry]]:
+    """Read a window's csv export into entries, cut into pages like the json search."""
+    project_ids = toggl.project_index().project_ids(wid)
+    localize = hourly_localizer(toggl_tz)
+    refreshed = False
+    entries = []
+    for row in toggl.export_report(wid, window):
+        key = (row["Client"], row["Project"])
+        if row["Project"] and key not in project_ids and not refreshed:
+            # probably a project created since the index was cached
+            project_ids = toggl.project_index(refresh=True).project_ids(wid)
+            refreshed = True
+
+        if not row["Project"]:
+            project_id = "-1"
+        elif project_ids.get(key) is None:
+            # renamed since the index was cached, or a name shared by two projects
+            raise TogglExportError("Can't tell which project {} is".format(key))
+        else:
+            project_id = project_ids[key]  # pyright: ignore[reportAssignmentType]
+        entries.append(TogglTimeEntry.from_export_row(row, project_id, localize))
 
-    for wid in [w.id for w in toggl_workspaces]:
-        for dr in toggl_dateranges:
-            more_reports = True
-            page = 0
-            while more_reports:
-                reports = ReportTimeEntry(toggl).search(
-                    wid, dr[0], dr[1], page_number=page
-                )
-                time_reports = reports + time_reports
-                more_reports = len(reports) > 0
-                page += 1
+    pages = [
+        entries[i : i + TOGGL_REPORT_PAGE_SIZE]
+        for i in range(0, len(entries), TOGGL_REPORT_PAGE_SIZE)
+    ]
+    return pages + [[]]
+
+
+def fetch_toggl_window_pages(
+    toggl: TogglSession,
+    wid: int,
+    window: list[datetime],
+    toggl_tz: Any,
+    export: bool = True,
+    user_ids: list[int] | None = None,
+) -> list[list[TogglTimeEntry]]:
+    """A window's entries, from the csv export unless it fails or `export` is off.
+
+    `user_ids` narrows the paged search down to those users' entries.
+    """
+    if export:
+        try:
+            return fetch_toggl_export_pages(toggl, wid, window, toggl_tz)
+        except (BadRequest, TogglExportError):
+            pass
+    return [
+        [TogglTimeEntry.from_resp(report) for report in page]
+        for page in fetch_toggl_report_pages(toggl, wid, window, user_ids)
+    ]
 
-    toggl_entries = [TogglTimeEntry.from_resp(report) for report in time_reports]
 
-    task_names: list[dict[str, str | int]] = [
-        {
-            "id": x.project_id + x.description,
-            "pid": x.project_id,
-            "description": x.description,
-            "project": x.project_id,
-        }
-        for x in toggl_entries
-    ]
-    toggl_task_names = list({x["id"]: x for x in task_names}.values())
-    toggl_task_names = sorted(
-        toggl_task_names, key=lambda k: k["pid"] if k["pid"] else 0
-    )
-    for i, t in enumerate(toggl_task_names):
-        t["id"] = i
+def fetch_toggl_entries(
+    toggl: TogglSession,
+    start_date: datetime,
+    end_date: datetime,
+    toggl_tz: Any,
+    window_days: int = 180,
+    concurrency: int = 1,
+    export: bool = True,
+) -> list[TogglTimeEntry]:
+    """Fetch the detailed report of every workspace, window by window.
+
+    With `export`, each window is downloaded as a single csv export, and only
+    windows that fail to export are paged through the json search instead. With
+    `concurrency` above 1, that many (workspace, window) pairs are fetched at the
+    same time.
+    """
+    toggl_dateranges = toggl_date_windows(start_date, end_date, toggl_tz, window_days)
+    toggl_workspaces = toggl.workspaces()
+    pairs = [(w.id, dr) for w in toggl_workspaces for dr in toggl_dateranges]
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        pages = [
+            page
+            for pair_pages in pool.map(
+                with_deadline(
+                    lambda pair: fetch_toggl_window_pages(
+                        toggl, *pair, toggl_tz, export
+                    )
+                ),
+                pairs,
+            )
+            for page in pair_pages
+        ]
+
+    # latest pages first, the order entries have always been numbered in
+    return [entry for page in reversed(pages) for entry in page]
 
-    # collect harvest entries
-    harvest_users = harvest.get_users()
 
-    if not harvest_email:
-        email_choices = click.Choice([x["email"] for x in harvest_users])
-        harvest_email = typer.prompt(
-            "Type the email address associated with the harvest account you'd like to sync to",
-            show_choices=True,
-            type=email_choices,
+def fetch_toggl_day_totals(
+    toggl: TogglSession,
+    start_date: datetime,
+    end_date: datetime,
+    toggl_tz: Any,
+    window_days: int = 180,
+    concurrency: int = 1,
+    export: bool = True,
+) -> list[TogglTimeEntry]:
+    """Per day (project, description) totals of the detailed report.
+
+    Each (workspace, window) pair is queried once, like `fetch_toggl_entries`
+    does, and totalled by day as soon as it's downloaded, so only the totals are
+    kept. Each total comes back as one entry starting at noon, which is all
+    `combine_entries_by_day` needs; entries starting right at midnight count
+    towards the day before, same as there.
+    """
+    toggl_dateranges = toggl_date_windows(start_date, end_date, toggl_tz, window_days)
+    pairs = [(w.id, dr) for w in toggl.workspaces() for dr in toggl_dateranges]
+
+    def window_totals(pair) -> dict[tuple[date, str, str], int]:
+        totals: dict[tuple[date, str, str], int] = {}
+        for page in fetch_toggl_window_pages(toggl, *pair, toggl_tz, export):
+            for entry in page:
+                local_start = entry.start.astimezone(toggl_tz)
+                day = (local_start - timedelta(microseconds=1)).date()
+                key = (day, entry.project_id, entry.description)
+                totals[key] = totals.get(key, 0) + entry.seconds
+        return totals
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        totals: dict[tuple[date, str, str], int] = {}
+        for pair_totals in pool.map(with_deadline(window_totals), pairs):
+            for key, seconds in pair_totals.items():
+                totals[key] = totals.get(key, 0) + seconds
+
+    localize = hourly_localizer(toggl_tz)
+    entries = []
+    for (day, project_id, description), seconds in totals.items():
+        midnight = datetime.combine(day, datetime.min.time())
+        noon = localize(midnight + timedelta(hours=12))
+        entries.append(
+            TogglTimeEntry.model_construct(
+                project_id=project_id,
+                description=description,
+                billable=False,
+                username="",
+                seconds=seconds,
+                start=noon,
+                stop=noon + timedelta(seconds=seconds),
+            )
         )
+    return entries
 
-    try:
-        harvest_user_id = [
-            usr["id"] for usr in harvest_users if usr["email"] == harvest_email
-        ].pop()
-    except IndexError:
-        print("Could not find user with email address: {0}".format(harvest_email))
-        raise
 
-    harvest_entries = harvest.get_time_entries()
-    if not isinstance(harvest_entries, list):
-        raise RuntimeError(
-            "Unexpected object type received when querying for harvest time entries"
+def aggregate_toggl_tasks(entries) -> dict[str, dict[str, float]]:
+    """Total hours per toggl project and description."""
+    tasks: dict[str, dict[str, float]] = {}
+    for entry in entries:
+        project_tasks = tasks.setdefault(entry.project_id, {})
+        project_tasks[entry.description] = (
+            project_tasks.get(entry.description, 0) + entry.seconds / 3600
         )
-    harvest_entries: list[HarvestTimeEntry] = harvest_entries
 
-    harvest_projects = harvest.get_projects()
-    harvest_task_assignments = harvest.get_task_assignments()
+    return tasks
 
-    # organize the list of task assignments to be used for listing later
-    for task_assignment in harvest_task_assignments:
-        try:
-            task_assignment["client"] = [
-                project["client"]
-                for project in harvest_projects
-                if project["id"] == task_assignment["project"]["id"]
-            ].pop()
-        except IndexError:
-            print(
-                "Could not find project with id: {0}".format(
-                    task_assignment["project"]["id"]
-                )
-            )
-            raise
 
-    harvest_task_names = sorted(
-        harvest_task_assignments, key=lambda k: k["client"]["id"]
-    )
+def aggregate_harvest_tasks(entries) -> dict[str, float]:
+    """Total hours per harvest entry note."""
+    tasks: dict[str, float] = {}
+    for entry in entries:
+        tasks[entry["notes"]] = tasks.get(entry["notes"], 0) + entry["hours"]
+
+    return tasks
 
-    # organize toggl entries by dates worked
+
+def combine_entries_by_day(
+    toggl_entries: list[TogglTimeEntry],
+    harvest_entries: list[HarvestTimeEntry],
+    start_date: datetime,
+    end_date: datetime,
+    toggl_tz: Any,
+) -> dict[datetime, CombinedEntries]:
     delta = end_date - start_date
-    dates = [start_date + timedelta(days=i) for i in range(delta.days + 1)]
+    days = [start_date + timedelta(days=i) for i in range(delta.days + 1)]
 
     combined_entries_dict: dict[datetime, CombinedEntries] = {}
 
-    for date in dates:
+    for day in days:
         # collect entries from either platform on the given date
         from_toggl = [
             x
             for x in toggl_entries
             if (
-                (x.start.astimezone(toggl_tz) > toggl_tz.localize(date))
+                (x.start.astimezone(toggl_tz) > toggl_tz.localize(day))
                 and (
                     x.start.astimezone(toggl_tz)
-                    <= toggl_tz.localize(date) + timedelta(days=1)
+                    <= toggl_tz.localize(day) + timedelta(days=1)
                 )
             )
         ]
@@ -774,48 +2293,228 @@ def do_sync(
             x
             for x in harvest_entries
             if dateutil.parser.parse(x["spent_date"]).astimezone(toggl_tz)
-            == toggl_tz.localize(date)
+            == toggl_tz.localize(day)
         ]
 
         if from_toggl or from_harvest:
-            combined_entries_dict[date] = {
-                "toggl": {"raw": from_toggl, "tasks": {}},
-                "harvest": {"raw": from_harvest, "tasks": {}},
+            # organize raw entries into unique tasks, and total time for that day
+            combined_entries_dict[day] = {
+                "toggl": {
+                    "raw": from_toggl,
+                    "tasks": aggregate_toggl_tasks(from_toggl),
+                },
+                "harvest": {
+                    "raw": from_harvest,
+                    "tasks": aggregate_harvest_tasks(from_harvest),
+                },
             }
 
-            # organize raw entries into unique tasks, and total time for that day
-            for entry in combined_entries_dict[date]["toggl"]["raw"]:
-                if (
-                    entry.project_id
-                    not in combined_entries_dict[date]["toggl"]["tasks"].keys()
-                ):
-                    combined_entries_dict[date]["toggl"]["tasks"][entry.project_id] = {}
-
-                try:
-                    combined_entries_dict[date]["toggl"]["tasks"][entry.project_id][
-                        entry.description
-                    ] += entry.seconds / 3600
-                except KeyError:
-                    combined_entries_dict[date]["toggl"]["tasks"][entry.project_id][
-                        entry.description
-                    ] = entry.seconds / 3600
-
-            for entry in combined_entries_dict[date]["harvest"]["raw"]:
-                try:
-                    combined_entries_dict[date]["harvest"]["tasks"][entry["notes"]] += (
-                        entry["hours"]
-                    )
-                except KeyError:
-                    combined_entries_dict[date]["harvest"]["tasks"][entry["notes"]] = (
-                        entry["hours"]
-                    )
+    return combined_entries_dict
 
-    # prompt the user for a task association config
-    task_association = task_association_config(toggl_task_names, harvest_task_names)
 
-    # add data to harvest
+def task_fingerprint(tasks: dict[str, Any]) -> str:
+    """Hash a day's task totals, rounded the same way they're posted to harvest."""
+
+    def rounded(value):
+        if isinstance(value, dict):
+            return {k: rounded(v) for k, v in value.items()}
+        return round(value, 2)
+
+    encoded = json.dumps(rounded(tasks), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def diff_fingerprints(old: dict[str, str], new: dict[str, str]) -> list[str]:
+    """Days whose hashes differ, including days only one side has."""
+    return sorted(
+        day for day in old.keys() | new.keys() if old.get(day) != new.get(day)
+    )
+
+
+def day_ranges(days: list[str]) -> list[tuple[datetime, datetime]]:
+    """Coalesce iso days into inclusive ranges of consecutive days."""
+    ranges: list[tuple[datetime, datetime]] = []
+    for day in sorted({datetime.fromisoformat(d) for d in days}):
+        if ranges and day - ranges[-1][1] == timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+
+    return ranges
+
+
+@dataclass
+class FingerprintIndex:
+    toggl: dict[str, str] = field(default_factory=dict)
+    harvest: dict[str, str] = field(default_factory=dict)
+    # when each day's fingerprints were last taken
+    checked: dict[str, str] = field(default_factory=dict)
+
+    def record(
+        self,
+        combined_entries: dict[datetime, CombinedEntries],
+        start_date: datetime,
+        end_date: datetime,
+        checked_at: str | None = None,
+    ):
+        """Replace the fingerprints of every day in [start_date, end_date]."""
+        self.forget(start_date, end_date)
+        for day, entry in combined_entries.items():
+            iso_day = day.date().isoformat()
+            if entry["toggl"]["tasks"]:
+                self.toggl[iso_day] = task_fingerprint(entry["toggl"]["tasks"])
+            if entry["harvest"]["tasks"]:
+                self.harvest[iso_day] = task_fingerprint(entry["harvest"]["tasks"])
+        self.mark_checked(start_date, end_date, checked_at)
+
+    def mark_checked(
+        self, start_date: datetime, end_date: datetime, checked_at: str | None = None
+    ):
+        checked_at = checked_at or datetime.now(pytz.utc).isoformat()
+        for i in range((end_date.date() - start_date.date()).days + 1):
+            self.checked[(start_date.date() + timedelta(days=i)).isoformat()] = (
+                checked_at
+            )
+
+    def checked_since(self, start_date: datetime, end_date: datetime) -> str | None:
+        """The oldest check of the window's days, None if any was never checked."""
+        times = []
+        for i in range((end_date.date() - start_date.date()).days + 1):
+            day = (start_date.date() + timedelta(days=i)).isoformat()
+            if day not in self.checked:
+                return None
+            times.append(self.checked[day])
+
+        return min(times, key=datetime.fromisoformat, default=None)
+
+    def forget(self, start_date: datetime, end_date: datetime):
+        first, last = start_date.date().isoformat(), end_date.date().isoformat()
+        for side in (self.toggl, self.harvest, self.checked):
+            for day in [d for d in side if first <= d <= last]:
+                del side[day]
+
+    @classmethod
+    def from_cache(cls, data: dict[str, Any]) -> "FingerprintIndex":
+        # indexes written before per-day checks only had one `checked_at` for
+        # every window, which can't tell which days it covers
+        return cls(data["toggl"], data["harvest"], data.get("checked", {}))
+
+
+def fingerprint_key(harvest: Harvest, harvest_user_id: int) -> str:
+    return f"{harvest.account_id}:{harvest_user_id}"
+
+
+@contextmanager
+def update_fingerprints(fingerprint_file: pathlib.Path):
+    with update_cache(True, True, fingerprint_file) as cache_data:
+        fingerprints = {
+            k: FingerprintIndex.from_cache(v) for k, v in cache_data.items()
+        }
+        try:
+            yield fingerprints
+        finally:
+            cache_data.clear()
+            cache_data.update({k: asdict(v) for k, v in fingerprints.items()})
+
+
+def toggl_task_table(
+    toggl_entries, project_index: TogglProjectIndex | None = None
+) -> list[dict[str, Any]]:
+    """Unique toggl (project, description) pairs, numbered for the association prompt.
+
+    Tasks are numbered by project, then by when they were first worked on, so the
+    numbers don't depend on the order entries were fetched in.
+    """
+    project_index = project_index or TogglProjectIndex()
+    earliest: dict[str, Any] = {}
+    for x in toggl_entries:
+        key = x.project_id + x.description
+        if key not in earliest or x.start < earliest[key].start:
+            earliest[key] = x
+
+    toggl_task_names: list[dict[str, Any]] = [
+        {
+            "id": i,
+            "pid": x.project_id,
+            "description": x.description,
+            "project": project_index.project_name(x.project_id),
+            "client": project_index.client_name(x.project_id),
+        }
+        for i, x in enumerate(
+            sorted(earliest.values(), key=lambda x: (x.project_id, x.start))
+        )
+    ]
+
+    return toggl_task_names
+
+
+def harvest_task_table(harvest_projects, harvest_task_assignments):
+    """Harvest task assignments with their client, ordered for the association prompt."""
+    projects_by_id = {project["id"]: project for project in harvest_projects}
+
+    # organize the list of task assignments to be used for listing later
+    for task_assignment in harvest_task_assignments:
+        try:
+            task_assignment["client"] = projects_by_id[
+                task_assignment["project"]["id"]
+            ]["client"]
+        except KeyError:
+            raise LookupError(
+                "Could not find project with id: {0}".format(
+                    task_assignment["project"]["id"]
+                )
+            ) from None
+
+    return sorted(harvest_task_assignments, key=lambda k: k["client"]["id"])
+
+
+def user_harvest_task_table(project_assignments):
+    """`harvest_task_table`, from the task assignments of one user's projects."""
+    task_assignments = [
+        {
+            "id": task_assignment["id"],
+            "client": project_assignment["client"],
+            "project": project_assignment["project"],
+            "task": task_assignment["task"],
+        }
+        for project_assignment in project_assignments
+        if project_assignment.get("is_active", True)
+        for task_assignment in project_assignment["task_assignments"]
+        if task_assignment.get("is_active", True)
+    ]
+
+    return sorted(task_assignments, key=lambda k: k["client"]["id"])
+
+
+def build_task_association(
+    toggl_tasks, harvest_tasks, groups: list[tuple[list[int], list[int]]]
+) -> dict[str, dict[str, dict[str, list[int]]]]:
+    """Map toggl project ids and descriptions to the harvest projects and tasks
+    picked for them, given (toggl #s, harvest #s) groups from the prompt tables."""
+    task_association: dict[str, dict[str, dict[str, list[int]]]] = {}
+    for task in toggl_tasks:
+        task_association.setdefault(task["pid"], {}).setdefault(
+            task["description"], {"harvest_project_id": [], "harvest_task_id": []}
+        )
+
+    for toggl_ids, harvest_ids in groups:
+        htasks = [harvest_tasks[i] for i in harvest_ids]
+        for task in (toggl_tasks[i] for i in toggl_ids):
+            association = task_association[task["pid"]][task["description"]]
+            association["harvest_project_id"].extend(h["project"]["id"] for h in htasks)
+            association["harvest_task_id"].extend(h["task"]["id"] for h in htasks)
+
+    return task_association
+
+
+def plan_harvest_entries(
+    combined_entries: dict[datetime, CombinedEntries],
+    task_association: dict[str, dict[str, dict[str, list[int]]]],
+    harvest_user_id: int,
+) -> list[dict[str, Any]]:
+    """Harvest entries to create for days that only have toggl time so far."""
     add_to_harvest = []
-    for date, entry in combined_entries_dict.items():
+    for day, entry in combined_entries.items():
         if entry["toggl"]["tasks"] and not entry["harvest"]["tasks"]:
             for pid in entry["toggl"]["tasks"].keys():
                 for task in entry["toggl"]["tasks"][pid].keys():
@@ -830,174 +2529,3139 @@ def do_sync(
                                 "user_id": harvest_user_id,
                                 "project_id": hidpair[0],
                                 "task_id": hidpair[1],
-                                "spent_date": date.date().isoformat(),
+                                "spent_date": day.date().isoformat(),
                                 "hours": round(entry["toggl"]["tasks"][pid][task], 2),
                                 "notes": task,
                             }
                         )
 
-    print("The following Toggl entries will be added to Harvest:")
-    add_to_harvest_tabulated = {
-        k: [d[k] for d in add_to_harvest] for k in add_to_harvest[0]
-    }
-    print(tabulate(add_to_harvest_tabulated, headers="keys"))
-    if input("""Add the entries noted above to harvest? (y/n)""").lower() in (
-        "y",
-        "yes",
-    ):
-        for entry in add_to_harvest:
-            #'{"user_id":1782959,"project_id":14307913,"task_id":8083365,"spent_date":"2017-03-21","hours":1.0}'
-            print("About to post: ")
-            pp.pprint(entry)
-            pp.pprint(harvest.post_all(url=HARVEST_TIME_ENTRIES_URL, data=entry))
-    else:
-        print("aborted")
-        exit(1)
-
-    print("done!")
-    exit(0)
+    return add_to_harvest
 
 
-def presentation_table(toggl_tasks, harvest_tasks):
-    presentation_header = [
-        "Toggl #",
-        "Toggl Project",
-        "Toggl Task Desc.",
-        "Harvest #",
-        "Harvest Client",
-        "Harvest Project",
-        "Harvest Task",
-    ]
-    presentation_table = []
-    while True:
-        idx = len(presentation_table)
-        if (idx < len(toggl_tasks)) and (
-            idx < len(harvest_tasks)
-        ):  # add both details to table
-            line = [
-                toggl_tasks[idx]["id"],
-                textwrap.shorten(toggl_tasks[idx]["project"] or "", width=20),
-                toggl_tasks[idx]["description"],
-                idx,
-                textwrap.shorten(harvest_tasks[idx]["client"]["name"] or "", width=20),
-                harvest_tasks[idx]["project"]["name"],
-                harvest_tasks[idx]["task"]["name"],
-            ]
-        elif idx < len(toggl_tasks):  # add toggl detail only to table
-            line = [
-                toggl_tasks[idx]["id"],
-                textwrap.shorten(toggl_tasks[idx]["project"] or "", width=20),
-                toggl_tasks[idx]["description"],
-                None,
-                None,
-                None,
-                None,
-            ]
-        elif idx < len(harvest_tasks):  # add harvest detail only to table
-            line = [
-                None,
-                None,
-                None,
-                idx,
-                textwrap.shorten(harvest_tasks[idx]["client"]["name"] or "", width=20),
-                harvest_tasks[idx]["project"]["name"],
-                harvest_tasks[idx]["task"]["name"],
-            ]
-        else:
-            break
-        presentation_table.append(line)
+# the first day of harvest's weeks, which approving a timesheet closes whole;
+# the account's week_start_day, monday unless it's been changed
+HARVEST_WEEK_START = 0
 
-    return presentation_table, presentation_header
 
+def harvest_week(day: date) -> date:
+    return day - timedelta(days=(day.weekday() - HARVEST_WEEK_START) % 7)
 
-def task_association_config(toggl_tasks, harvest_tasks):
-    print("""The following are two tables, one showing the tasks across your Toggl account, and the other showing
-tasks across your Harvest account.""")
-    print(tabulate(*presentation_table(toggl_tasks, harvest_tasks), tablefmt="grid"))
 
-    help_msg = """You'll need to enter which Toggl tasks you'd like to associate with which Harvest tasks.
-You'll be asked to enter an association formula - the formula should take the following form:
+def harvest_lock_reason(entry: dict[str, Any]) -> str | None:
+    """Why harvest won't let the entry's day take more time, if it won't."""
+    if entry.get("is_locked"):
+        return entry.get("locked_reason") or "locked"
+    if entry.get("is_billed"):
+        return "billed"
+    return None
 
-    <task config>|<task config>|..., where each <task config> is formatted as follows:
-    (toggl ids)>(harvest ids), where ids can be comma separated and include :'s to denote lists.
 
-For example:
-User enters: 1:3,5,7>2,3|4,6>1
-Result: Toggl entries in task #s 1,2,3,5 and 7 will be added as Harvest entries in task #s 2 and 3, and
-        Toggl entries in task #s 4 and 6 will be added as Harvest entries in task #1
-User enters: 1-3,5,7>2
-Result: Toggl entires in task #s 1,2,3,5 and 7 will be added as Harvest entries in task #2 only
+@dataclass
+class LockedPeriods:
+    """The days harvest won't take new time on, worked out from a user's entries.
 
-NOTE: Any task #s not appearing in a task config will be ignored."""
+    An approved timesheet closes the user's whole week, so a closed entry
+    closes its week for every project. Locked and billed entries lock their
+    project's days: a run of them with no editable entry of the same project in
+    between is taken as one locked range, the way invoices and period locks
+    cover every day from one date to another.
+    """
 
-    print(help_msg)
+    closed_weeks: set[date] = field(default_factory=set)
+    # per project, why each day with entries is locked, or None where it isn't
+    project_days: dict[int, dict[date, str | None]] = field(default_factory=dict)
 
-    task_association = {}
-    for task in toggl_tasks:
-        if task["pid"] not in task_association.keys():
-            task_association[task["pid"]] = {}
+    @classmethod
+    def from_entries(cls, entries: Iterable[dict[str, Any]]) -> "LockedPeriods":
+        periods = cls()
+        for entry in entries:
+            day = date.fromisoformat(entry["spent_date"])
+            if entry.get("is_closed"):
+                periods.closed_weeks.add(harvest_week(day))
+            if entry.get("project") is not None:
+                periods._mark(entry["project"]["id"], day, harvest_lock_reason(entry))
+        return periods
 
-        if task["description"] not in task_association[task["pid"]].keys():
-            task_association[task["pid"]][task["description"]] = {
-                "harvest_project_id": [],
-                "harvest_task_id": [],
-            }
+    @classmethod
+    def by_user(cls, entries: Iterable[dict[str, Any]]) -> dict[int, "LockedPeriods"]:
+        """The locked periods of each harvest user, from everyone's entries.
+
+        Approvals and locks are per user, so one person's approved week or
+        invoiced days say nothing about anyone else's.
+        """
+        return {
+            user_id: cls.from_entries(user_entries)
+            for user_id, user_entries in partition_entries(
+                entries, lambda entry: (entry.get("user") or {}).get("id")
+            ).items()
+        }
 
-    cfgpat = re.compile(
-        r"((?P<config>(?P<togglids>(((\d+\:\d+)|(\d+)){1}\,?)+)(\>{1})(?P<harvestids>(((\d+\:\d+)|(\d+)){1}\,?)+))(\|)?)"
-    )
-    idpat = re.compile(
-        r"(?P<id>((?P<list>(?P<first>\d+)\:(?P<second>\d+))|(?P<single>\d+)){1}\,?)"
+    def _mark(self, project_id: int, day: date, reason: str | None):
+        days = self.project_days.setdefault(project_id, {})
+        # a single editable entry shows the day is still open
+        if reason is None:
+            days[day] = None
+        else:
+            days.setdefault(day, reason)
+
+    def merge(self, other: "LockedPeriods"):
+        self.closed_weeks |= other.closed_weeks
+        for project_id, days in other.project_days.items():
+            for day, reason in days.items():
+                self._mark(project_id, day, reason)
+
+    def ranges(self) -> dict[int, list[tuple[date, date, str]]]:
+        """Each project's locked (first day, last day, reason), in order."""
+        ranges: dict[int, list[tuple[date, date, str]]] = {}
+        for project_id, days in self.project_days.items():
+            runs = []
+            run = None
+            for day, reason in sorted(days.items()):
+                if reason is None:
+                    run = None
+                elif run is None:
+                    run = [day, day, reason]
+                    runs.append(run)
+                else:
+                    run[1] = day
+            if runs:
+                ranges[project_id] = [tuple(run) for run in runs]
+        return ranges
+
+    def prune(
+        self, entries: list[dict[str, Any]]
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """Split planned entries into those harvest would take, and those it would
+        refuse, each of the latter with the `reason` it would."""
+        ranges = self.ranges()
+        starts = {
+            project_id: [first for first, _, _ in runs]
+            for project_id, runs in ranges.items()
+        }
+        kept, pruned = [], []
+        for entry in entries:
+            day = date.fromisoformat(entry["spent_date"])
+            week = harvest_week(day)
+            reason = None
+            if week in self.closed_weeks:
+                reason = "timesheet for the week of {} approved".format(week)
+            elif entry["project_id"] in ranges:
+                i = bisect.bisect_right(starts[entry["project_id"]], day) - 1
+                if i >= 0 and day <= ranges[entry["project_id"]][i][1]:
+                    first, last, reason = ranges[entry["project_id"]][i]
+                    reason = "{} from {} to {}".format(reason, first, last)
+
+            if reason is None:
+                kept.append(entry)
+            else:
+                pruned.append({**entry, "reason": reason})
+
+        return kept, pruned
+
+
+HarvestEmail = str | Callable[[list[dict[str, Any]]], str]
+
+
+def prompt_harvest_email(harvest_users: list[dict[str, Any]]) -> str:
+    email_choices = click.Choice([x["email"] for x in harvest_users])
+    return typer.prompt(
+        "Type the email address associated with the harvest account you'd like to sync to",
+        show_choices=True,
+        type=email_choices,
     )
 
-    config_groups = []
-    while True:
-        task_config = input("Enter one or more task configs:")
-
-        for cfgmatch in [m.groupdict() for m in cfgpat.finditer(task_config)]:
-            config_group = {}
-
-            tidmatches = [m.groupdict() for m in idpat.finditer(cfgmatch["togglids"])]
-            hidmatches = [m.groupdict() for m in idpat.finditer(cfgmatch["harvestids"])]
-
-            htasks = []
-            for idmatch in hidmatches:
-                if idmatch["list"] is not None:
-                    htasks = (
-                        htasks
-                        + harvest_tasks[
-                            int(idmatch["first"]) : int(idmatch["second"]) + 1
-                        ]
-                    )
+
+def resolve_harvest_user_id(
+    harvest_users: list[dict[str, Any]], harvest_email: HarvestEmail
+) -> int:
+    """The id of the harvest user with the email, given or picked from the users
+    by calling `harvest_email` with them."""
+    if callable(harvest_email):
+        harvest_email = harvest_email(harvest_users)
+
+    try:
+        return [
+            usr["id"] for usr in harvest_users if usr["email"] == harvest_email
+        ].pop()
+    except IndexError:
+        raise LookupError(
+            "Could not find user with email address: {0}".format(harvest_email)
+        ) from None
+
+
+@dataclass
+class MemoryStage:
+    name: str
+    # bytes of python allocations held once the stage is over, and at its peak
+    held: int
+    peak: int
+    # the source lines whose allocations grew the most during the stage
+    top: list[tuple[str, int]]
+
+
+class MemoryReport:
+    """Python allocations per sync stage, traced with tracemalloc."""
+
+    def __init__(self, top: int = 3):
+        self.top = top
+        self.stages: list[MemoryStage] = []
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        self._snapshot = self._take_snapshot()
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            held, peak = tracemalloc.get_traced_memory()
+            snapshot = self._take_snapshot()
+            top = [
+                (str(stat.traceback[0]), stat.size_diff)
+                for stat in snapshot.compare_to(self._snapshot, "lineno")[: self.top]
+                if stat.size_diff > 0
+            ]
+            self._snapshot = snapshot
+            self.stages.append(MemoryStage(name, held, peak, top))
+
+    @staticmethod
+    def peak_rss() -> int | None:
+        """The most memory the process has held, in bytes, where that's known."""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macos
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def print(self):
+        def mib(size: int) -> str:
+            return "{:.1f}".format(size / 2**20)
+
+        print(
+            tabulate(
+                [
+                    [
+                        stage.name,
+                        mib(stage.held),
+                        mib(stage.peak),
+                        "\n".join(
+                            "{} (+{} MiB)".format(line, mib(size))
+                            for line, size in stage.top
+                        ),
+                    ]
+                    for stage in self.stages
+                ],
+                headers=["stage", "held MiB", "peak MiB", "grew most at"],
+            )
+        )
+        peak_rss = self.peak_rss()
+        if peak_rss is not None:
+            print("peak RSS: {} MiB".format(mib(peak_rss)))
+
+    def close(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+
+def memory_stage(report: MemoryReport | None, name: str):
+    return nullcontext() if report is None else report.stage(name)
+
+
+class SyncPrefetch:
+    """Starts every fetch do_sync needs in the background as soon as it's created.
+
+    None of them depend on each other or on the user's answers, so the prompts
+    only wait for whichever result they need next. The exception is the harvest
+    task table, which only holds what the harvest user can log time to, and so
+    is fetched once they're known, see `harvest_tasks`.
+    """
+
+    def __init__(
+        self,
+        toggl: TogglSession,
+        harvest: Harvest,
+        start_date: datetime,
+        end_date: datetime,
+        aggregate: bool = False,
+        coalescer: "Coalescer | None" = None,
+        entries: bool = True,
+        account_wide: bool = False,
+    ):
+        """Without `entries`, only the users and toggl projects are fetched. With
+        `account_wide`, so is every harvest project and task assignment."""
+        self.pool = ThreadPoolExecutor(max_workers=5, thread_name_prefix="prefetch")
+        window = (start_date, end_date, aggregate)
+        # keys see only what their own token is allowed to, even on one account
+        account = harvest.cache_key
+
+        def submit(key, fetch: Callable, *args) -> Future:
+            fetch = with_deadline(fetch)
+            if coalescer is None:
+                return self.pool.submit(fetch, *args)
+            # fetches with the same key and window share one download
+            return self.pool.submit(coalescer.run, key, lambda: fetch(*args))
+
+        self.toggl: Future[tuple[Any, list[TogglTimeEntry]]] | None = None
+        self.harvest_entries: Future[list[Any]] | None = None
+        if entries:
+            self.toggl = submit(
+                ("toggl", toggl.cache_key, window),
+                self._fetch_toggl,
+                toggl,
+                start_date,
+                end_date,
+                aggregate,
+            )
+            # entries outside the window are never looked at
+            self.harvest_entries = submit(
+                ("time_entries", account, window),
+                self._fetch_harvest,
+                harvest,
+                start_date,
+                end_date,
+                aggregate,
+            )
+        self.toggl_projects = submit(
+            ("toggl_projects", toggl.cache_key), toggl.project_index
+        )
+        self.harvest_users = submit(("users", account), harvest.get_users)
+        self._submit = submit
+        self._harvest = harvest
+        self._coalescer = coalescer
+        self.harvest_projects: Future[list[Any]] | None = None
+        self.harvest_task_assignments: Future[list[Any]] | None = None
+        if account_wide:
+            self._fetch_account_tasks()
+
+    def _fetch_account_tasks(self):
+        if self.harvest_projects is None or self.harvest_task_assignments is None:
+            account = self._harvest.cache_key
+            self.harvest_projects = self._submit(
+                ("projects", account), self._harvest.get_projects
+            )
+            self.harvest_task_assignments = self._submit(
+                ("task_assignments", account), self._harvest.get_task_assignments
+            )
+        return self.harvest_projects, self.harvest_task_assignments
+
+    def harvest_tasks(
+        self, harvest_user_id: int | None = None
+    ) -> Future[list[dict[str, Any]]]:
+        """Start fetching the harvest task table of the user, or of everyone.
+
+        Only the user's own project assignments are downloaded, falling back to
+        every project and task assignment on the account when the harvest key
+        isn't allowed to list another user's.
+        """
+        return self.pool.submit(with_deadline(self._harvest_tasks), harvest_user_id)
+
+    def _harvest_tasks(self, harvest_user_id: int | None) -> list[dict[str, Any]]:
+        if harvest_user_id is not None:
+            key = ("project_assignments", self._harvest.cache_key, harvest_user_id)
+            fetch = self._harvest.get_user_project_assignments
+            try:
+                if self._coalescer is None:
+                    project_assignments = fetch(harvest_user_id)
                 else:
-                    htasks.append(harvest_tasks[int(idmatch["single"])])
-
-            ttasks = []
-            for idmatch in tidmatches:
-                if idmatch["list"] is not None:
-                    ttasks = (
-                        ttasks
-                        + toggl_tasks[
-                            int(idmatch["first"]) : int(idmatch["second"]) + 1
-                        ]
+                    project_assignments = self._coalescer.run(
+                        key, lambda: fetch(harvest_user_id)
                     )
+                return user_harvest_task_table(project_assignments)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in (403, 404):
+                    raise
+
+        projects, task_assignments = self._fetch_account_tasks()
+        # the table is built in place, and the listing may be shared
+        return harvest_task_table(
+            projects.result(), copy.deepcopy(task_assignments.result())
+        )
+
+    @staticmethod
+    def _fetch_toggl(
+        toggl: TogglSession, start_date: datetime, end_date: datetime, aggregate: bool
+    ):
+        toggl_tz = toggl.timezone()
+        fetch = fetch_toggl_day_totals if aggregate else fetch_toggl_entries
+        return toggl_tz, fetch(toggl, start_date, end_date, toggl_tz)
+
+    @staticmethod
+    def _fetch_harvest(
+        harvest: Harvest, start_date: datetime, end_date: datetime, aggregate: bool
+    ):
+        fetch = harvest.get_time_entry_totals if aggregate else harvest.get_time_entries
+        return fetch(
+            {"from": start_date.date().isoformat(), "to": end_date.date().isoformat()}
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        # don't hold up an aborted sync waiting for downloads nobody will use
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass
+class DayTotals:
+    """The combined entries of a run of days, without the raw entries behind them."""
+
+    combined_entries: dict[datetime, CombinedEntries] = field(default_factory=dict)
+    # the earliest entry of each toggl task, which `toggl_task_table` numbers by
+    task_entries: dict[tuple[str, str], TogglTimeEntry] = field(default_factory=dict)
+    toggl_rows: int = 0
+    harvest_rows: int = 0
+    # by harvest user, who isn't known yet when shards are fetched
+    locked: dict[int, LockedPeriods] = field(default_factory=dict)
+    harvest_tasks: dict[int, dict[datetime, dict[str, float]]] = field(
+        default_factory=dict
+    )
+
+    def merge(self, other: "DayTotals"):
+        """Add the totals of days these don't cover, fetched after these were."""
+        self.combined_entries.update(other.combined_entries)
+        for user_id, days in other.harvest_tasks.items():
+            self.harvest_tasks.setdefault(user_id, {}).update(days)
+        for entry in other.task_entries.values():
+            self.add_task_entry(entry)
+        self.toggl_rows += other.toggl_rows
+        self.harvest_rows += other.harvest_rows
+        for user_id, periods in other.locked.items():
+            self.locked.setdefault(user_id, LockedPeriods()).merge(periods)
+
+    def add_task_entry(self, entry: TogglTimeEntry):
+        key = (entry.project_id, entry.description)
+        if key not in self.task_entries or entry.start < self.task_entries[key].start:
+            self.task_entries[key] = entry
+
+    def combined_for(self, harvest_user_id: int) -> dict[datetime, CombinedEntries]:
+        """The combined entries of each day, with only this user's harvest time."""
+        harvest_days = self.harvest_tasks.get(harvest_user_id, {})
+        combined_entries: dict[datetime, CombinedEntries] = {}
+        for day in sorted(set(self.combined_entries) | set(harvest_days)):
+            toggl = self.combined_entries.get(day, {}).get("toggl")
+            combined_entries[day] = {
+                "toggl": toggl or {"raw": [], "tasks": {}},
+                "harvest": {"raw": [], "tasks": harvest_days.get(day, {})},
+            }
+        return combined_entries
+
+
+def fetch_day_totals(
+    toggl: TogglSession,
+    harvest: Harvest,
+    first: datetime,
+    last: datetime,
+    end_date: datetime,
+    toggl_tz: Any,
+    aggregate: bool = False,
+) -> DayTotals:
+    """Download and combine the days from `first` through `last` of a sync window.
+
+    Entries starting right at midnight count towards the day before, so toggl is
+    asked for the day after `last` too, unless that's past the window's
+    `end_date`.
+    """
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="days") as pool:
+        toggl_fetch = pool.submit(
+            with_deadline(SyncPrefetch._fetch_toggl),
+            toggl,
+            first,
+            min(last + timedelta(days=1), end_date),
+            aggregate,
+        )
+        harvest_entries = pool.submit(
+            with_deadline(SyncPrefetch._fetch_harvest),
+            harvest,
+            first,
+            last,
+            aggregate,
+        ).result()
+        toggl_entries = toggl_fetch.result()[1]
+
+    totals = DayTotals(
+        harvest_rows=len(harvest_entries),
+        locked=LockedPeriods.by_user(harvest_entries),
+    )
+    for entry in toggl_entries:
+        totals.add_task_entry(entry)
+    totals.combined_entries = combine_entries_by_day(
+        toggl_entries, [], first, last, toggl_tz
+    )
+    for day_entries in totals.combined_entries.values():
+        # the day after `last` is counted by whichever slice it belongs to
+        totals.toggl_rows += len(day_entries["toggl"]["raw"])
+        day_entries["toggl"]["raw"] = []
+
+    # harvest's listing is everyone's, and only one user's time is synced
+    for user_id, user_entries in partition_entries(
+        harvest_entries, lambda entry: (entry.get("user") or {}).get("id")
+    ).items():
+        totals.harvest_tasks[user_id] = {
+            day: day_entries["harvest"]["tasks"]
+            for day, day_entries in combine_entries_by_day(
+                [], user_entries, first, last, toggl_tz
+            ).items()
+        }
+
+    return totals
+
+
+@dataclass
+class ShardClients:
+    """What a worker process needs to open its own toggl and harvest clients."""
+
+    toggl_auth: BasicAuth | TokenAuth
+    toggl_cache_file: pathlib.Path
+    harvest_account_id: str
+    harvest_key: str
+
+
+def fetch_shard_totals(
+    first: datetime,
+    last: datetime,
+    clients: ShardClients,
+    end_date: datetime,
+    toggl_tz: Any,
+    aggregate: bool,
+    expires_at: float | None,
+) -> DayTotals:
+    """`fetch_day_totals` for one shard of a backfill, run in a worker process.
+
+    `expires_at` is the run's deadline as a `time.time()`, so shards queued
+    behind others don't get a budget of their own.
+    """
+    harvest = Harvest(clients.harvest_account_id, clients.harvest_key)
+    with (
+        TogglSession(clients.toggl_auth, clients.toggl_cache_file) as toggl,
+        deadline_scope(Deadline.until(expires_at)),
+    ):
+        return fetch_day_totals(
+            toggl, harvest, first, last, end_date, toggl_tz, aggregate
+        )
+
+
+TaskAssociation = dict[str, dict[str, dict[str, list[int]]]]
+
+
+@dataclass
+class SyncPlan:
+    """What a sync would add to harvest, and the tables it was worked out from."""
+
+    start_date: datetime
+    end_date: datetime
+    harvest_user_id: int
+    toggl_tasks: list[dict[str, Any]]
+    harvest_tasks: list[dict[str, Any]]
+    task_association: TaskAssociation
+    combined_entries: dict[datetime, CombinedEntries]
+    entries: list[dict[str, Any]]
+    timings: dict[str, float] = field(default_factory=dict)
+    # entries left out because harvest would refuse them, each with its `reason`
+    pruned: list[dict[str, Any]] = field(default_factory=list)
+
+    def tables(self) -> dict[str, Any]:
+        """The numbered tables an association formula refers to, and the entries."""
+        return {
+            "toggl_tasks": [
+                {
+                    "#": t["id"],
+                    "client": t["client"],
+                    "project": t["project"],
+                    "description": t["description"],
+                }
+                for t in self.toggl_tasks
+            ],
+            "harvest_tasks": [
+                {
+                    "#": i,
+                    "client": h["client"]["name"],
+                    "project": h["project"]["name"],
+                    "task": h["task"]["name"],
+                }
+                for i, h in enumerate(self.harvest_tasks)
+            ],
+            "entries": self.entries,
+            "pruned": self.pruned,
+        }
+
+
+@dataclass
+class SyncResult:
+    plan: SyncPlan
+    confirmed: bool
+    posted: list[dict[str, Any]] = field(default_factory=list)
+    # entries left unposted when the deadline ran out, and why
+    pending: list[dict[str, Any]] = field(default_factory=list)
+    error: str | None = None
+
+
+@dataclass
+class OrgPlan:
+    """One plan per harvest user email, and the toggl users nobody maps to."""
+
+    plans: dict[str, SyncPlan] = field(default_factory=dict)
+    unmapped: list[str] = field(default_factory=list)
+
+
+def partition_entries[T](
+    entries: Iterable[T], key: Callable[[T], Any]
+) -> dict[Any, list[T]]:
+    """Group entries by `key`, dropping those it returns None for."""
+    partitions: dict[Any, list[T]] = {}
+    for entry in entries:
+        value = key(entry)
+        if value is not None:
+            partitions.setdefault(value, []).append(entry)
+
+    return partitions
+
+
+def match_org_users(
+    toggl_users: list[dict[str, Any]],
+    harvest_users: list[dict[str, Any]],
+    user_map: dict[str, str],
+) -> dict[int, int]:
+    """Harvest user ids by toggl user id, matched on email unless `user_map` says
+    otherwise. `user_map` is keyed by toggl email or id, and holds harvest emails."""
+    harvest_ids = {user["email"].lower(): user["id"] for user in harvest_users}
+    user_map = {str(k).lower(): v.lower() for k, v in user_map.items()}
+
+    matches = {}
+    for user in toggl_users:
+        email = user["email"].lower()
+        harvest_email = user_map.get(str(user["id"]), user_map.get(email, email))
+        if harvest_email in harvest_ids:
+            matches[user["id"]] = harvest_ids[harvest_email]
+
+    return matches
+
+
+class SyncSession:
+    """Plans and applies syncs between one toggl and one harvest account.
+
+    Nothing here prompts, prints or exits: the harvest user, the association
+    and the confirmation are all arguments, so a warm session can run any number
+    of syncs, one after another or from several threads at once. Sessions sharing
+    a `coalescer` share downloads of the same data that overlap in time.
+    """
+
+    def __init__(
+        self,
+        toggl: TogglSession,
+        harvest: Harvest,
+        coalescer: "Coalescer | None" = None,
+        fingerprint_file: pathlib.Path | None = None,
+        stats_file: pathlib.Path | None = None,
+    ):
+        """The fingerprint and stats files default to the cli's."""
+        self.toggl = toggl
+        self.harvest = harvest
+        self.coalescer = coalescer
+        self.fingerprint_file = fingerprint_file or state.fingerprint_file
+        self.stats_file = stats_file or state.stats_file
+        self._owns_clients = False
+
+    @classmethod
+    def from_credentials(
+        cls,
+        creds: "ConfirmedCredentials",
+        toggl_cache_file: pathlib.Path | None = None,
+        cassette: "Cassette | None" = None,
+        **kwargs: Any,
+    ) -> "SyncSession":
+        session = cls(
+            TogglSession(
+                toggl_auth_.TokenAuth(creds.toggl_key),
+                toggl_cache_file,
+                cassette=cassette,
+            ),
+            Harvest(creds.harvest_account_id, creds.harvest_key, cassette),
+            **kwargs,
+        )
+        session._owns_clients = True
+        return session
+
+    def prefetch(
+        self, start_date: datetime, end_date: datetime, aggregate: bool = False
+    ) -> SyncPrefetch:
+        return SyncPrefetch(
+            self.toggl, self.harvest, start_date, end_date, aggregate, self.coalescer
+        )
+
+    def plan(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        association: str | Callable[[list, list], TaskAssociation],
+        harvest_email: HarvestEmail,
+        aggregate: bool = False,
+        prefetch: SyncPrefetch | None = None,
+        max_memory: int | None = None,
+        memory_report: MemoryReport | None = None,
+        processes: int | None = None,
+    ) -> SyncPlan:
+        """Work out the harvest entries a sync of the window would create.
+
+        `association` is either a formula (see `parse_task_association`) or a
+        function given the toggl and harvest task tables that returns the
+        association itself. `harvest_email` is either the harvest user's email or
+        a function picking it from the account's users; when no user has it, a
+        LookupError is raised.
+
+        With `max_memory` (bytes), the window is downloaded and combined a slice
+        at a time instead, see `_plan_in_slices`. With `processes`, it's split
+        into shards that many worker processes download and combine at once, see
+        `_plan_in_shards`. `memory_report` traces the allocations of each stage.
+        """
+        if max_memory is not None and processes is not None:
+            raise ValueError("Only one of `max_memory` and `processes` can be given")
+        if processes is not None:
+            return self._plan_in_shards(
+                start_date,
+                end_date,
+                association,
+                harvest_email,
+                aggregate,
+                processes,
+                memory_report,
+            )
+        if max_memory is not None:
+            return self._plan_in_slices(
+                start_date,
+                end_date,
+                association,
+                harvest_email,
+                aggregate,
+                max_memory,
+                memory_report,
+            )
+
+        timings: dict[str, float] = {}
+        started = time.perf_counter()
+        if prefetch is None:
+            prefetch = self.prefetch(start_date, end_date, aggregate)
+
+        with prefetch:
+            harvest_user_id = resolve_harvest_user_id(
+                prefetch.harvest_users.result(), harvest_email
+            )
+            toggl_tz, toggl_entries, harvest_entries, toggl_tasks, harvest_tasks = (
+                self._fetched_tables(prefetch, harvest_user_id, memory_report)
+            )
+        timings["fetch"] = round(time.perf_counter() - started, 3)
+
+        if not aggregate:
+            # daily totals say nothing about how many entries there are
+            record_sync_stats(
+                self.toggl,
+                self.harvest,
+                start_date,
+                end_date,
+                len(toggl_entries),
+                len(harvest_entries),
+                self.stats_file,
+            )
+
+        started = time.perf_counter()
+        task_association = self._associate(association, toggl_tasks, harvest_tasks)
+        timings["associate"] = round(time.perf_counter() - started, 3)
+
+        # harvest's listing is everyone's, and only one user's time is synced
+        user_entries = partition_entries(
+            harvest_entries, lambda entry: (entry.get("user") or {}).get("id")
+        ).get(harvest_user_id, [])
+        with memory_stage(memory_report, "combined entries"):
+            combined_entries = combine_entries_by_day(
+                toggl_entries, user_entries, start_date, end_date, toggl_tz
+            )
+        with memory_stage(memory_report, "harvest entries to add"):
+            return self._user_plan(
+                start_date,
+                end_date,
+                harvest_user_id,
+                combined_entries,
+                LockedPeriods.by_user(harvest_entries).get(
+                    harvest_user_id, LockedPeriods()
+                ),
+                toggl_tasks,
+                harvest_tasks,
+                task_association,
+                timings,
+            )
+
+    def _plan_in_slices(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        association: str | Callable[[list, list], TaskAssociation],
+        harvest_email: HarvestEmail,
+        aggregate: bool,
+        max_memory: int,
+        memory_report: MemoryReport | None,
+    ) -> SyncPlan:
+        """`plan`, downloading and combining the window a slice of days at a time.
+
+        Only each day's totals are kept from one slice to the next, dropping the
+        raw entries `plan` would keep in `combined_entries`. The first slice is
+        MEMORY_SLICE_DAYS long, and every later one is sized from the peak python
+        allocations of the slice before, so they stay under `max_memory` along
+        with everything kept so far. Tasks are numbered the same as `plan`'s,
+        from the earliest entry of each.
+        """
+
+        def sliced_totals(toggl_tz: Any) -> DayTotals:
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            try:
+                baseline = tracemalloc.get_traced_memory()[0]
+                totals = DayTotals()
+                days = MEMORY_SLICE_DAYS
+                last = end_date
+                while last >= start_date:
+                    first = max(last - timedelta(days=days - 1), start_date)
+                    held = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    with memory_stage(
+                        memory_report, "{} to {}".format(first.date(), last.date())
+                    ):
+                        totals.merge(
+                            fetch_day_totals(
+                                self.toggl,
+                                self.harvest,
+                                first,
+                                last,
+                                end_date,
+                                toggl_tz,
+                                aggregate,
+                            )
+                        )
+
+                    peak = max(tracemalloc.get_traced_memory()[1] - held, 1)
+                    room = max_memory - (tracemalloc.get_traced_memory()[0] - baseline)
+                    days = max(1, int(room / (peak / ((last - first).days + 1))))
+                    last = first - timedelta(days=1)
+                return totals
+            finally:
+                if not tracing:
+                    tracemalloc.stop()
+
+        return self._plan_from_day_totals(
+            start_date,
+            end_date,
+            association,
+            harvest_email,
+            aggregate,
+            sliced_totals,
+            memory_report,
+        )
+
+    def _plan_in_shards(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        association: str | Callable[[list, list], TaskAssociation],
+        harvest_email: HarvestEmail,
+        aggregate: bool,
+        processes: int,
+        memory_report: MemoryReport | None,
+    ) -> SyncPlan:
+        """`plan`, with each shard of days fetched and totalled in its own process.
+
+        Shards are runs of whole days in the toggl user's timezone, at most
+        SHARD_DAYS long so each is a single report window, and split finer when
+        there are fewer of them than processes. Each worker opens its own clients,
+        and sends back only its days' totals, which are merged latest shard first
+        like `_plan_in_slices` merges its slices.
+        """
+        days = (end_date - start_date).days + 1
+        shard_days = max(1, min(SHARD_DAYS, math.ceil(days / processes)))
+        shards = []
+        last = end_date
+        while last >= start_date:
+            first = max(last - timedelta(days=shard_days - 1), start_date)
+            shards.append((first, last))
+            last = first - timedelta(days=1)
+
+        clients = ShardClients(
+            self.toggl.auth,
+            self.toggl.cache.cache_file,
+            self.harvest.account_id,
+            self.harvest.auth_key,
+        )
+
+        # the workers start before the prefetch starts any threads of its own
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            expires_at = current_deadline.get().wall_time()
+            toggl_tz = self.toggl.timezone()
+            futures = [
+                pool.submit(
+                    fetch_shard_totals,
+                    first,
+                    last,
+                    clients,
+                    end_date,
+                    toggl_tz,
+                    aggregate,
+                    expires_at,
+                )
+                for first, last in shards
+            ]
+
+            def sharded_totals(_toggl_tz: Any) -> DayTotals:
+                totals = DayTotals()
+                with memory_stage(memory_report, "{} shards".format(len(shards))):
+                    for future in futures:
+                        totals.merge(future.result())
+                return totals
+
+            try:
+                return self._plan_from_day_totals(
+                    start_date,
+                    end_date,
+                    association,
+                    harvest_email,
+                    aggregate,
+                    sharded_totals,
+                    memory_report,
+                )
+            except BaseException:
+                # leaving the pool waits for every shard, so drop the queued ones
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _plan_from_day_totals(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        association: str | Callable[[list, list], TaskAssociation],
+        harvest_email: HarvestEmail,
+        aggregate: bool,
+        fetch_totals: Callable[[Any], "DayTotals"],
+        memory_report: MemoryReport | None,
+    ) -> SyncPlan:
+        """Plan from `fetch_totals(toggl_tz)`, fetching everything else meanwhile."""
+        timings: dict[str, float] = {}
+        started = time.perf_counter()
+        with SyncPrefetch(
+            self.toggl,
+            self.harvest,
+            start_date,
+            end_date,
+            aggregate,
+            self.coalescer,
+            entries=False,
+        ) as prefetch:
+            harvest_user_id = resolve_harvest_user_id(
+                prefetch.harvest_users.result(), harvest_email
+            )
+            harvest_task_fetch = prefetch.harvest_tasks(harvest_user_id)
+            totals = fetch_totals(self.toggl.timezone())
+            toggl_projects = prefetch.toggl_projects.result()
+            harvest_tasks = harvest_task_fetch.result()
+        timings["fetch"] = round(time.perf_counter() - started, 3)
+
+        if not aggregate:
+            record_sync_stats(
+                self.toggl,
+                self.harvest,
+                start_date,
+                end_date,
+                totals.toggl_rows,
+                totals.harvest_rows,
+                self.stats_file,
+            )
+
+        toggl_tasks = toggl_task_table(
+            list(totals.task_entries.values()), toggl_projects
+        )
+        started = time.perf_counter()
+        task_association = self._associate(association, toggl_tasks, harvest_tasks)
+        timings["associate"] = round(time.perf_counter() - started, 3)
+
+        with memory_stage(memory_report, "harvest entries to add"):
+            return self._user_plan(
+                start_date,
+                end_date,
+                harvest_user_id,
+                totals.combined_for(harvest_user_id),
+                totals.locked.get(harvest_user_id, LockedPeriods()),
+                toggl_tasks,
+                harvest_tasks,
+                task_association,
+                timings,
+            )
+
+    def plan_org(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        association: str | Callable[[list, list], TaskAssociation],
+        user_map: dict[str, str] | None = None,
+    ) -> "OrgPlan":
+        """Plan a sync for everyone in the workspace from one pass over the reports.
+
+        The toggl key has to be a workspace admin's, so the detailed reports hold
+        every member's entries, and the harvest key one allowed to add time for
+        other people. Entries are split by toggl user, and each user's share is
+        synced to the harvest user with the same email. `user_map` maps toggl
+        emails (or user ids) to harvest emails where those differ. The task tables
+        and association are shared by everyone.
+        """
+        timings: dict[str, float] = {}
+        started = time.perf_counter()
+        # the task table is shared, so it has to hold everyone's tasks
+        with SyncPrefetch(
+            self.toggl,
+            self.harvest,
+            start_date,
+            end_date,
+            coalescer=self.coalescer,
+            account_wide=True,
+        ) as prefetch:
+            toggl_users = self.toggl.workspace_users()
+            harvest_users = prefetch.harvest_users.result()
+            toggl_tz, toggl_entries, harvest_entries, toggl_tasks, harvest_tasks = (
+                self._fetched_tables(prefetch, None)
+            )
+        timings["fetch"] = round(time.perf_counter() - started, 3)
+
+        record_sync_stats(
+            self.toggl,
+            self.harvest,
+            start_date,
+            end_date,
+            len(toggl_entries),
+            len(harvest_entries),
+            self.stats_file,
+        )
+
+        started = time.perf_counter()
+        task_association = self._associate(association, toggl_tasks, harvest_tasks)
+        timings["associate"] = round(time.perf_counter() - started, 3)
+
+        org_plan = OrgPlan()
+        harvest_emails = {user["id"]: user["email"] for user in harvest_users}
+        matches = match_org_users(toggl_users, harvest_users, user_map or {})
+        harvest_by_user = partition_entries(
+            harvest_entries, lambda entry: entry["user"]["id"]
+        )
+        # csv exports name users by email rather than id
+        email_ids = {user["email"].lower(): user["id"] for user in toggl_users}
+
+        def toggl_user(entry: TogglTimeEntry) -> Any:
+            if entry.user_id is not None:
+                return entry.user_id
+            email = (entry.email or "").lower()
+            return email_ids.get(email, email or entry.username)
+
+        toggl_by_user = partition_entries(toggl_entries, toggl_user)
+
+        for toggl_user_id, user_entries in toggl_by_user.items():
+            harvest_user_id = matches.get(toggl_user_id)
+            if harvest_user_id is None:
+                org_plan.unmapped.append(user_entries[0].username or str(toggl_user_id))
+                continue
+
+            user_harvest_entries = harvest_by_user.get(harvest_user_id, [])
+            org_plan.plans[harvest_emails[harvest_user_id]] = self._user_plan(
+                start_date,
+                end_date,
+                harvest_user_id,
+                # organize each user's toggl entries by dates worked
+                combine_entries_by_day(
+                    user_entries, user_harvest_entries, start_date, end_date, toggl_tz
+                ),
+                LockedPeriods.from_entries(user_harvest_entries),
+                toggl_tasks,
+                harvest_tasks,
+                task_association,
+                dict(timings),
+            )
+
+        return org_plan
+
+    @staticmethod
+    def _fetched_tables(
+        prefetch: SyncPrefetch,
+        harvest_user_id: int | None,
+        memory_report: MemoryReport | None = None,
+    ):
+        if prefetch.toggl is None or prefetch.harvest_entries is None:
+            raise ValueError("The prefetch was started without entries")
+        harvest_task_fetch = prefetch.harvest_tasks(harvest_user_id)
+
+        with memory_stage(memory_report, "toggl entries"):
+            toggl_tz, toggl_entries = prefetch.toggl.result()
+        with memory_stage(memory_report, "harvest entries"):
+            harvest_entries = prefetch.harvest_entries.result()
+        if not isinstance(harvest_entries, list):
+            raise RuntimeError(
+                "Unexpected object type received when querying for harvest time entries"
+            )
+        harvest_entries: list[HarvestTimeEntry] = harvest_entries
+
+        with memory_stage(memory_report, "task tables"):
+            toggl_tasks = toggl_task_table(
+                toggl_entries, prefetch.toggl_projects.result()
+            )
+            harvest_tasks = harvest_task_fetch.result()
+
+        return toggl_tz, toggl_entries, harvest_entries, toggl_tasks, harvest_tasks
+
+    @staticmethod
+    def _associate(
+        association: str | Callable[[list, list], TaskAssociation],
+        toggl_tasks: list[dict[str, Any]],
+        harvest_tasks: list[dict[str, Any]],
+    ) -> TaskAssociation:
+        if isinstance(association, str):
+            return build_task_association(
+                toggl_tasks,
+                harvest_tasks,
+                parse_task_association(
+                    association, len(toggl_tasks), len(harvest_tasks)
+                ),
+            )
+        return association(toggl_tasks, harvest_tasks)
+
+    def _user_plan(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        harvest_user_id: int,
+        combined_entries: dict[datetime, CombinedEntries],
+        locked: LockedPeriods,
+        toggl_tasks: list[dict[str, Any]],
+        harvest_tasks: list[dict[str, Any]],
+        task_association: TaskAssociation,
+        timings: dict[str, float],
+    ) -> SyncPlan:
+        # harvest refuses time on locked days one post at a time, so don't post
+        entries, pruned = locked.prune(
+            plan_harvest_entries(combined_entries, task_association, harvest_user_id)
+        )
+        return SyncPlan(
+            start_date=start_date,
+            end_date=end_date,
+            harvest_user_id=harvest_user_id,
+            toggl_tasks=toggl_tasks,
+            harvest_tasks=harvest_tasks,
+            task_association=task_association,
+            combined_entries=combined_entries,
+            entries=entries,
+            timings=timings,
+            pruned=pruned,
+        )
+
+    def apply(
+        self,
+        plan: SyncPlan,
+        confirm: bool | Callable[[SyncPlan], bool] = False,
+        progress: Callable[[dict[str, Any], Any], None] | None = None,
+    ) -> SyncResult:
+        """Post the plan's entries to harvest, if `confirm` is (or returns) true.
+
+        `progress` is called with each entry and harvest's response to it. When
+        the deadline runs out or harvest refuses an entry, posting stops and the
+        entries not yet posted are left in the result's `pending`. The entry
+        being posted when the deadline ran out may have made it into harvest
+        anyway.
+        """
+        confirmed = confirm(plan) if callable(confirm) else confirm
+        result = SyncResult(plan, confirmed)
+        if not confirmed:
+            return result
+
+        started = time.perf_counter()
+        try:
+            for entry in plan.entries:
+                response = self.harvest.post_all(
+                    url=HARVEST_TIME_ENTRIES_URL, data=entry
+                )
+                result.posted.append(response)
+                if progress is not None:
+                    progress(entry, response)
+        except (DeadlineExceeded, requests.HTTPError) as e:
+            result.pending = plan.entries[len(result.posted) :]
+            result.error = str(e)
+        plan.timings["post"] = round(time.perf_counter() - started, 3)
+
+        # a partly posted sync leaves its days for `reconcile` to find as changed
+        if result.error is None:
+            self._record_fingerprints(plan)
+
+        return result
+
+    def _record_fingerprints(self, plan: SyncPlan):
+        """Remember what each synced day looks like now, so `reconcile` can skip it."""
+        posted = partition_entries(plan.entries, lambda e: e["spent_date"])
+        combined_entries = {}
+        for day, entry in plan.combined_entries.items():
+            iso_day = day.date().isoformat()
+            if iso_day in posted:
+                harvest_tasks = dict(entry["harvest"]["tasks"])
+                for task, hours in aggregate_harvest_tasks(posted[iso_day]).items():
+                    harvest_tasks[task] = harvest_tasks.get(task, 0) + hours
+                entry = {**entry, "harvest": {"raw": [], "tasks": harvest_tasks}}
+            combined_entries[day] = entry
+
+        with update_fingerprints(self.fingerprint_file) as fingerprints:
+            index = fingerprints.setdefault(
+                fingerprint_key(self.harvest, plan.harvest_user_id), FingerprintIndex()
+            )
+            index.record(combined_entries, plan.start_date, plan.end_date)
+
+    def sync(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        association: str | Callable[[list, list], TaskAssociation],
+        harvest_email: HarvestEmail,
+        confirm: bool | Callable[[SyncPlan], bool] = False,
+        aggregate: bool = False,
+    ) -> SyncResult:
+        plan = self.plan(start_date, end_date, association, harvest_email, aggregate)
+        return self.apply(plan, confirm)
+
+    def close(self):
+        if self._owns_clients:
+            self.toggl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+
+def do_sync(
+    toggl: TogglSession,
+    harvest: Harvest,
+    start_date: datetime,
+    end_date: datetime,
+    harvest_email: str | None = None,
+    aggregate: bool = False,
+    max_memory: int | None = None,
+    memory_report: bool = False,
+    processes: int | None = None,
+):
+    """Convert Toggl time entries into Harvest timesheet entries.
+
+    With `aggregate`, toggl is asked for each day's totals rather than every
+    entry, and harvest entries are trimmed to their day, hours and notes. With
+    `max_memory` (bytes), the window is synced a slice at a time, with
+    `processes` in shards fetched by that many worker processes, and with
+    `memory_report` the memory each stage took is printed before posting.
+    """
+    pp = pprint.PrettyPrinter(indent=4)
+    session = SyncSession(toggl, harvest)
+    report = MemoryReport() if memory_report else None
+
+    # prompt the user for a task association config
+    try:
+        plan = session.plan(
+            start_date,
+            end_date,
+            task_association_config,
+            harvest_email or prompt_harvest_email,
+            aggregate,
+            max_memory=max_memory,
+            memory_report=report,
+            processes=processes,
+        )
+    except DeadlineExceeded as e:
+        print("{}, nothing was added to harvest".format(e))
+        exit(1)
+    except LookupError as e:
+        print(e)
+        exit(1)
+    finally:
+        if report is not None:
+            report.print()
+            report.close()
+
+    if plan.pruned:
+        print("The following Toggl entries fall on days Harvest has locked:")
+        print(tabulate(plan.pruned, headers="keys"))
+
+    print("The following Toggl entries will be added to Harvest:")
+    print(tabulate(plan.entries, headers="keys"))
+
+    def confirm(_plan: SyncPlan) -> bool:
+        return input("""Add the entries noted above to harvest? (y/n)""").lower() in (
+            "y",
+            "yes",
+        )
+
+    def progress(entry: dict[str, Any], response: Any):
+        #'{"user_id":1782959,"project_id":14307913,"task_id":8083365,"spent_date":"2017-03-21","hours":1.0}'
+        print("Posted: ")
+        pp.pprint(entry)
+        pp.pprint(response)
+
+    result = session.apply(plan, confirm, progress)
+    if not result.confirmed:
+        print("aborted")
+        exit(1)
+    if result.error is not None:
+        print(
+            "{}, {} of {} entries were not added:".format(
+                result.error, len(result.pending), len(plan.entries)
+            )
+        )
+        pp.pprint(result.pending)
+        exit(1)
+
+    print("done!")
+    exit(0)
+
+
+# what each field of a posted job may be, when given at all
+SYNC_JOB_FIELD_TYPES: dict[str, tuple[type, ...]] = {
+    "profile": (str,),
+    "harvest_email": (str,),
+    "association": (str,),
+    "mode": (str,),
+    "days": (int,),
+    "daterange": (list,),
+    "deadline": (int, float),
+}
+# how long finished jobs can still be looked up
+SYNC_JOB_TTL = timedelta(hours=1)
+
+
+@dataclass
+class SyncJob:
+    profile: str
+    start_date: datetime
+    end_date: datetime
+    harvest_email: str
+    association: str = ""
+    mode: Literal["plan", "apply"] = "plan"
+    # seconds the job may take once it starts running
+    deadline: float | None = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: Literal["queued", "running", "done", "failed"] = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+    result: dict[str, Any] | None = None
+    error: str | None = None
+
+    @classmethod
+    def from_request(cls, request: dict[str, Any]):
+        if not isinstance(request, dict):
+            raise ValueError("A job must be a json object")
+        for name, types in SYNC_JOB_FIELD_TYPES.items():
+            value = request.get(name)
+            # bools are ints to python, but not to whoever sent them
+            if value is not None and (
+                not isinstance(value, types) or isinstance(value, bool)
+            ):
+                raise ValueError(
+                    "`{}` must be {}".format(
+                        name, " or ".join(t.__name__ for t in types)
+                    )
+                )
+        if request.get("daterange") is not None and not all(
+            isinstance(x, str) for x in request["daterange"]
+        ):
+            raise ValueError("`daterange` must be a list of dates")
+        if not request.get("harvest_email"):
+            raise ValueError("`harvest_email` is required")
+        if request.get("mode", "plan") not in ("plan", "apply"):
+            raise ValueError("`mode` must be one of: plan, apply")
+
+        start_date, end_date = parse_date_range(
+            request.get("days"), request.get("daterange")
+        )
+        return cls(
+            profile=request.get("profile", DEFAULT_PROFILE),
+            start_date=start_date,
+            end_date=end_date,
+            harvest_email=request["harvest_email"],
+            association=request.get("association", ""),
+            mode=request.get("mode", "plan"),
+            deadline=request.get("deadline"),
+        )
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = round(time.perf_counter() - started, 3)
+
+    def summary(self) -> dict[str, Any]:
+        summary = asdict(self)
+        summary["start_date"] = self.start_date.date().isoformat()
+        summary["end_date"] = self.end_date.date().isoformat()
+        return summary
+
+
+class Coalescer:
+    """Lets concurrent callers asking for the same key share a single call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[Any, Future] = {}
+
+    def run[T](self, key: Any, fetch: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if future is None:
+                future = self._in_flight[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+
+        return future.result()
+
+
+class SyncService:
+    """Runs queued sync jobs on a bounded pool of workers.
+
+    Clients are kept per key for the lifetime of the service, and jobs fetching
+    with the same keys and window at the same time share one download.
+    Jobs never prompt: the harvest user and association formula come with the job.
+    """
+
+    def __init__(self, cache_file: pathlib.Path, workers: int = 4):
+        self.credential_store = CredentialStore(cache_file)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync")
+        self.coalescer = Coalescer()
+        self.jobs: dict[str, SyncJob] = {}
+        self._lock = threading.Lock()
+        self._toggl: dict[str, TogglSession] = {}
+        self._harvest: dict[tuple[str, str], Harvest] = {}
+
+    def submit(self, job: SyncJob) -> SyncJob:
+        self.expire()
+        with self._lock:
+            self.jobs[job.id] = job
+        self.pool.submit(self._run, job)
+        return job
+
+    def expire(self):
+        """Forget the jobs that finished more than SYNC_JOB_TTL ago."""
+        expired_before = time.time() - SYNC_JOB_TTL.total_seconds()
+        with self._lock:
+            for job_id in [
+                job.id
+                for job in self.jobs.values()
+                if job.finished_at is not None and job.finished_at < expired_before
+            ]:
+                del self.jobs[job_id]
+
+    def clients(self, profile: str) -> tuple[TogglSession, Harvest]:
+        creds = ConfirmedCredentials.from_creds(self.credential_store.get(profile))
+        with self._lock:
+            if creds.toggl_key not in self._toggl:
+                self._toggl[creds.toggl_key] = TogglSession(
+                    toggl_auth_.TokenAuth(creds.toggl_key)
+                )
+            harvest_key = (creds.harvest_account_id, creds.harvest_key)
+            if harvest_key not in self._harvest:
+                self._harvest[harvest_key] = Harvest(*harvest_key)
+
+            return self._toggl[creds.toggl_key], self._harvest[harvest_key]
+
+    def _run(self, job: SyncJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = self.execute(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = "{}: {}".format(type(e).__name__, e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def execute(self, job: SyncJob) -> dict[str, Any]:
+        toggl, harvest = self.clients(job.profile)
+        session = SyncSession(toggl, harvest, self.coalescer)
+
+        with deadline_scope(Deadline(job.deadline)):
+            plan = session.plan(
+                job.start_date, job.end_date, job.association, job.harvest_email
+            )
+            result = session.apply(plan, confirm=job.mode == "apply")
+        job.timings.update(plan.timings)
+
+        tables = plan.tables()
+        if result.confirmed:
+            tables["posted"] = result.posted
+        if result.error is not None:
+            job.error = result.error
+            tables["pending"] = result.pending
+        return tables
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        for toggl in self._toggl.values():
+            toggl.close()
+
+
+class JsonRequestHandler(BaseHTTPRequestHandler):
+    server: "ThreadingHTTPServer | UnixHTTPServer"
+
+    def send_json(self, status: int, body: Any):
+        encoded = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    @override
+    def address_string(self) -> str:
+        # unix socket clients don't have an address
+        return str(self.client_address[0] if self.client_address else "unix")
+
+
+class SyncServiceHandler(JsonRequestHandler):
+    """`POST /jobs` queues a job, `GET /jobs` and `GET /jobs/<id>` report on them."""
+
+    @property
+    def service(self) -> SyncService:
+        return self.server.service  # pyright: ignore[reportAttributeAccessIssue]
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        self.service.expire()
+        job = self.service.jobs.get(parts[1]) if len(parts) == 2 else None
+        if parts == ["jobs"]:
+            jobs = list(self.service.jobs.values())
+            self.send_json(200, [job.summary() for job in jobs])
+        elif parts[:1] == ["jobs"] and job is not None:
+            self.send_json(200, job.summary())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            job = SyncJob.from_request(json.loads(self.read_body() or b"{}"))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        self.send_json(202, self.service.submit(job).summary())
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+@app.command()
+def serve(
+    host: Annotated[str, typer.Option(help="Address to listen on")] = "127.0.0.1",
+    port: Annotated[int, typer.Option(help="Port to listen on")] = 8765,
+    unix_socket: Annotated[
+        pathlib.Path | None,
+        typer.Option("--socket", help="Listen on this unix socket instead of tcp"),
+    ] = None,
+    workers: Annotated[
+        int, typer.Option(help="Number of sync jobs to run at the same time")
+    ] = 4,
+    cache_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location to look for toggl and harvest credentials",
+        ),
+    ] = pathlib.Path(".creds"),
+):
+    """Run a local service that accepts sync jobs over http.
+
+    Jobs are posted to /jobs as json, e.g.
+    {"profile": "default", "days": 7, "harvest_email": "me@example.com",
+    "association": "0:3>1", "mode": "plan"}, and polled at /jobs/<id>.
+    """
+    service = SyncService(cache_file, workers)
+    if unix_socket is not None:
+        unix_socket.unlink(missing_ok=True)
+        server = UnixHTTPServer(str(unix_socket), SyncServiceHandler)
+        print("listening on {}".format(unix_socket))
+    else:
+        server = ThreadingHTTPServer((host, port), SyncServiceHandler)
+        print("listening on http://{}:{}".format(host, port))
+    server.service = service  # pyright: ignore[reportAttributeAccessIssue]
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+TOGGL_SIGNATURE_HEADER = "X-Webhook-Signature-256"
+
+
+def verify_toggl_signature(secret: str, body: bytes, signature: str | None) -> bool:
+    """Check toggl's `sha256=<hex hmac of the body>` webhook signature."""
+    if not signature:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip())
+
+
+class Debouncer:
+    """Calls `callback(key)` once `delay` seconds pass without another `touch(key)`."""
+
+    def __init__(self, delay: float, callback: Callable[[Any], None]):
+        self.delay = delay
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._timers: dict[Any, threading.Timer] = {}
+
+    def touch(self, key: Any):
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            timer = self._timers[key] = threading.Timer(self.delay, self._fire, (key,))
+            timer.daemon = True
+            timer.start()
+
+    def _fire(self, key: Any):
+        with self._lock:
+            # touched again after this timer ran out, a newer one will fire
+            if self._timers.get(key) is not threading.current_thread():
+                return
+            del self._timers[key]
+        self.callback(key)
+
+    def flush(self):
+        """Run every pending callback now, instead of waiting for its timer."""
+        with self._lock:
+            pending = list(self._timers)
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        for key in pending:
+            self.callback(key)
+
+    def close(self):
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+
+
+@dataclass
+class HarvestDelta:
+    create: list[dict[str, Any]] = field(default_factory=list)
+    # (harvest time entry id, changed fields)
+    update: list[tuple[int, dict[str, Any]]] = field(default_factory=list)
+    delete: list[int] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.create or self.update or self.delete)
+
+
+def managed_harvest_keys(
+    task_association: TaskAssociation,
+) -> set[tuple[int, int, str]]:
+    """(harvest project, harvest task, notes) of every entry a sync could create."""
+    return {
+        (project_id, task_id, description)
+        for descriptions in task_association.values()
+        for description, association in descriptions.items()
+        for project_id, task_id in zip(
+            association["harvest_project_id"], association["harvest_task_id"]
+        )
+    }
+
+
+def harvest_day_delta(
+    desired: list[dict[str, Any]],
+    existing: list[dict[str, Any]],
+    managed: set[tuple[int, int, str]],
+) -> HarvestDelta:
+    """Changes that make a day's harvest entries match the `desired` ones.
+
+    Entries are matched on (project, task, notes). Existing entries no toggl task
+    could have created are left alone, whatever they are.
+    """
+    wanted: dict[tuple[int, int, str], dict[str, Any]] = {}
+    for entry in desired:
+        key = (entry["project_id"], entry["task_id"], entry["notes"])
+        if key in wanted:
+            # two toggl tasks sent to the same harvest task with the same notes
+            wanted[key] = dict(
+                wanted[key], hours=round(wanted[key]["hours"] + entry["hours"], 2)
+            )
+        else:
+            wanted[key] = entry
+
+    found: dict[tuple[int, int, str], list[dict[str, Any]]] = {}
+    for entry in existing:
+        key = (entry["project"]["id"], entry["task"]["id"], entry["notes"])
+        if key in managed:
+            found.setdefault(key, []).append(entry)
+
+    delta = HarvestDelta()
+    for key, entry in wanted.items():
+        matches = found.pop(key, [])
+        if not matches:
+            delta.create.append(entry)
+            continue
+        first, *duplicates = matches
+        if round(first["hours"], 2) != entry["hours"]:
+            delta.update.append((first["id"], {"hours": entry["hours"]}))
+        delta.delete += [duplicate["id"] for duplicate in duplicates]
+    delta.delete += [entry["id"] for entries in found.values() for entry in entries]
+
+    return delta
+
+
+# how many entries WebhookSync remembers the day of, and deltas it keeps
+WEBHOOK_ENTRIES = 100_000
+WEBHOOK_HISTORY = 1000
+# attempts at pushing a day after the first fails, a debounce apart
+WEBHOOK_RETRIES = 3
+
+
+class WebhookSync:
+    """Mirrors toggl time entry events into harvest, a (user, day) at a time.
+
+    Events only mark the days they touch; once a day has been quiet for
+    `debounce` seconds its toggl entries are refetched, totalled like any other
+    sync, and the difference pushed to harvest. Nothing is requested from
+    either api between events.
+    """
+
+    def __init__(
+        self,
+        toggl: TogglSession,
+        harvest: Harvest,
+        task_association: TaskAssociation,
+        harvest_users: dict[int, int],
+        debounce: float = 5.0,
+    ):
+        self.toggl = toggl
+        self.harvest = harvest
+        self.toggl_tz = toggl.timezone()
+        self.task_association = task_association
+        self.managed = managed_harvest_keys(task_association)
+        # harvest user ids by toggl user id
+        self.harvest_users = harvest_users
+        self.debouncer = Debouncer(debounce, self.resync)
+        # the (user, day) each entry was last seen on, to clean up after moves;
+        # least recently seen first, and only the latest WEBHOOK_ENTRIES kept
+        self.entry_days: dict[int, tuple[int, str]] = {}
+        # the latest WEBHOOK_HISTORY deltas pushed
+        self.pushed: deque[tuple[tuple[int, str], HarvestDelta]] = deque(
+            maxlen=WEBHOOK_HISTORY
+        )
+        # failed attempts of each day still to be retried
+        self.failures: dict[tuple[int, str], int] = {}
+        self._lock = threading.Lock()
+        self._day_locks: dict[tuple[int, str], threading.Lock] = {}
+
+    def handle(self, event: dict[str, Any]) -> dict[str, Any]:
+        """Take in one webhook event, returning the body to answer it with."""
+        if event.get("payload") == "ping":
+            # toggl checks a new subscription by having it echo this code
+            return {"validation_code": event.get("validation_code")}
+
+        metadata = event.get("metadata") or {}
+        entry = event.get("payload")
+        if metadata.get("model") != "time_entry" or not isinstance(entry, dict):
+            return {}
+
+        user_id = int(entry.get("user_id") or metadata["event_user_id"])
+        keys = set()
+        with self._lock:
+            previous = self.entry_days.pop(entry["id"], None)
+            if previous is not None:
+                keys.add(previous)
+            if entry.get("start"):
+                # entries starting exactly at midnight belong to the previous
+                # day, same as in `combine_entries_by_day`
+                start = datetime.fromisoformat(entry["start"]).astimezone(self.toggl_tz)
+                day = (start - timedelta(microseconds=1)).date().isoformat()
+                keys.add((user_id, day))
+                if metadata.get("action") != "deleted":
+                    self.entry_days[entry["id"]] = (user_id, day)
+                    if len(self.entry_days) > WEBHOOK_ENTRIES:
+                        del self.entry_days[next(iter(self.entry_days))]
+
+        for key in keys:
+            if key[0] in self.harvest_users:
+                self.debouncer.touch(key)
+        return {}
+
+    def resync(self, key: tuple[int, str]):
+        with self._lock:
+            day_lock = self._day_locks.setdefault(key, threading.Lock())
+        with day_lock:
+            try:
+                delta = self.push_day(*key)
+            except Exception as e:
+                with self._lock:
+                    attempts = self.failures[key] = self.failures.get(key, 0) + 1
+                if attempts <= WEBHOOK_RETRIES:
+                    retry = "retrying"
+                    self.debouncer.touch(key)
                 else:
-                    ttasks.append(toggl_tasks[int(idmatch["single"])])
+                    retry = "giving up until it changes again"
+                    with self._lock:
+                        del self.failures[key]
+                print(
+                    "Could not sync {} for toggl user {}, {}: {}".format(
+                        key[1], key[0], retry, e
+                    )
+                )
+                return
+        with self._lock:
+            self.failures.pop(key, None)
+        if delta:
+            self.pushed.append((key, delta))
+            print(
+                "{} for toggl user {}: {} added, {} updated, {} removed".format(
+                    key[1],
+                    key[0],
+                    len(delta.create),
+                    len(delta.update),
+                    len(delta.delete),
+                )
+            )
+
+    def push_day(self, toggl_user_id: int, day: str) -> HarvestDelta:
+        harvest_user_id = self.harvest_users[toggl_user_id]
+        date = datetime.fromisoformat(day)
+        window = [
+            self.toggl_tz.localize(date),
+            self.toggl_tz.localize(date + timedelta(days=1)),
+        ]
+        toggl_entries = [
+            entry
+            for workspace in self.toggl.workspaces()
+            # only the json search can be narrowed down to one user
+            for page in fetch_toggl_window_pages(
+                self.toggl,
+                workspace.id,
+                window,
+                self.toggl_tz,
+                export=False,
+                user_ids=[toggl_user_id],
+            )
+            for entry in page
+            if entry.description in self.task_association.get(entry.project_id, {})
+        ]
+
+        # planned as if harvest had nothing that day, then compared to what it has
+        desired = plan_harvest_entries(
+            combine_entries_by_day(toggl_entries, [], date, date, self.toggl_tz),
+            self.task_association,
+            harvest_user_id,
+        )
+        existing = self.harvest.get_time_entries(
+            {"from": day, "to": day, "user_id": harvest_user_id}
+        )
+        delta = harvest_day_delta(desired, existing, self.managed)
+
+        for entry in delta.create:
+            self.harvest.post_all(url=HARVEST_TIME_ENTRIES_URL, data=entry)
+        for entry_id, changes in delta.update:
+            self.harvest.patch(
+                url="{}/{}".format(HARVEST_TIME_ENTRIES_URL, entry_id), data=changes
+            )
+        for entry_id in delta.delete:
+            self.harvest.delete(url="{}/{}".format(HARVEST_TIME_ENTRIES_URL, entry_id))
+
+        return delta
+
+    def close(self):
+        self.debouncer.close()
+
+
+class TogglWebhookHandler(JsonRequestHandler):
+    """Receives toggl webhook events, answering each once its signature checks out."""
+
+    @property
+    def webhook(self) -> WebhookSync:
+        return self.server.webhook  # pyright: ignore[reportAttributeAccessIssue]
+
+    def do_POST(self):
+        body = self.read_body()
+        secret: str = self.server.secret  # pyright: ignore[reportAttributeAccessIssue]
+        if not verify_toggl_signature(
+            secret, body, self.headers.get(TOGGL_SIGNATURE_HEADER)
+        ):
+            self.send_json(401, {"error": "bad signature"})
+            return
+
+        try:
+            event = json.loads(body)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        self.send_json(200, self.webhook.handle(event))
+
+
+@app.command()
+def webhook(
+    secret: Annotated[
+        str,
+        typer.Option(
+            envvar="TOGGL_WEBHOOK_SECRET",
+            help="The secret the toggl webhook subscription signs its events with",
+        ),
+    ],
+    host: Annotated[str, typer.Option(help="Address to listen on")] = "127.0.0.1",
+    port: Annotated[int, typer.Option(help="Port to listen on")] = 8766,
+    debounce: Annotated[
+        float,
+        typer.Option(help="Seconds a day has to be quiet before it's pushed"),
+    ] = 5.0,
+    days: Annotated[
+        int,
+        typer.Option(
+            "--days",
+            "-d",
+            help="# of past days whose tasks make up the association tables",
+        ),
+    ] = 30,
+    association: Annotated[
+        str | None,
+        typer.Option(help="Association formula, prompted for if not given"),
+    ] = None,
+    harvest_email: Annotated[
+        str | None,
+        typer.Option(
+            "--harvest-email",
+            "-hem",
+            help="the email address associated with your harvest user to create new time entries under",
+        ),
+    ] = None,
+    org_mode: Annotated[
+        bool,
+        typer.Option(
+            "--org",
+            help="Mirror everyone in the workspace, matched to harvest users by email",
+        ),
+    ] = False,
+    user_map: Annotated[
+        pathlib.Path | None,
+        typer.Option(
+            help="With --org, a json object mapping toggl emails (or user ids) to harvest emails",
+        ),
+    ] = None,
+    cache_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location to look for toggl and harvest credentials",
+        ),
+    ] = pathlib.Path(".creds"),
+    profile: Annotated[
+        str,
+        typer.Option("--profile", "-p", help="Name of the stored credentials to use"),
+    ] = DEFAULT_PROFILE,
+):
+    """Mirror toggl time entries into harvest as toggl reports changes to them.
+
+    Point a toggl webhook subscription for time entry events at this address.
+    Every change is pushed to harvest a few seconds after the day it falls on
+    stops changing: entries are added, updated or removed so the day's harvest
+    entries match its toggl totals.
+    """
+    creds = ConfirmedCredentials.from_creds(CredentialStore(cache_file).get(profile))
+    start_date, end_date = parse_date_range(days, None)
+
+    with SyncSession.from_credentials(creds) as session:
+        plan = session.plan(
+            start_date,
+            end_date,
+            association or task_association_config,
+            harvest_email or prompt_harvest_email,
+        )
+        if org_mode:
+            mapping = json.loads(user_map.read_text()) if user_map is not None else {}
+            harvest_users = match_org_users(
+                session.toggl.workspace_users(), session.harvest.get_users(), mapping
+            )
+        else:
+            harvest_users = {session.toggl.me().id: plan.harvest_user_id}
+
+        receiver = WebhookSync(
+            session.toggl,
+            session.harvest,
+            plan.task_association,
+            harvest_users,
+            debounce,
+        )
+        server = ThreadingHTTPServer((host, port), TogglWebhookHandler)
+        server.webhook = receiver  # pyright: ignore[reportAttributeAccessIssue]
+        server.secret = secret  # pyright: ignore[reportAttributeAccessIssue]
+        print("listening on http://{}:{}".format(host, port))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            # push whatever was still waiting out its debounce
+            receiver.debouncer.flush()
+            receiver.close()
+
+
+# toggl only reports modifications made within the last 90 days
+TOGGL_SINCE_LIMIT = timedelta(days=89)
+
+
+def changed_days_since(
+    toggl: TogglSession,
+    harvest: Harvest,
+    harvest_user_id: int,
+    checked_at: str | None,
+    start_date: datetime,
+    end_date: datetime,
+    toggl_tz: Any,
+) -> set[str] | None:
+    """Days touched on either side since `checked_at`, None if that's unknowable."""
+    if checked_at is None:
+        return None
+
+    since = datetime.fromisoformat(checked_at)
+    if datetime.now(pytz.utc) - since > TOGGL_SINCE_LIMIT:
+        return None
+
+    days = set()
+
+    # modified (including deleted) toggl entries; entries starting exactly at
+    # midnight belong to the previous day, same as in `combine_entries_by_day`
+    for entry in toggl.user.get_time_entries(since=int(since.timestamp())):
+        local_start = entry.start.astimezone(toggl_tz) - timedelta(microseconds=1)
+        days.add(local_start.date().isoformat())
+
+    for entry in harvest.iter_all(
+        HARVEST_TIME_ENTRIES_URL,
+        "time_entries",
+        params={
+            "updated_since": since.isoformat(),
+            "user_id": harvest_user_id,
+            "from": start_date.date().isoformat(),
+            "to": end_date.date().isoformat(),
+        },
+        fields=("spent_date",),
+    ):
+        days.add(entry["spent_date"])
+
+    first, last = start_date.date().isoformat(), end_date.date().isoformat()
+    return {d for d in days if first <= d <= last}
+
+
+def fingerprints_fresh(
+    fingerprint_file: pathlib.Path,
+    harvest: Harvest,
+    harvest_user_id: int,
+    start_date: datetime,
+    end_date: datetime,
+) -> bool:
+    """Whether `reconcile` can ask what changed, instead of refetching the window."""
+    index = read_cache(fingerprint_file).get(fingerprint_key(harvest, harvest_user_id))
+    if index is None:
+        return False
+    checked_at = FingerprintIndex.from_cache(index).checked_since(start_date, end_date)
+    return (
+        checked_at is not None
+        and datetime.now(pytz.utc) - datetime.fromisoformat(checked_at)
+        <= TOGGL_SINCE_LIMIT
+    )
+
+
+@app.command()
+def reconcile(
+    harvest_email: Annotated[
+        str | None,
+        typer.Option(
+            "--harvest-email",
+            "-hem",
+            help="the email address of the harvest user that was synced to",
+        ),
+    ] = None,
+    days: Annotated[
+        int | None,
+        typer.Option(
+            "--days",
+            "-d",
+            click_type=mutual_date_option,
+            help="""integer # of days in the past, from today, to reconcile
+            NOTE: This argument is mutually exclusive with arguments: [daterange, datebound].
+            """,
+        ),
+    ] = None,
+    daterange: Annotated[
+        tuple[str, str] | None,
+        typer.Option(
+            "--daterange",
+            "-dr",
+            click_type=mutual_date_option,
+            help="""Two dates bounding inclusively the dates to reconcile, separated by a space.
+            NOTE: This argument is mutually exclusive with arguments: [days, datebound].
+            """,
+        ),
+    ] = None,
+    datebound: Annotated[
+        str | None,
+        typer.Option(
+            "--datebound",
+            "-db",
+            click_type=mutual_date_option,
+            help="""A date in the past from which to reconcile.
+            NOTE: This argument is mutually exclusive with arguments: [days, daterange].
+            """,
+        ),
+    ] = None,
+    cache_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location to look for toggl and harvest credentials",
+        ),
+    ] = pathlib.Path(".creds"),
+    profile: Annotated[
+        str,
+        typer.Option("--profile", "-p", help="Name of the stored credentials to use"),
+    ] = DEFAULT_PROFILE,
+    fingerprint_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location of the per-day fingerprints recorded by previous syncs",
+        ),
+    ] = pathlib.Path(".fingerprints"),
+):
+    """Find the days that changed on either side since the last sync or reconcile.
+
+    Only the days reported as modified by toggl and harvest are refetched; their
+    fingerprints are then compared against the ones stored before.
+    """
+    start_date, end_date = parse_date_range(
+        days, (daterange and list(daterange)) or (datebound and [datebound]) or None
+    )
+
+    creds = ConfirmedCredentials.from_creds(CredentialStore(cache_file).get(profile))
+
+    harvest = Harvest(creds.harvest_account_id, creds.harvest_key)
+
+    with TogglSession(toggl_auth_.TokenAuth(creds.toggl_key)) as toggl:
+        toggl_tz = toggl.timezone()
+        harvest_user_id = resolve_harvest_user_id(
+            harvest.get_users(), harvest_email or prompt_harvest_email
+        )
+
+        with update_fingerprints(fingerprint_file) as fingerprints:
+            key = fingerprint_key(harvest, harvest_user_id)
+            index = fingerprints.get(key, FingerprintIndex())
+
+            # changes made while refetching are picked up by the next reconcile
+            checked_at = datetime.now(pytz.utc).isoformat()
+            dirty = changed_days_since(
+                toggl,
+                harvest,
+                harvest_user_id,
+                index.checked_since(start_date, end_date),
+                start_date,
+                end_date,
+                toggl_tz,
+            )
+            if dirty is None:
+                print("No recent fingerprints, fetching the whole date range...")
+                ranges = [(start_date, end_date)]
+            else:
+                ranges = day_ranges(list(dirty))
+
+            updated = FingerprintIndex(
+                dict(index.toggl), dict(index.harvest), dict(index.checked)
+            )
+            for first, last in ranges:
+                toggl_entries = fetch_toggl_entries(
+                    toggl, first, last + timedelta(days=1), toggl_tz
+                )
+                harvest_entries = harvest.get_time_entries(
+                    params={
+                        "user_id": harvest_user_id,
+                        "from": first.date().isoformat(),
+                        "to": last.date().isoformat(),
+                    }
+                )
+                updated.record(
+                    combine_entries_by_day(
+                        toggl_entries, harvest_entries, first, last, toggl_tz
+                    ),
+                    first,
+                    last,
+                    checked_at,
+                )
+            updated.mark_checked(start_date, end_date, checked_at)
+            fingerprints[key] = updated
+
+    changed = sorted(
+        set(diff_fingerprints(index.toggl, updated.toggl))
+        | set(diff_fingerprints(index.harvest, updated.harvest))
+    )
+    if not changed:
+        print("nothing changed")
+        return
+
+    print("The following days changed since they were last synced:")
+    print(
+        tabulate(
+            [
+                [first.date().isoformat(), last.date().isoformat()]
+                for first, last in day_ranges(changed)
+            ],
+            headers=["From", "To"],
+        )
+    )
+
+
+def sync_stats_key(toggl: TogglSession, harvest: Harvest) -> str:
+    return f"{toggl.cache_key}:{harvest.account_id}"
+
+
+def record_sync_stats(
+    toggl: TogglSession,
+    harvest: Harvest,
+    start_date: datetime,
+    end_date: datetime,
+    toggl_rows: int,
+    harvest_entries: int,
+    stats_file: pathlib.Path | None = None,
+):
+    """Remember how dense the account's data is, for estimating later syncs."""
+    days = max((end_date - start_date).days, 1)
+    DiskCache(stats_file or state.stats_file, SYNC_STATS_TTL).set(
+        sync_stats_key(toggl, harvest),
+        {
+            "toggl_rows_per_day": toggl_rows / days,
+            "harvest_entries_per_day": harvest_entries / days,
+        },
+    )
+
+
+@dataclass
+class SyncProbe:
+    days: int
+    workspaces: int
+    toggl_rows_per_day: float
+    harvest_counts: dict[str, int]
+    toggl_latency: float
+    harvest_latency: float
+    fingerprints_fresh: bool
+    requests: int
+
+
+def probe_sync_cost(
+    toggl: TogglSession,
+    harvest: Harvest,
+    start_date: datetime,
+    end_date: datetime,
+    harvest_user_id: int,
+) -> SyncProbe:
+    """Measure what a sync of the window would have to download, as cheaply as possible.
+
+    Harvest listings are sized with one-record pages. Toggl has no totals, so its
+    density comes from the stats of earlier syncs, or else from the first report
+    page of the last month of the window.
+    """
+    days = max((end_date - start_date).days, 1)
+    requests_made = 0
+
+    started = time.perf_counter()
+    workspaces = toggl.workspaces()
+    toggl_tz = toggl.timezone()
+    toggl_latency = time.perf_counter() - started
+
+    stats = DiskCache(state.stats_file, SYNC_STATS_TTL).get(
+        sync_stats_key(toggl, harvest)
+    )
+    if stats is not None:
+        toggl_rows_per_day = stats["toggl_rows_per_day"]
+    else:
+        sample_start = max(start_date, end_date - timedelta(days=30))
+        sample_days = max((end_date - sample_start).days, 1)
+        toggl_rows_per_day = 0.0
+        for workspace in workspaces:
+            started = time.perf_counter()
+            rows = toggl.reports.search(
+                workspace.id,
+                toggl_tz.localize(sample_start),
+                toggl_tz.localize(end_date),
+                page_size=TOGGL_REPORT_PAGE_SIZE,
+            )
+            toggl_latency = time.perf_counter() - started
+            requests_made += 1
+            if len(rows) < TOGGL_REPORT_PAGE_SIZE:
+                toggl_rows_per_day += len(rows) / sample_days
+            else:
+                # a full page: extrapolate from the days it covers
+                starts = [row.time_entries[0].start for row in rows]
+                covered = max((max(starts) - min(starts)).days, 1)
+                toggl_rows_per_day += len(rows) / covered
+
+    harvest_counts = {}
+    harvest_latency = 0.0
+    window = {"from": start_date.date().isoformat(), "to": end_date.date().isoformat()}
+    for name, url, params in (
+        ("time_entries", HARVEST_TIME_ENTRIES_URL, window),
+        ("users", HARVEST_USERS_URL, None),
+        ("projects", HARVEST_PROJECTS_URL, None),
+        ("task_assignments", HARVEST_TASK_ASSIGNMENTS_URL, None),
+    ):
+        started = time.perf_counter()
+        harvest_counts[name] = harvest.count(url, params)
+        harvest_latency = max(harvest_latency, time.perf_counter() - started)
+        requests_made += 1
+
+    return SyncProbe(
+        days=days,
+        workspaces=len(workspaces),
+        toggl_rows_per_day=toggl_rows_per_day,
+        harvest_counts=harvest_counts,
+        toggl_latency=toggl_latency,
+        harvest_latency=harvest_latency,
+        fingerprints_fresh=fingerprints_fresh(
+            state.fingerprint_file, harvest, harvest_user_id, start_date, end_date
+        ),
+        requests=requests_made,
+    )
+
+
+@dataclass
+class StageEstimate:
+    stage: str
+    requests: int
+    bytes: int
+    seconds: float
+
+
+@dataclass
+class SyncEstimate:
+    strategy: str
+    window_days: int
+    concurrency: int
+    stages: list[StageEstimate]
+
+    @property
+    def requests(self) -> int:
+        return sum(stage.requests for stage in self.stages)
+
+    @property
+    def bytes(self) -> int:
+        return sum(stage.bytes for stage in self.stages)
+
+    @property
+    def seconds(self) -> float:
+        # toggl and harvest are fetched at the same time, posting comes after
+        fetches = [s.seconds for s in self.stages if s.stage != "post"]
+        posts = [s.seconds for s in self.stages if s.stage == "post"]
+        return max(fetches, default=0) + sum(posts)
+
+
+def request_seconds(
+    requests: int, latency: float, concurrency: int, per_second: float
+) -> float:
+    """Time for `requests` calls, bounded by both latency and the rate limit."""
+    return max(requests * latency / max(concurrency, 1), requests / per_second)
+
+
+def estimate_sync_cost(
+    probe: SyncProbe,
+    window_days: int,
+    concurrency: int,
+    export: bool = True,
+    aggregate: bool = False,
+) -> SyncEstimate:
+    windows = math.ceil(probe.days / window_days)
+    toggl_rows = probe.toggl_rows_per_day * probe.days
+    rows_per_window = toggl_rows / windows
+    if export:
+        # one csv download per (workspace, window) pair, totalled by day as it
+        # comes in when aggregating
+        toggl_requests = windows * max(probe.workspaces, 1)
+    else:
+        # every (workspace, window) pair ends on an empty page
+        toggl_requests = windows * math.ceil(
+            rows_per_window / TOGGL_REPORT_PAGE_SIZE
+        ) + windows * max(probe.workspaces, 1)
+
+    harvest_requests = {
+        name: max(math.ceil(count / HARVEST_PER_PAGE), 1)
+        for name, count in probe.harvest_counts.items()
+    }
+    if aggregate:
+        strategy, toggl_record = "aggregate", "toggl_export"
+    elif export:
+        strategy, toggl_record = "export", "toggl_export"
+    else:
+        strategy, toggl_record = "paged", "toggl_reports"
+    posts = max(round(toggl_rows - probe.harvest_counts.get("time_entries", 0)), 0)
+
+    stages = [
+        StageEstimate(
+            "toggl reports",
+            toggl_requests,
+            round(toggl_rows * RECORD_BYTES[toggl_record]),
+            request_seconds(
+                toggl_requests,
+                probe.toggl_latency,
+                concurrency,
+                TOGGL_REQUESTS_PER_SECOND,
+            ),
+        ),
+        StageEstimate(
+            "harvest listings",
+            sum(harvest_requests.values()),
+            # aggregated syncs download whole entries too, and only keep the
+            # fields they total afterwards
+            sum(
+                count * RECORD_BYTES[name]
+                for name, count in probe.harvest_counts.items()
+            ),
+            # the listings are downloaded side by side, pages one after another
+            max(
+                max(
+                    (n * probe.harvest_latency for n in harvest_requests.values()),
+                    default=0,
+                ),
+                sum(harvest_requests.values()) / HARVEST_REQUESTS_PER_SECOND,
+            ),
+        ),
+        StageEstimate(
+            "post",
+            posts,
+            posts * RECORD_BYTES["posts"],
+            request_seconds(
+                posts, probe.harvest_latency, 1, HARVEST_REQUESTS_PER_SECOND
+            ),
+        ),
+    ]
+    return SyncEstimate(strategy, window_days, concurrency, stages)
+
+
+def plan_sync_strategies(probe: SyncProbe) -> list[SyncEstimate]:
+    """The ways `sync` can fetch the window, cheapest first.
+
+    Its only concurrency is `--processes`, each fetching a shard of the days as
+    one report window per workspace; a single process fetches SHARD_DAYS-day
+    windows one after another.
+    """
+    estimates = []
+    for processes in SYNC_PROCESSES:
+        window_days = min(SHARD_DAYS, math.ceil(probe.days / processes))
+        estimates += [
+            estimate_sync_cost(probe, window_days, processes, aggregate=aggregate)
+            for aggregate in (False, True)
+        ]
+
+    # aggregating costs the same to fetch, it only keeps less in memory
+    return sorted(
+        estimates,
+        key=lambda e: (e.seconds, e.requests, e.concurrency, e.strategy != "export"),
+    )
+
 
-            config_group["htasks"] = htasks
-            config_group["ttasks"] = ttasks
+def sync_flags(estimate: SyncEstimate) -> str:
+    """The `sync` options that fetch the way `estimate` does."""
+    flags = []
+    if estimate.strategy == "aggregate":
+        flags.append("--aggregate")
+    if estimate.concurrency > 1:
+        flags.append("--processes {}".format(estimate.concurrency))
+    return " ".join(flags)
 
-            config_groups.append(config_group)
 
-        ttasks_ignored = [
-            t
-            for t in toggl_tasks
-            if t not in [x for grp in config_groups for x in grp["ttasks"]]
+def print_sync_plan(
+    toggl: TogglSession,
+    harvest: Harvest,
+    start_date: datetime,
+    end_date: datetime,
+    harvest_user_id: int,
+):
+    probe = probe_sync_cost(toggl, harvest, start_date, end_date, harvest_user_id)
+    estimates = plan_sync_strategies(probe)
+    chosen = estimates[0]
+
+    print(
+        "Probed with {} request(s): {} day(s), {} workspace(s), "
+        "~{:.1f} toggl entries/day, {} harvest time entries.".format(
+            probe.requests,
+            probe.days,
+            probe.workspaces,
+            probe.toggl_rows_per_day,
+            probe.harvest_counts["time_entries"],
+        )
+    )
+    print(
+        tabulate(
+            [
+                [
+                    e.strategy,
+                    e.window_days,
+                    e.concurrency,
+                    e.requests,
+                    round(e.bytes / 1e6, 2),
+                    round(e.seconds, 1),
+                    sync_flags(e),
+                ]
+                for e in estimates
+            ],
+            headers=[
+                "Strategy",
+                "Window (days)",
+                "Processes",
+                "Requests",
+                "MB",
+                "Seconds",
+                "Sync options",
+            ],
+        )
+    )
+    print()
+    print("Cheapest: sync {}".format(sync_flags(chosen) or "with no extra options"))
+    print(
+        tabulate(
+            [
+                [
+                    stage.stage,
+                    stage.requests,
+                    round(stage.bytes / 1e6, 2),
+                    round(stage.seconds, 1),
+                ]
+                for stage in chosen.stages
+            ],
+            headers=["Stage", "Requests", "MB", "Seconds"],
+        )
+    )
+    if probe.fingerprints_fresh:
+        # a diff, not a sync, so it isn't ranked with the ones above
+        print()
+        print(
+            "The window was synced or reconciled recently: `reconcile` can list "
+            "the days changed since with a request to each service, so only those "
+            "need syncing again."
+        )
+
+
+@app.command()
+def plan(
+    harvest_email: Annotated[
+        str | None,
+        typer.Option(
+            "--harvest-email",
+            "-hem",
+            help="the email address of the harvest user the sync would be for",
+        ),
+    ] = None,
+    days: Annotated[
+        int | None,
+        typer.Option(
+            "--days",
+            "-d",
+            click_type=mutual_date_option,
+            help="""integer # of days in the past, from today, to estimate a sync for
+            NOTE: This argument is mutually exclusive with arguments: [daterange, datebound].
+            """,
+        ),
+    ] = None,
+    daterange: Annotated[
+        tuple[str, str] | None,
+        typer.Option(
+            "--daterange",
+            "-dr",
+            click_type=mutual_date_option,
+            help="""Two dates bounding inclusively the dates to estimate a sync for.
+            NOTE: This argument is mutually exclusive with arguments: [days, datebound].
+            """,
+        ),
+    ] = None,
+    datebound: Annotated[
+        str | None,
+        typer.Option(
+            "--datebound",
+            "-db",
+            click_type=mutual_date_option,
+            help="""A date in the past from which to estimate a sync.
+            NOTE: This argument is mutually exclusive with arguments: [days, daterange].
+            """,
+        ),
+    ] = None,
+    cache_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location to look for toggl and harvest credentials",
+        ),
+    ] = pathlib.Path(".creds"),
+    profile: Annotated[
+        str,
+        typer.Option("--profile", "-p", help="Name of the stored credentials to use"),
+    ] = DEFAULT_PROFILE,
+):
+    """Estimate the requests, bytes and time a sync would take, without syncing."""
+    start_date, end_date = parse_date_range(
+        days, (daterange and list(daterange)) or (datebound and [datebound]) or None
+    )
+    creds = ConfirmedCredentials.from_creds(CredentialStore(cache_file).get(profile))
+    harvest = Harvest(creds.harvest_account_id, creds.harvest_key)
+
+    with TogglSession(toggl_auth_.TokenAuth(creds.toggl_key)) as toggl:
+        harvest_user_id = resolve_harvest_user_id(
+            harvest.get_users(), harvest_email or prompt_harvest_email
+        )
+        print_sync_plan(toggl, harvest, start_date, end_date, harvest_user_id)
+
+
+@app.command()
+def org(
+    days: Annotated[
+        int | None,
+        typer.Option(
+            "--days",
+            "-d",
+            click_type=mutual_date_option,
+            help="""integer # of days in the past, from today, to sync for
+            NOTE: This argument is mutually exclusive with arguments: [daterange, datebound].
+            """,
+        ),
+    ] = None,
+    daterange: Annotated[
+        tuple[str, str] | None,
+        typer.Option(
+            "--daterange",
+            "-dr",
+            click_type=mutual_date_option,
+            help="""Two dates bounding inclusively the dates to sync for, separated by a space.
+            NOTE: This argument is mutually exclusive with arguments: [days, datebound].
+            """,
+        ),
+    ] = None,
+    datebound: Annotated[
+        str | None,
+        typer.Option(
+            "--datebound",
+            "-db",
+            click_type=mutual_date_option,
+            help="""A date in the past from which to include time entries.
+            NOTE: This argument is mutually exclusive with arguments: [days, daterange].
+            """,
+        ),
+    ] = None,
+    user_map: Annotated[
+        pathlib.Path | None,
+        typer.Option(
+            help="""A json object mapping toggl emails (or user ids) to the harvest
+            emails of the same people, for anyone whose emails differ.""",
+        ),
+    ] = None,
+    cache_file: Annotated[
+        pathlib.Path,
+        typer.Option(
+            help="Location to look for toggl and harvest credentials",
+        ),
+    ] = pathlib.Path(".creds"),
+    profile: Annotated[
+        str,
+        typer.Option("--profile", "-p", help="Name of the stored credentials to use"),
+    ] = DEFAULT_PROFILE,
+):
+    """Sync everyone in the workspace at once, using admin credentials.
+
+    Toggl reports are fetched once for the whole workspace and split by user,
+    then each user's entries are added to their own harvest timesheet.
+    """
+    start_date, end_date = parse_date_range(
+        days, (daterange and list(daterange)) or (datebound and [datebound]) or None
+    )
+    creds = ConfirmedCredentials.from_creds(CredentialStore(cache_file).get(profile))
+    mapping = json.loads(user_map.read_text()) if user_map is not None else {}
+
+    with SyncSession.from_credentials(creds) as session:
+        org_plan = session.plan_org(
+            start_date, end_date, task_association_config, mapping
+        )
+        if org_plan.unmapped:
+            print(
+                "No harvest user found for these toggl users, skipping them: {}".format(
+                    ", ".join(org_plan.unmapped)
+                )
+            )
+
+        rows = [
+            {"email": email, **entry}
+            for email, plan in org_plan.plans.items()
+            for entry in plan.entries
+        ]
+        if not rows:
+            print("nothing to add")
+            return
+
+        print("The following Toggl entries will be added to Harvest:")
+        print(tabulate(rows, headers="keys"))
+        if input("""Add the entries noted above to harvest? (y/n)""").lower() not in (
+            "y",
+            "yes",
+        ):
+            print("aborted")
+            exit(1)
+
+        for email, plan in org_plan.plans.items():
+            result = session.apply(plan, confirm=True)
+            print("{}: added {} entries".format(email, len(result.posted)))
+
+
+# how much a toggl description matching a harvest task's name counts for,
+# next to the toggl client, project and description matching its project's
+SUGGESTION_TASK_WEIGHT = 0.5
+# the least similarity for a suggestion to make it into the pre-filled formula
+SUGGESTION_MIN_SCORE = 0.3
+# how much of their trigrams two words must share to count as the same word
+SUGGESTION_MIN_WORD_SIMILARITY = 0.3
+# how many of the likeliest projects have their tasks scored, however few
+# suggestions are asked for
+SUGGESTION_PROJECTS = 3
+
+
+def name_words(text: str) -> set[str]:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def word_trigrams(word: str) -> set[str]:
+    """The character trigrams of a word padded with spaces."""
+    padded = " {} ".format(word)
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class NgramIndex:
+    """An inverted index of names by their words, and of the words by trigrams.
+
+    A query's words match the indexed words that share enough of their
+    trigrams, so typos and abbreviations still count. Names are ranked by the
+    cosine similarity of their words to those matches, rarer words weighing
+    more.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names = list(names)
+        self.postings: dict[str, list[int]] = {}
+        words = [name_words(name) for name in self.names]
+        for i, name_word_set in enumerate(words):
+            for word in name_word_set:
+                self.postings.setdefault(word, []).append(i)
+
+        self.trigrams: dict[str, list[str]] = {}
+        self.trigram_counts: dict[str, int] = {}
+        for word in self.postings:
+            trigrams = word_trigrams(word)
+            self.trigram_counts[word] = len(trigrams)
+            for trigram in trigrams:
+                self.trigrams.setdefault(trigram, []).append(word)
+
+        count = len(self.names)
+        self.weights = {
+            word: math.log(1 + count / len(ids)) for word, ids in self.postings.items()
+        }
+        # what a word no name has weighs against the query
+        self.unknown_weight = math.log(1 + count)
+        self.norms = [
+            math.sqrt(sum(self.weights[word] ** 2 for word in name_word_set)) or 1.0
+            for name_word_set in words
         ]
+
+    def similar_words(self, word: str) -> dict[str, float]:
+        """Indexed words like `word`, by the dice coefficient of their trigrams."""
+        if word in self.postings:
+            return {word: 1.0}
+
+        trigrams = word_trigrams(word)
+        shared: dict[str, int] = {}
+        for trigram in trigrams:
+            for other in self.trigrams.get(trigram, ()):
+                shared[other] = shared.get(other, 0) + 1
+        similar = {}
+        for other, count in shared.items():
+            similarity = 2 * count / (len(trigrams) + self.trigram_counts[other])
+            if similarity >= SUGGESTION_MIN_WORD_SIMILARITY:
+                similar[other] = similarity
+        return similar
+
+    def query(self, text: str) -> dict[int, float]:
+        """Similarities above zero of the names to `text`, by name index."""
+        scores: dict[int, float] = {}
+        query_norm = 0.0
+        for word in name_words(text):
+            similar = self.similar_words(word)
+            if not similar:
+                query_norm += self.unknown_weight**2
+                continue
+            query_norm += max(self.weights[w] * s for w, s in similar.items()) ** 2
+            for other, similarity in similar.items():
+                weight = self.weights[other] ** 2 * similarity
+                for i in self.postings[other]:
+                    scores[i] = scores.get(i, 0.0) + weight
+
+        query_norm = math.sqrt(query_norm) or 1.0
+        return {
+            i: min(1.0, score / (query_norm * self.norms[i]))
+            for i, score in scores.items()
+        }
+
+
+class AssociationSuggester:
+    """Ranks harvest task assignments by how much their names look like a toggl task's.
+
+    Toggl clients, projects and descriptions are matched against harvest
+    clients and projects, and descriptions against harvest task names too. Each
+    distinct project and task name is indexed once, however many assignments
+    share it.
+    """
+
+    def __init__(self, harvest_tasks: list[dict[str, Any]]):
+        projects: dict[str, int] = {}
+        tasks: dict[str, int] = {}
+        # harvest task #s by project, and the task name of each
+        self.project_assignments: list[list[int]] = []
+        self.assignment_tasks: list[int] = []
+        for i, assignment in enumerate(harvest_tasks):
+            project = "{} {}".format(
+                assignment["client"]["name"] or "", assignment["project"]["name"]
+            )
+            if project not in projects:
+                projects[project] = len(projects)
+                self.project_assignments.append([])
+            self.project_assignments[projects[project]].append(i)
+            self.assignment_tasks.append(
+                tasks.setdefault(assignment["task"]["name"], len(tasks))
+            )
+
+        self.projects = NgramIndex(projects)
+        self.tasks = NgramIndex(tasks)
+
+    def suggest(
+        self, toggl_task: dict[str, Any], k: int = 3
+    ) -> list[tuple[int, float]]:
+        """The `k` likeliest (harvest task #, similarity) for a toggl task row."""
+        project_scores = self.projects.query(
+            "{} {} {}".format(
+                toggl_task["client"] or "",
+                toggl_task["project"] or "",
+                toggl_task["description"],
+            )
+        )
+        task_scores = self.tasks.query(toggl_task["description"])
+        candidates = (
+            (
+                i,
+                (
+                    project_score
+                    + SUGGESTION_TASK_WEIGHT
+                    * task_scores.get(self.assignment_tasks[i], 0.0)
+                )
+                / (1 + SUGGESTION_TASK_WEIGHT),
+            )
+            # only the likeliest projects' tasks are worth scoring
+            for project, project_score in heapq.nlargest(
+                SUGGESTION_PROJECTS, project_scores.items(), key=lambda item: item[1]
+            )
+            for i in self.project_assignments[project]
+        )
+        return heapq.nlargest(k, candidates, key=lambda item: item[1])
+
+
+def suggested_association_formula(
+    toggl_tasks: list[dict[str, Any]],
+    suggestions: list[list[tuple[int, float]]],
+    min_score: float = SUGGESTION_MIN_SCORE,
+) -> str:
+    """An association formula sending each toggl task to its best suggestion."""
+    groups: dict[int, list[int]] = {}
+    for task, task_suggestions in zip(toggl_tasks, suggestions):
+        if task_suggestions and task_suggestions[0][1] >= min_score:
+            groups.setdefault(task_suggestions[0][0], []).append(task["id"])
+
+    return "|".join(
+        "{}>{}".format(",".join(str(i) for i in toggl_ids), harvest_id)
+        for harvest_id, toggl_ids in sorted(groups.items(), key=lambda g: g[1][0])
+    )
+
+
+def suggest_task_association(toggl_tasks, harvest_tasks) -> TaskAssociation:
+    """The suggested association, for syncs nobody is around to confirm."""
+    suggester = AssociationSuggester(harvest_tasks)
+    formula = suggested_association_formula(
+        toggl_tasks, [suggester.suggest(task, 1) for task in toggl_tasks]
+    )
+    return build_task_association(
+        toggl_tasks,
+        harvest_tasks,
+        parse_task_association(formula, len(toggl_tasks), len(harvest_tasks)),
+    )
+
+
+def presentation_table(toggl_tasks, harvest_tasks):
+    presentation_header = [
+        "Toggl #",
+        "Toggl Client",
+        "Toggl Project",
+        "Toggl Task Desc.",
+        "Harvest #",
+        "Harvest Client",
+        "Harvest Project",
+        "Harvest Task",
+    ]
+    presentation_table = []
+    while True:
+        idx = len(presentation_table)
+        if (idx < len(toggl_tasks)) and (
+            idx < len(harvest_tasks)
+        ):  # add both details to table
+            line = [
+                toggl_tasks[idx]["id"],
+                textwrap.shorten(toggl_tasks[idx]["client"] or "", width=20),
+                textwrap.shorten(toggl_tasks[idx]["project"] or "", width=20),
+                toggl_tasks[idx]["description"],
+                idx,
+                textwrap.shorten(harvest_tasks[idx]["client"]["name"] or "", width=20),
+                harvest_tasks[idx]["project"]["name"],
+                harvest_tasks[idx]["task"]["name"],
+            ]
+        elif idx < len(toggl_tasks):  # add toggl detail only to table
+            line = [
+                toggl_tasks[idx]["id"],
+                textwrap.shorten(toggl_tasks[idx]["client"] or "", width=20),
+                textwrap.shorten(toggl_tasks[idx]["project"] or "", width=20),
+                toggl_tasks[idx]["description"],
+                None,
+                None,
+                None,
+                None,
+            ]
+        elif idx < len(harvest_tasks):  # add harvest detail only to table
+            line = [
+                None,
+                None,
+                None,
+                None,
+                idx,
+                textwrap.shorten(harvest_tasks[idx]["client"]["name"] or "", width=20),
+                harvest_tasks[idx]["project"]["name"],
+                harvest_tasks[idx]["task"]["name"],
+            ]
+        else:
+            break
+        presentation_table.append(line)
+
+    return presentation_table, presentation_header
+
+
+class AssociationFormulaError(ValueError):
+    def __init__(self, message: str, formula: str, position: int):
+        self.formula = formula
+        self.position = position
+        # scripted formulas can be very long, only show what's around the error
+        start = max(position - 30, 0)
+        snippet = formula[start : position + 30]
+        super().__init__(
+            "{} at position {}:\n    {}\n    {}^".format(
+                message, position, snippet, " " * (position - start)
+            )
+        )
+
+
+def tokenize_task_association(formula: str):
+    """Yield (kind, value, position) tokens of an association formula."""
+    position = 0
+    while position < len(formula):
+        char = formula[position]
+        if char.isspace():
+            position += 1
+        elif char.isdigit():
+            start = position
+            while position < len(formula) and formula[position].isdigit():
+                position += 1
+            yield "id", int(formula[start:position]), start
+        elif char in ":-":
+            yield "range", char, position
+            position += 1
+        elif char in ",>|":
+            yield char, char, position
+            position += 1
+        else:
+            raise AssociationFormulaError(
+                "Unexpected character {!r}".format(char), formula, position
+            )
+
+    yield "end", None, position
+
+
+def parse_task_association(
+    formula: str, toggl_count: int, harvest_count: int
+) -> list[tuple[list[int], list[int]]]:
+    """Parse `<toggl ids>><harvest ids>|...` into (toggl ids, harvest ids) pairs.
+
+    Runs in a single pass over the formula, and ranges are expanded into ordered,
+    de-duplicated id lists.
+    """
+    tokens = tokenize_task_association(formula)
+    token = next(tokens)
+
+    def advance():
+        nonlocal token
+        current = token
+        token = next(tokens)
+        return current
+
+    def expect(kind: str, what: str):
+        if token[0] != kind:
+            found = "end of input" if token[0] == "end" else repr(token[1])
+            raise AssociationFormulaError(
+                "Expected {}, found {}".format(what, found), formula, token[2]
+            )
+        return advance()
+
+    def parse_ids(count: int, platform: str) -> list[int]:
+        ids: dict[int, None] = {}
+        while True:
+            _, first, first_position = expect("id", "a {} task #".format(platform))
+            last, last_position = first, first_position
+            if token[0] == "range":
+                advance()
+                _, last, last_position = expect("id", "the end of a range")
+                if last < first:
+                    raise AssociationFormulaError(
+                        "Range {}:{} is reversed".format(first, last),
+                        formula,
+                        first_position,
+                    )
+            if last >= count:
+                raise AssociationFormulaError(
+                    "There is no {} task #{}".format(platform, last),
+                    formula,
+                    last_position,
+                )
+            ids.update(dict.fromkeys(range(first, last + 1)))
+
+            if token[0] != ",":
+                return list(ids)
+            advance()
+            if token[0] != "id":  # trailing comma
+                return list(ids)
+
+    groups: list[tuple[list[int], list[int]]] = []
+    while token[0] != "end":
+        toggl_ids = parse_ids(toggl_count, "toggl")
+        expect(">", "'>'")
+        harvest_ids = parse_ids(harvest_count, "harvest")
+        groups.append((toggl_ids, harvest_ids))
+        if token[0] != "end":
+            expect("|", "'|' or the end of the formula")
+
+    return groups
+
+
+def task_association_config(toggl_tasks, harvest_tasks):
+    print("""The following are two tables, one showing the tasks across your Toggl account, and the other showing
+tasks across your Harvest account.""")
+    print(tabulate(*presentation_table(toggl_tasks, harvest_tasks), tablefmt="grid"))
+
+    help_msg = """You'll need to enter which Toggl tasks you'd like to associate with which Harvest tasks.
+You'll be asked to enter an association formula - the formula should take the following form:
+
+    <task config>|<task config>|..., where each <task config> is formatted as follows:
+    (toggl ids)>(harvest ids), where ids can be comma separated and include :'s to denote lists.
+
+For example:
+User enters: 1:3,5,7>2,3|4,6>1
+Result: Toggl entries in task #s 1,2,3,5 and 7 will be added as Harvest entries in task #s 2 and 3, and
+        Toggl entries in task #s 4 and 6 will be added as Harvest entries in task #1
+User enters: 1-3,5,7>2
+Result: Toggl entires in task #s 1,2,3,5 and 7 will be added as Harvest entries in task #2 only
+
+NOTE: Any task #s not appearing in a task config will be ignored."""
+
+    print(help_msg)
+
+    suggester = AssociationSuggester(harvest_tasks)
+    suggestions = [suggester.suggest(task) for task in toggl_tasks]
+    suggested = suggested_association_formula(toggl_tasks, suggestions)
+    if suggested:
+        print("""The Harvest tasks whose names look most like each Toggl task's -""")
+        print(
+            tabulate(
+                [
+                    [
+                        task["id"],
+                        task["description"],
+                        ", ".join(
+                            "#{} ({:.0%})".format(i, score)
+                            for i, score in task_suggestions
+                        ),
+                    ]
+                    for task, task_suggestions in zip(toggl_tasks, suggestions)
+                ],
+                headers=["Toggl #", "Description", "Harvest #s"],
+                tablefmt="grid",
+            )
+        )
+
+    config_groups = []
+    while True:
+        if suggested and not config_groups:
+            task_config = (
+                input("Enter one or more task configs [{}]:".format(suggested))
+                or suggested
+            )
+        else:
+            task_config = input("Enter one or more task configs:")
+
+        try:
+            groups = parse_task_association(
+                task_config, len(toggl_tasks), len(harvest_tasks)
+            )
+        except AssociationFormulaError as e:
+            print(e)
+            continue
+
+        config_groups += groups
+
+        toggl_used = {i for toggl_ids, _ in config_groups for i in toggl_ids}
+        harvest_used = {i for _, harvest_ids in config_groups for i in harvest_ids}
+        ttasks_ignored = [t for i, t in enumerate(toggl_tasks) if i not in toggl_used]
         htasks_ignored = [
-            t
-            for t in harvest_tasks
-            if t not in [x for grp in config_groups for x in grp["htasks"]]
+            t for i, t in enumerate(harvest_tasks) if i not in harvest_used
         ]
 
         print("""The following are the tasks that will be ignored - """)
@@ -1010,16 +5674,7 @@ NOTE: Any task #s not appearing in a task config will be ignored."""
         if cont.lower() not in ("y", "yes"):
             break
 
-    for config_group in config_groups:
-        for task in config_group["ttasks"]:
-            task_association[task["pid"]][task["description"]][
-                "harvest_project_id"
-            ].append(*[h["project"]["id"] for h in config_group["htasks"]])
-            task_association[task["pid"]][task["description"]][
-                "harvest_task_id"
-            ].append(*[h["task"]["id"] for h in config_group["htasks"]])
-
-    return task_association
+    return build_task_association(toggl_tasks, harvest_tasks, config_groups)
 
 
 if __name__ == "__main__":